@@ -1,14 +1,53 @@
 # ------------------
 #       Meropo
 # ------------------
+import io
 import os
+import atexit
+import copy
+import json
+import time
+import httpx
 import dotenv
 import base64
-from openai import OpenAI
-from gradio_client import Client, handle_file
-from typing import Literal, Optional, Union, Tuple
+import random
+import shutil
+import asyncio
+import logging
+import tempfile
+import weakref
+import functools
+import threading
+import urllib.parse
+import concurrent.futures
+from concurrent.futures import Future
+from dataclasses import dataclass
+from openai import DEFAULT_CONNECTION_LIMITS, APIError, DefaultHttpxClient, OpenAI, Stream, Timeout
+from openai.types.chat import ChatCompletion, ChatCompletionChunk
+from gradio_client import Client, handle_file, __version__ as gradio_client_version
+from gradio_client.client import Job
+from gradio_client import utils as gradio_utils
+from gradio_client.utils import StatusUpdate
+from typing import AsyncIterator, Callable, Iterator, List, Literal, Optional, Union, Tuple
+from cache import AnalysisCache, ResultCache, SchemaCache, file_digest
+from cancel import CancelToken
+from audio import PreparedAudio, decode, prepare_for_analysis
+from features import extract_features
+from memory import ConversationMemory, clip_summary
 dotenv.load_dotenv('.env')
 
+try:
+    import h2  # noqa: F401  enables HTTP/2 in httpx
+except ImportError:  # HTTP/1.1 with keep-alive only
+    h2 = None
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_API_URL = "https://d07261654-acestep10-3024-syc5g9dc-7865.550c.cloud"
+
+# gradio_client releases whose Client keeps the per-event message queues _release_pending_event clears
+PENDING_EVENTS_VERSIONS = ((1, 0), (3, 0))  # [first, last) major.minor
+
 
 def get_desktop_path():
     try:
@@ -20,63 +59,562 @@ def get_desktop_path():
         return os.getcwd()
 
 
+@dataclass
+class BatchResult:
+    """Outcome of one item of a generate_batch run."""
+    index: int
+    seed: str
+    audio_file: Optional[str] = None
+    params: Union[str, float, bool, list, dict, None] = None
+    error: Optional[BaseException] = None
+    started_at: float = 0.0
+    elapsed: float = 0.0
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+@dataclass
+class JobStatus:
+    """Snapshot of a remote job as reported by the Gradio queue."""
+    api_name: str
+    stage: str  # lower-cased gradio Status code, e.g. "in_queue", "processing", "progress"
+    rank: Optional[int] = None
+    queue_size: Optional[int] = None
+    eta: Optional[float] = None
+    step: Optional[int] = None
+    steps: Optional[int] = None
+    progress: Optional[float] = None  # fraction of the current progress bar, 0..1
+    desc: Optional[str] = None
+    elapsed: float = 0.0
+
+    @classmethod
+    def from_update(cls, api_name: str, update: StatusUpdate, elapsed: float) -> "JobStatus":
+        status = cls(api_name=api_name, stage=update.code.name.lower(), rank=update.rank,
+                     queue_size=update.queue_size, eta=update.eta, elapsed=elapsed)
+        if update.progress_data:
+            unit = update.progress_data[-1]
+            status.step, status.steps, status.desc = unit.index, unit.length, unit.desc
+            status.progress = unit.progress
+            if status.progress is None and unit.index is not None and unit.length:
+                status.progress = unit.index / unit.length
+        return status
+
+    def same_as(self, other: Optional["JobStatus"]) -> bool:
+        """Whether other reports the same position and progress (elapsed time aside)."""
+        return other is not None and (self.stage, self.rank, self.queue_size, self.eta, self.step,
+                                      self.steps, self.progress, self.desc) == \
+            (other.stage, other.rank, other.queue_size, other.eta, other.step, other.steps,
+             other.progress, other.desc)
+
+
+StatusCallback = Callable[[JobStatus], None]
+
+
+class AnalysisError(Exception):
+    """An audio analysis could not be run; API failures are raised as the openai exception types."""
+
+
+class AudioFileError(AnalysisError):
+    """The audio file is missing or cannot be used for the requested analysis."""
+
+
+class AnalysisFailedError(AnalysisError):
+    """An unexpected error while preparing or running an analysis; the original error is the __cause__."""
+
+
+def _release_pending_event(client: Client, job: Job):
+    """
+    Wake the local listener of a cancelled job and stop tracking its event.
+
+    The server may never report a cancelled event, so the worker waiting for its
+    messages would otherwise block until the stream closes. This is the only place
+    that touches the Client's private queue state; on gradio_client versions outside
+    PENDING_EVENTS_VERSIONS, or if the attributes are missing, it does nothing.
+    """
+    try:
+        version = tuple(int(part) for part in gradio_client_version.split(".")[:2])
+    except ValueError:
+        return
+    if not PENDING_EVENTS_VERSIONS[0] <= version < PENDING_EVENTS_VERSIONS[1]:
+        return
+    event_id = getattr(job.communicator, "event_id", None)
+    pending = getattr(client, "pending_messages_per_event", None)
+    lock = getattr(client, "pending_lock", None)
+    if event_id is None or pending is None or lock is None:
+        return
+    with lock:
+        messages = pending.pop(event_id, None)
+        getattr(client, "pending_event_ids", set()).discard(event_id)
+    if messages is not None:
+        messages.append(None)
+
+
+def _poll_timeout(start: float, timeout: Optional[float], interval: Optional[float]) -> Optional[float]:
+    """How long to block before the next status poll or the deadline, whichever comes first."""
+    if timeout is None:
+        return interval
+    remaining = max(0.0, timeout - (time.perf_counter() - start))
+    return remaining if interval is None else min(remaining, interval)
+
+
+_FILE_TOKEN = "\ue000meropo-file\ue000"
+
+
+class _Base64File:
+    """Placeholder for the base64 text of a local file inside a _StreamingJSONBody payload."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.size = os.path.getsize(path)
+
+    @property
+    def encoded_size(self) -> int:
+        return (self.size + 2) // 3 * 4
+
+
+class _StreamingJSONBody(io.RawIOBase):
+    """
+    Seekable JSON request body that base64-encodes its _Base64File parts from disk while it is read.
+
+    Only the chunk being read is held in memory, whatever the file size, and the exact
+    length is known up front, so the body is sent with a Content-Length and can be
+    rewound for a retry.
+    """
+
+    def __init__(self, payload):
+        super().__init__()
+        files = []
+
+        def placeholder(value):
+            if not isinstance(value, _Base64File):
+                raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+            files.append(value)
+            return _FILE_TOKEN
+
+        texts = json.dumps(payload, ensure_ascii=False, default=placeholder).split(_FILE_TOKEN)
+        self.files = files
+        self._segments = []  # (start, length, bytes or _Base64File)
+        start = 0
+        for i, text in enumerate(texts):
+            for part in ([text.encode('utf-8'), files[i]] if i < len(files) else [text.encode('utf-8')]):
+                length = part.encoded_size if isinstance(part, _Base64File) else len(part)
+                self._segments.append((start, length, part))
+                start += length
+        self._length = start
+        self._position = 0
+        self._handles = {}
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._position
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self._position, io.SEEK_END: self._length}[whence]
+        self._position = max(0, base + offset)
+        return self._position
+
+    def readinto(self, buffer) -> int:
+        for start, length, part in self._segments:
+            if start <= self._position < start + length:
+                break
+        else:
+            return 0
+        offset = self._position - start
+        n = min(len(buffer), length - offset)
+        if isinstance(part, _Base64File):
+            # base64 maps every 3 input bytes to 4 characters, so start at the enclosing group
+            handle = self._handles.get(part.path)
+            if handle is None:
+                handle = self._handles[part.path] = open(part.path, 'rb')
+            skip = offset % 4
+            handle.seek(offset // 4 * 3)
+            data = base64.b64encode(handle.read((skip + n + 3) // 4 * 3))[skip:skip + n]
+        else:
+            data = part[offset:offset + n]
+        buffer[:len(data)] = data
+        self._position += len(data)
+        return len(data)
+
+    def close(self):
+        for handle in self._handles.values():
+            handle.close()
+        self._handles.clear()
+        super().close()
+
+
+def _batch_seeds(seeds: Optional[List[Union[int, str]]], n: Optional[int]) -> List[str]:
+    if seeds is not None:
+        return [str(seed) for seed in seeds]
+    if n is None:
+        raise ValueError("generate_batch needs either seeds or n")
+    return [str(random.randrange(2 ** 31)) for _ in range(n)]
+
+
+class _CachedSchemaClient(Client):
+    """gradio Client that boots from a cached app config and API info instead of fetching them."""
+
+    def __init__(self, src: str, schema: dict, **kwargs):
+        self._schema = schema
+        super().__init__(src, **kwargs)
+
+    def _get_config(self) -> dict:
+        return copy.deepcopy(self._schema["config"])
+
+    def _get_api_info(self):
+        return copy.deepcopy(self._schema["info"])
+
+
 class MusicAPI:
-    def __init__(self, api_url: str = "https://d07261654-acestep10-3024-syc5g9dc-7865.550c.cloud"):
+    def __init__(self, api_url: str = DEFAULT_API_URL, connect_timeout: Optional[float] = None,
+                 cache_schema: bool = True, cache_results: bool = True, result_cache_bytes: int = 2 * 1024 ** 3,
+                 status_interval: float = 0.5, download_files: bool = True):
         """
         Initialize the MusicAPI client.
 
+        The Gradio handshake runs on a background thread, so construction returns
+        immediately and the first remote call waits for the connection instead.
+        With a cached schema the client is built without any round-trip and a full
+        handshake revalidates the schema in the background.
+
         Args:
             api_url: The base URL of the API endpoint
+            connect_timeout: Seconds a remote call waits for the connection (None waits forever)
+            cache_schema: Whether to persist and reuse the endpoint schema across runs
+            cache_results: Whether to cache the audio of seeded (deterministic) generations on disk
+            result_cache_bytes: Size cap of the result cache, least recently used entries are evicted
+            status_interval: Seconds between job status polls for calls given an on_status callback
+            download_files: Whether audio results are downloaded; when False the endpoints return the
+                FileData dict of the server-side file instead of a local path (see download)
         """
-        self.client = Client(api_url)
+        self.api_url = api_url
+        self.download_files = download_files
+        self.connect_timeout = connect_timeout
+        self.status_interval = status_interval
+        self.schema_cache = SchemaCache() if cache_schema else None
+        self.result_cache = ResultCache(max_bytes=result_cache_bytes) if cache_results else None
+        self._lock = threading.Lock()
+        self._connection: Optional[Future] = None
+        self._state_callbacks = []
+        self._uploads = {}  # content hash -> FileData of the copy uploaded to this endpoint
+        self._upload_locks = {}
+        self.connect()
 
-    def toggle_ref_audio_visibilitity(self, is_checked=False) -> tuple[str, float]:
+    def connect(self) -> Future:
+        """
+        Start the background handshake unless one is pending or has succeeded.
+
+        A failed handshake is retried on the next call.
+
+        Returns:
+            Future resolving to the connected gradio Client
+        """
+        with self._lock:
+            connection = self._connection
+            if connection is not None and not (connection.done() and connection.exception() is not None):
+                return connection
+            connection = self._connection = Future()
+        self._notify_state("connecting")
+        threading.Thread(target=self._connect, args=(connection,), daemon=True).start()
+        return connection
+
+    def _connect(self, connection: Future):
+        schema = self.schema_cache.get(self.api_url) if self.schema_cache is not None else None
+        client = None
+        if schema is not None:
+            try:
+                client = self._dedupe_uploads(_CachedSchemaClient(self.api_url, schema, **self._client_kwargs()))
+            except Exception:
+                schema = None  # unusable cache entry, fall back to a full handshake
+        try:
+            if client is None:
+                client = self._handshake()
+        except BaseException as e:
+            connection.set_exception(e)
+        else:
+            connection.set_result(client)
+        self._notify_state(self.state)
+        if client is not None and schema is not None:
+            self._revalidate_schema(connection, schema)
+
+    def _handshake(self) -> Client:
+        client = self._dedupe_uploads(Client(self.api_url, **self._client_kwargs()))
+        if self.schema_cache is not None:
+            self.schema_cache.put(self.api_url, client.config, client._info)
+        return client
+
+    def _client_kwargs(self) -> dict:
+        return {} if self.download_files else {"download_files": False}
+
+    def _revalidate_schema(self, connection: Future, schema: dict):
+        """Run a full handshake and swap in the fresh client if the remote schema changed."""
+        try:
+            fresh = self._handshake()
+        except Exception:
+            return  # keep the cached client; a dead endpoint surfaces on the next call
+        if self.schema_cache.digest(fresh.config, fresh._info) == schema["digest"]:
+            fresh.close()
+            return
+        with self._lock:
+            swapped = self._connection is connection
+            if swapped:
+                self._connection = Future()
+                self._connection.set_result(fresh)
+        # stop the heartbeat of whichever client is no longer used; jobs already
+        # submitted through the old one keep their own streams
+        (connection.result() if swapped else fresh).close()
+
+    def _dedupe_uploads(self, client: Client) -> Client:
+        """Route the file uploads of every endpoint of client through _upload_file."""
+        for endpoint in client.endpoints.values():
+            if hasattr(endpoint, "_upload_file"):
+                endpoint._upload_file = functools.partial(self._upload_file, client, endpoint._upload_file)
+        return client
+
+    def _upload_file(self, client: Client, upload: Callable, f: dict, data_index: int) -> dict:
+        """
+        Upload a local file once per endpoint and content, reusing the server-side copy afterwards.
+
+        A remembered copy is checked before reuse and uploaded again if the server
+        has expired it.
+
+        Args:
+            client: Client the upload goes to
+            upload: The endpoint's own upload function
+            f: FileData dict of the local file
+            data_index: Index of the input the file belongs to
+
+        Returns:
+            FileData dict referring to the server-side copy
+        """
+        path = f["path"]
+        if gradio_utils.is_http_url_like(path) or not os.path.isfile(path):
+            return upload(f, data_index)
+        digest = file_digest(path)
+        with self._lock:
+            lock = self._upload_locks.setdefault(digest, threading.Lock())
+        with lock:
+            remote = self._uploads.get(digest)
+            if remote is None or not self._remote_file_exists(client, remote["path"]):
+                remote = self._uploads[digest] = upload(f, data_index)
+        return dict(remote)
+
+    @staticmethod
+    def _remote_file_exists(client: Client, path: str) -> bool:
+        url = urllib.parse.urljoin(client.src_prefixed, "file=" + gradio_utils.encode_file_path(path))
+        try:
+            with httpx.stream("GET", url, headers=client.headers, cookies=client.cookies, verify=client.ssl_verify,
+                              follow_redirects=True, **client.httpx_kwargs) as response:
+                return response.status_code == 200
+        except httpx.HTTPError:
+            return False
+
+    def download(self, file: Union[str, dict], path: Optional[str] = None) -> str:
+        """
+        Download an audio result returned while download_files is False (local files are copied).
+
+        Args:
+            file: FileData dict (or server-side path) returned by an endpoint
+            path: Local destination; defaults to a new file in the temporary directory
+
+        Returns:
+            Path of the downloaded file
+        """
+        if isinstance(file, str) and os.path.isfile(file):
+            # already local (downloaded by the client)
+            return file if path is None else shutil.copyfile(file, path)
+        remote_path = file["path"] if isinstance(file, dict) else file
+        if path is None:
+            path = os.path.join(tempfile.mkdtemp(prefix="meropo_"), os.path.basename(remote_path) or "audio")
+        partial = path + ".part"
+        with open(partial, 'wb') as f:
+            for chunk in self.iter_file(file):
+                f.write(chunk)
+        os.replace(partial, path)
+        return path
+
+    def iter_file(self, file: Union[str, dict], chunk_size: int = 1024 * 1024) -> Iterator[bytes]:
+        """
+        Stream the content of a server-side file, e.g. straight into its final location.
+
+        Args:
+            file: FileData dict (or server-side path) returned by an endpoint
+            chunk_size: Bytes per yielded chunk
+
+        Returns:
+            Iterator of content chunks
+        """
+        client = self.client
+        remote_path = file["path"] if isinstance(file, dict) else file
+        url = urllib.parse.urljoin(client.src_prefixed, "file=" + gradio_utils.encode_file_path(remote_path))
+        with httpx.stream("GET", url, headers=client.headers, cookies=client.cookies, verify=client.ssl_verify,
+                          follow_redirects=True, **client.httpx_kwargs) as response:
+            response.raise_for_status()
+            yield from response.iter_bytes(chunk_size)
+
+    def _notify_state(self, state: str):
+        for callback in list(self._state_callbacks):
+            callback(state)
+
+    @property
+    def state(self) -> Literal['connecting', 'ready', 'failed']:
+        """Connection state of the current handshake."""
+        connection = self._connection
+        if connection is None or not connection.done():
+            return "connecting"
+        return "failed" if connection.exception() is not None else "ready"
+
+    @property
+    def connection_error(self) -> Optional[BaseException]:
+        """The exception of the last failed handshake, if any."""
+        connection = self._connection
+        if connection is not None and connection.done():
+            return connection.exception()
+        return None
+
+    def add_state_callback(self, callback: Callable[[str], None]):
+        """
+        Register a callback invoked with "connecting", "ready" or "failed" on every state change.
+
+        The callback is called once right away with the current state. It runs on the
+        connecting thread, so GUI code must marshal it onto its own loop.
+
+        Args:
+            callback: Function receiving the new state
+        """
+        self._state_callbacks.append(callback)
+        callback(self.state)
+
+    @property
+    def client(self) -> Client:
+        """The connected gradio Client, waiting for the handshake if it is still running."""
+        return self.connect().result(timeout=self.connect_timeout)
+
+    def _submit(self, *, api_name: str, **kwargs) -> Job:
+        return self.client.submit(api_name=api_name, **kwargs)
+
+    def _call(self, *, api_name: str, on_status: Optional[StatusCallback] = None, timeout: Optional[float] = None,
+              cancel_token: Optional[CancelToken] = None, **kwargs):
+        """Run an endpoint and return its outputs; every endpoint method goes through here."""
+        if cancel_token is not None:
+            cancel_token.raise_if_cancelled()
+        job = self._submit(api_name=api_name, **kwargs)
+        waiting = [job.future] if cancel_token is None else [job.future, cancel_token._future]
+        start = time.perf_counter()
+        last = None
+        while True:
+            wait = _poll_timeout(start, timeout, self.status_interval if on_status is not None else None)
+            concurrent.futures.wait(waiting, timeout=wait, return_when=concurrent.futures.FIRST_COMPLETED)
+            if job.future.done():
+                return self._job_result(job)
+            self._check_deadline(job, api_name, start, timeout, cancel_token)
+            if on_status is not None:
+                status = JobStatus.from_update(api_name, job.status(), time.perf_counter() - start)
+                if not status.same_as(last):
+                    on_status(status)
+                    last = status
+
+    def _check_deadline(self, job: Job, api_name: str, start: float, timeout: Optional[float],
+                        cancel_token: Optional[CancelToken]):
+        """Cancel an unfinished job whose token was cancelled or whose deadline passed, and raise."""
+        if cancel_token is not None and cancel_token.cancelled:
+            self._cancel_job(job)
+            raise concurrent.futures.CancelledError(f"{api_name} was cancelled")
+        if timeout is not None and time.perf_counter() - start >= timeout:
+            self._cancel_job(job)
+            raise TimeoutError(f"{api_name} did not finish within {timeout} seconds")
+
+    def _cancel_job(self, job: Job):
+        """Cancel a job on the server and release the local worker still waiting for its messages."""
+        job.cancel()
+        _release_pending_event(self.client, job)
+
+    def _job_result(self, job: Job):
+        """Outputs of a finished job, raising its exception if it failed."""
+        return job.result()
+
+    def toggle_ref_audio_visibilitity(self, is_checked=False, on_status: Optional[StatusCallback] = None,
+                                      timeout: Optional[float] = None, cancel_token: Optional[CancelToken] = None) -> tuple[str, float]:
         """
         :param is_checked: The input value that is provided in the "Preset" Dropdown component.
+        :param on_status: Called with a JobStatus whenever the job's queue position or progress changes.
+        :param timeout: Seconds the remote job may take before it is cancelled and TimeoutError is raised.
+        :param cancel_token: Token whose cancel() stops the remote job and raises CancelledError.
         :return: (filepath, float) -> ("Reference Audio (for Audio2Audio)", "Refer audio strength")
         """
-        return self.client.predict(
+        return self._call(
             is_checked=is_checked,
+            on_status=on_status,
+            timeout=timeout,
+            cancel_token=cancel_token,
             api_name="/toggle_ref_audio_visibility"
         )
 
     def update_tags_from_preset(self, preset_name: Literal[
-        'Custom', 'Modern Pop', 'Rock', 'Hip Hop', 'Country', 'EDM', 'Reggae', 'Classical', 'Jazz', 'Metal', 'R&B'] = "Custom") -> str:
+        'Custom', 'Modern Pop', 'Rock', 'Hip Hop', 'Country', 'EDM', 'Reggae', 'Classical', 'Jazz', 'Metal', 'R&B'] = "Custom",
+            on_status: Optional[StatusCallback] = None, timeout: Optional[float] = None,
+            cancel_token: Optional[CancelToken] = None) -> str:
         """
         :param preset_name: The input value that is provided in the "Preset" Dropdown component.
+        :param on_status: Called with a JobStatus whenever the job's queue position or progress changes.
+        :param timeout: Seconds the remote job may take before it is cancelled and TimeoutError is raised.
+        :param cancel_token: Token whose cancel() stops the remote job and raises CancelledError.
         :return: The output value that appears in the "Tags" Textbox component.
         """
-        return self.client.predict(
+        return self._call(
             preset_name=preset_name,
+            on_status=on_status,
+            timeout=timeout,
+            cancel_token=cancel_token,
             api_name="/update_tags_from_preset"
         )
 
-    def retake_process_func(self, json_data, retake_variance, retake_seeds):
+    def retake_process_func(self, json_data, retake_variance, retake_seeds, on_status: Optional[StatusCallback] = None,
+                            timeout: Optional[float] = None, cancel_token: Optional[CancelToken] = None):
         """
         :param json_data: The input value that is provided in the "Text2Music Parameters" Json component.
         :param retake_variance: The input value that is provided in the "variance" Slider component.
         :param retake_seeds:The input value that is provided in the "retake seeds (default None)" Textbox component.
+        :param on_status: Called with a JobStatus whenever the job's queue position or progress changes.
+        :param timeout: Seconds the remote job may take before it is cancelled and TimeoutError is raised.
+        :param cancel_token: Token whose cancel() stops the remote job and raises CancelledError.
         :return: (filepath, str | float | bool | list | dict) -> ("Retake Generated Audio 1", "Retake Parameters")
         """
-        return self.client.predict(
-            json_data={"foo": "bar"},
-            retake_variance=0.2,
-            retake_seeds="Hello!!",
+        return self._call(
+            json_data=json_data,
+            retake_variance=retake_variance,
+            retake_seeds=retake_seeds,
+            on_status=on_status,
+            timeout=timeout,
+            cancel_token=cancel_token,
             api_name="/retake_process_func"
         )
 
-    def lambda_func(self, x: Literal['text2music', 'last_repaint', 'upload'] = "text2music") -> str:
+    def lambda_func(self, x: Literal['text2music', 'last_repaint', 'upload'] = "text2music", on_status: Optional[StatusCallback] = None,
+                    timeout: Optional[float] = None, cancel_token: Optional[CancelToken] = None) -> str:
         """
         Lambda function for repaint source selection.
 
         Args:
             x: Repaint source selection
+            on_status: Called with a JobStatus whenever the job's queue position or progress changes
+            timeout: Seconds the remote job may take before it is cancelled and TimeoutError is raised
+            cancel_token: Token whose cancel() stops the remote job and raises CancelledError
 
         Returns:
             str: Path to the upload audio file
         """
-        return self.client.predict(
+        return self._call(
             x=x,
+            on_status=on_status,
+            timeout=timeout,
+            cancel_token=cancel_token,
             api_name="/lambda"
         )
 
@@ -106,7 +644,10 @@ class MusicAPI:
             use_erg_diffusion: bool = True,
             oss_steps: str = "Hello!!",
             guidance_scale_text: float = 0,
-            guidance_scale_lyric: float = 0
+            guidance_scale_lyric: float = 0,
+            on_status: Optional[StatusCallback] = None,
+            timeout: Optional[float] = None,
+            cancel_token: Optional[CancelToken] = None
     ) -> Tuple[str, Union[str, float, bool, list, dict]]:
         """
         Process audio repainting.
@@ -137,6 +678,9 @@ class MusicAPI:
             oss_steps: OSS steps value
             guidance_scale_text: Guidance scale for text
             guidance_scale_lyric: Guidance scale for lyrics
+            on_status: Called with a JobStatus whenever the job's queue position or progress changes
+            timeout: Seconds the remote job may take before it is cancelled and TimeoutError is raised
+            cancel_token: Token whose cancel() stops the remote job and raises CancelledError
 
         Returns:
             Tuple containing:
@@ -146,7 +690,7 @@ class MusicAPI:
         if repaint_source_audio_upload:
             repaint_source_audio_upload = handle_file(repaint_source_audio_upload)
 
-        return self.client.predict(
+        return self._call(
             text2music_json_data=text2music_json_data,
             repaint_json_data=repaint_json_data,
             retake_variance=retake_variance,
@@ -172,38 +716,55 @@ class MusicAPI:
             oss_steps=oss_steps,
             guidance_scale_text=guidance_scale_text,
             guidance_scale_lyric=guidance_scale_lyric,
+            on_status=on_status,
+            timeout=timeout,
+            cancel_token=cancel_token,
             api_name="/repaint_process_func"
         )
 
-    def edit_type_change_func(self, edit_type: Literal['only_lyrics', 'remix'] = "only_lyrics") -> Tuple[float, float]:
+    def edit_type_change_func(self, edit_type: Literal['only_lyrics', 'remix'] = "only_lyrics", on_status: Optional[StatusCallback] = None,
+                              timeout: Optional[float] = None, cancel_token: Optional[CancelToken] = None) -> Tuple[float, float]:
         """
         Change edit type and get corresponding min/max values.
 
         Args:
             edit_type: Type of edit to perform
+            on_status: Called with a JobStatus whenever the job's queue position or progress changes
+            timeout: Seconds the remote job may take before it is cancelled and TimeoutError is raised
+            cancel_token: Token whose cancel() stops the remote job and raises CancelledError
 
         Returns:
             Tuple containing:
                 - float: edit_n_min value
                 - float: edit_n_max value
         """
-        return self.client.predict(
+        return self._call(
             edit_type=edit_type,
+            on_status=on_status,
+            timeout=timeout,
+            cancel_token=cancel_token,
             api_name="/edit_type_change_func"
         )
 
-    def lambda_func_1(self, x: Literal['text2music', 'last_edit', 'upload'] = "text2music") -> str:
+    def lambda_func_1(self, x: Literal['text2music', 'last_edit', 'upload'] = "text2music", on_status: Optional[StatusCallback] = None,
+                      timeout: Optional[float] = None, cancel_token: Optional[CancelToken] = None) -> str:
         """
         Lambda function for edit source selection.
 
         Args:
             x: Edit source selection
+            on_status: Called with a JobStatus whenever the job's queue position or progress changes
+            timeout: Seconds the remote job may take before it is cancelled and TimeoutError is raised
+            cancel_token: Token whose cancel() stops the remote job and raises CancelledError
 
         Returns:
             str: Path to the upload audio file
         """
-        return self.client.predict(
+        return self._call(
             x=x,
+            on_status=on_status,
+            timeout=timeout,
+            cancel_token=cancel_token,
             api_name="/lambda_1"
         )
 
@@ -234,7 +795,10 @@ class MusicAPI:
             oss_steps: str = "Hello!!",
             guidance_scale_text: float = 0,
             guidance_scale_lyric: float = 0,
-            retake_seeds: str = "Hello!!"
+            retake_seeds: str = "Hello!!",
+            on_status: Optional[StatusCallback] = None,
+            timeout: Optional[float] = None,
+            cancel_token: Optional[CancelToken] = None
     ) -> Tuple[str, Union[str, float, bool, list, dict]]:
         """
         Process audio editing.
@@ -266,6 +830,9 @@ class MusicAPI:
             guidance_scale_text: Guidance scale for text
             guidance_scale_lyric: Guidance scale for lyrics
             retake_seeds: Seeds for retake process
+            on_status: Called with a JobStatus whenever the job's queue position or progress changes
+            timeout: Seconds the remote job may take before it is cancelled and TimeoutError is raised
+            cancel_token: Token whose cancel() stops the remote job and raises CancelledError
 
         Returns:
             Tuple containing:
@@ -275,7 +842,7 @@ class MusicAPI:
         if edit_source_audio_upload:
             edit_source_audio_upload = handle_file(edit_source_audio_upload)
 
-        return self.client.predict(
+        return self._call(
             text2music_json_data=text2music_json_data,
             edit_input_params_json=edit_input_params_json,
             edit_source=edit_source,
@@ -302,21 +869,31 @@ class MusicAPI:
             guidance_scale_text=guidance_scale_text,
             guidance_scale_lyric=guidance_scale_lyric,
             retake_seeds=retake_seeds,
+            on_status=on_status,
+            timeout=timeout,
+            cancel_token=cancel_token,
             api_name="/edit_process_func"
         )
 
-    def lambda_func_2(self, x: Literal['text2music', 'last_extend', 'upload'] = "text2music") -> str:
+    def lambda_func_2(self, x: Literal['text2music', 'last_extend', 'upload'] = "text2music", on_status: Optional[StatusCallback] = None,
+                      timeout: Optional[float] = None, cancel_token: Optional[CancelToken] = None) -> str:
         """
         Lambda function for extend source selection.
 
         Args:
             x: Extend source selection
+            on_status: Called with a JobStatus whenever the job's queue position or progress changes
+            timeout: Seconds the remote job may take before it is cancelled and TimeoutError is raised
+            cancel_token: Token whose cancel() stops the remote job and raises CancelledError
 
         Returns:
             str: Path to the upload audio file
         """
-        return self.client.predict(
+        return self._call(
             x=x,
+            on_status=on_status,
+            timeout=timeout,
+            cancel_token=cancel_token,
             api_name="/lambda_2"
         )
 
@@ -345,7 +922,10 @@ class MusicAPI:
             use_erg_diffusion: bool = True,
             oss_steps: str = "Hello!!",
             guidance_scale_text: float = 0,
-            guidance_scale_lyric: float = 0
+            guidance_scale_lyric: float = 0,
+            on_status: Optional[StatusCallback] = None,
+            timeout: Optional[float] = None,
+            cancel_token: Optional[CancelToken] = None
     ) -> Tuple[str, Union[str, float, bool, list, dict]]:
         """
         Process audio extension.
@@ -375,6 +955,9 @@ class MusicAPI:
             oss_steps: OSS steps value
             guidance_scale_text: Guidance scale for text
             guidance_scale_lyric: Guidance scale for lyrics
+            on_status: Called with a JobStatus whenever the job's queue position or progress changes
+            timeout: Seconds the remote job may take before it is cancelled and TimeoutError is raised
+            cancel_token: Token whose cancel() stops the remote job and raises CancelledError
 
         Returns:
             Tuple containing:
@@ -384,7 +967,7 @@ class MusicAPI:
         if extend_source_audio_upload:
             extend_source_audio_upload = handle_file(extend_source_audio_upload)
 
-        return self.client.predict(
+        return self._call(
             text2music_json_data=text2music_json_data,
             extend_input_params_json=extend_input_params_json,
             extend_seeds=extend_seeds,
@@ -409,10 +992,14 @@ class MusicAPI:
             oss_steps=oss_steps,
             guidance_scale_text=guidance_scale_text,
             guidance_scale_lyric=guidance_scale_lyric,
+            on_status=on_status,
+            timeout=timeout,
+            cancel_token=cancel_token,
             api_name="/extend_process_func"
         )
 
-    def sample_data(self, lora_name_or_path_: Literal['ACE-Step/ACE-Step-v1-chinese-rap-LoRA', 'none'] = "none") -> \
+    def sample_data(self, lora_name_or_path_: Literal['ACE-Step/ACE-Step-v1-chinese-rap-LoRA', 'none'] = "none", on_status: Optional[StatusCallback] = None,
+                    timeout: Optional[float] = None, cancel_token: Optional[CancelToken] = None) -> \
             Tuple[float, str, str, float, float, Literal['euler', 'heun', 'pingpong'], Literal[
                 'cfg', 'apg', 'cfg_star'], float, str, float, float, float, bool, bool, bool, str, float, float, bool, float, str]:
         """
@@ -420,16 +1007,23 @@ class MusicAPI:
 
         Args:
             lora_name_or_path_: LoRA name or path to use
+            on_status: Called with a JobStatus whenever the job's queue position or progress changes
+            timeout: Seconds the remote job may take before it is cancelled and TimeoutError is raised
+            cancel_token: Token whose cancel() stops the remote job and raises CancelledError
 
         Returns:
             Tuple containing various parameters for music generation
         """
-        return self.client.predict(
+        return self._call(
             lora_name_or_path_=lora_name_or_path_,
+            on_status=on_status,
+            timeout=timeout,
+            cancel_token=cancel_token,
             api_name="/sample_data"
         )
 
-    def load_data(self, json_file: str) -> Tuple[
+    def load_data(self, json_file: str, on_status: Optional[StatusCallback] = None,
+                  timeout: Optional[float] = None, cancel_token: Optional[CancelToken] = None) -> Tuple[
         float, str, str, float, float, Literal['euler', 'heun', 'pingpong'], Literal[
             'cfg', 'apg', 'cfg_star'], float, str, float, float, float, bool, bool, bool, str, float, float, bool, float, str]:
         """
@@ -437,12 +1031,18 @@ class MusicAPI:
 
         Args:
             json_file: Path to the JSON file to load
+            on_status: Called with a JobStatus whenever the job's queue position or progress changes
+            timeout: Seconds the remote job may take before it is cancelled and TimeoutError is raised
+            cancel_token: Token whose cancel() stops the remote job and raises CancelledError
 
         Returns:
             Tuple containing various parameters for music generation
         """
-        return self.client.predict(
+        return self._call(
             json_file=json_file,
+            on_status=on_status,
+            timeout=timeout,
+            cancel_token=cancel_token,
             api_name="/load_data"
         )
 
@@ -471,11 +1071,17 @@ class MusicAPI:
             ref_audio_strength: float = 0.5,
             ref_audio_input: Optional[str] = None,
             lora_name_or_path: Literal['ACE-Step/ACE-Step-v1-chinese-rap-LoRA', 'none'] = "none",
-            lora_weight: float = 1
+            lora_weight: float = 1,
+            on_status: Optional[StatusCallback] = None,
+            timeout: Optional[float] = None,
+            cancel_token: Optional[CancelToken] = None
     ) -> Tuple[str, Union[str, float, bool, list, dict]]:
         """
         Generate music from text parameters.
 
+        With fixed manual_seeds the result is served from the on-disk result cache
+        when the same arguments (and reference audio content) were generated before.
+
         Args:
             format: Output audio format
             audio_duration: Duration of audio to generate
@@ -501,16 +1107,16 @@ class MusicAPI:
             ref_audio_input: Path to reference audio file
             lora_name_or_path: LoRA name or path to use
             lora_weight: Weight for LoRA
+            on_status: Called with a JobStatus whenever the job's queue position or progress changes
+            timeout: Seconds the remote job may take before it is cancelled and TimeoutError is raised
+            cancel_token: Token whose cancel() stops the remote job and raises CancelledError
 
         Returns:
             Tuple containing:
                 - filepath: Path to the generated audio file
                 - JSON data of generation parameters
         """
-        if ref_audio_input:
-            ref_audio_input = handle_file(ref_audio_input)
-
-        return self.client.predict(
+        arguments = dict(
             format=format,
             audio_duration=audio_duration,
             prompt=prompt,
@@ -534,61 +1140,549 @@ class MusicAPI:
             ref_audio_strength=ref_audio_strength,
             ref_audio_input=ref_audio_input,
             lora_name_or_path=lora_name_or_path,
-            lora_weight=lora_weight,
-            api_name="/__call__"
+            lora_weight=lora_weight
         )
+        # only seeded generations are deterministic, so only they may be served from the cache
+        cache_key = None
+        if self.result_cache is not None and manual_seeds:
+            cache_key = self.result_cache.key(arguments, self.api_url)
+
+        if ref_audio_input:
+            arguments["ref_audio_input"] = handle_file(ref_audio_input)
+
+        return self._cached_call(cache_key, api_name="/__call__", on_status=on_status, timeout=timeout,
+                                 cancel_token=cancel_token, **arguments)
+
+    def _cached_call(self, cache_key: Optional[str], *, api_name: str, **kwargs):
+        if cache_key is not None:
+            cached = self.result_cache.load(cache_key)
+            if cached is not None:
+                return cached
+        result = self._call(api_name=api_name, **kwargs)
+        if cache_key is not None:
+            result = self._cache_result(cache_key, result)
+        return result
+
+    def _cache_result(self, cache_key: str, result):
+        """Store a result in the result cache; audio left on the server is fetched into it once."""
+        audio, params = result
+        if not isinstance(audio, dict):
+            self.result_cache.store(cache_key, audio, params)
+            return result
+        self.result_cache.store_stream(cache_key, self.iter_file(audio), os.path.splitext(audio["path"])[1], params)
+        # hand out the cached copy, so the caller does not download the same file again
+        return self.result_cache.load(cache_key) or result
+
+    def generate_batch(
+            self,
+            params: Optional[dict] = None,
+            seeds: Optional[List[Union[int, str]]] = None,
+            n: Optional[int] = None,
+            max_in_flight: int = 4
+    ) -> Iterator[BatchResult]:
+        """
+        Generate several takes of the same parameters, one per seed.
+
+        Items run concurrently, at most max_in_flight at a time, and are yielded in
+        completion order. A failing item is reported in its BatchResult and does not
+        stop the others.
+
+        Args:
+            params: Keyword arguments for generate_music (manual_seeds is overridden); a
+                timeout or cancel_token given here applies to every item
+            seeds: Seeds to sweep, one generation per seed
+            n: Number of random seeds to draw when seeds is not given
+            max_in_flight: Maximum number of generations running at once
+
+        Returns:
+            Iterator of BatchResult in completion order
+        """
+        seeds = _batch_seeds(seeds, n)
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_in_flight)
+        try:
+            futures = [executor.submit(self._generate_batch_item, params or {}, index, seed)
+                       for index, seed in enumerate(seeds)]
+            for future in concurrent.futures.as_completed(futures):
+                yield future.result()
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def _generate_batch_item(self, params: dict, index: int, seed: str) -> BatchResult:
+        result = BatchResult(index=index, seed=seed, started_at=time.time())
+        start = time.perf_counter()
+        try:
+            result.audio_file, result.params = self.generate_music(**{**params, "manual_seeds": seed})
+        except Exception as e:
+            result.error = e
+        result.elapsed = time.perf_counter() - start
+        return result
+
+
+class AsyncMusicAPI(MusicAPI):
+    def __init__(self, api_url: str = DEFAULT_API_URL, max_concurrency: int = 16, **kwargs):
+        """
+        Asyncio flavour of MusicAPI.
+
+        Every endpoint method keeps the MusicAPI signature but returns an awaitable.
+        Calls are submitted as gradio Jobs, so a pending generation holds no thread
+        of its own, and at most max_concurrency jobs are in flight per event loop.
+        Cancelling the awaiting task cancels the remote job as well.
+
+        Callers without an event loop (tkinter, plain scripts) can use run_threadsafe.
+
+        Args:
+            api_url: The base URL of the API endpoint
+            max_concurrency: Maximum number of jobs in flight at once
+            **kwargs: Passed on to MusicAPI
+        """
+        super().__init__(api_url, **kwargs)
+        self.max_concurrency = max_concurrency
+        self._semaphores = weakref.WeakKeyDictionary()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def _semaphore(self) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        semaphore = self._semaphores.get(loop)
+        if semaphore is None:
+            semaphore = self._semaphores[loop] = asyncio.Semaphore(self.max_concurrency)
+        return semaphore
+
+    async def wait_connected(self) -> Client:
+        """Wait for the background handshake without blocking the event loop."""
+        connection = asyncio.wrap_future(self.connect())
+        # shield: a cancelled caller must not cancel the handshake shared by all callers
+        return await asyncio.wait_for(asyncio.shield(connection), self.connect_timeout)
+
+    async def _call(self, *, api_name: str, on_status: Optional[StatusCallback] = None,
+                    timeout: Optional[float] = None, cancel_token: Optional[CancelToken] = None, **kwargs):
+        async with self._semaphore():
+            await self.wait_connected()
+            if cancel_token is not None:
+                cancel_token.raise_if_cancelled()
+            job = self._submit(api_name=api_name, **kwargs)
+            result = asyncio.wrap_future(job.future)
+            # a job we gave up on still settles later; mark its outcome as retrieved
+            result.add_done_callback(lambda f: f.cancelled() or f.exception())
+            waiting = {result} if cancel_token is None else {result, asyncio.wrap_future(cancel_token._future)}
+            start = time.perf_counter()
+            last = None
+            try:
+                while True:
+                    wait = _poll_timeout(start, timeout, self.status_interval if on_status is not None else None)
+                    await asyncio.wait(waiting, timeout=wait, return_when=asyncio.FIRST_COMPLETED)
+                    if result.done():
+                        return self._job_result(job)
+                    self._check_deadline(job, api_name, start, timeout, cancel_token)
+                    if on_status is not None:
+                        status = JobStatus.from_update(api_name, job.status(), time.perf_counter() - start)
+                        if not status.same_as(last):
+                            on_status(status)
+                            last = status
+            except asyncio.CancelledError:
+                self._cancel_job(job)
+                raise
+
+    async def generate_batch(
+            self,
+            params: Optional[dict] = None,
+            seeds: Optional[List[Union[int, str]]] = None,
+            n: Optional[int] = None,
+            max_in_flight: int = 4
+    ) -> AsyncIterator[BatchResult]:
+        """
+        Async counterpart of MusicAPI.generate_batch, usable with `async for`.
+
+        Args:
+            params: Keyword arguments for generate_music (manual_seeds is overridden)
+            seeds: Seeds to sweep, one generation per seed
+            n: Number of random seeds to draw when seeds is not given
+            max_in_flight: Maximum number of generations running at once
+
+        Returns:
+            Async iterator of BatchResult in completion order
+        """
+        seeds = _batch_seeds(seeds, n)
+        semaphore = asyncio.Semaphore(max_in_flight)
+
+        async def run(index: int, seed: str) -> BatchResult:
+            async with semaphore:
+                result = BatchResult(index=index, seed=seed, started_at=time.time())
+                start = time.perf_counter()
+                try:
+                    result.audio_file, result.params = await self.generate_music(
+                        **{**(params or {}), "manual_seeds": seed})
+                except Exception as e:
+                    result.error = e
+                result.elapsed = time.perf_counter() - start
+                return result
+
+        tasks = [asyncio.ensure_future(run(index, seed)) for index, seed in enumerate(seeds)]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                yield await next_done
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def _cached_call(self, cache_key: Optional[str], *, api_name: str, **kwargs):
+        if cache_key is not None:
+            cached = await asyncio.to_thread(self.result_cache.load, cache_key)
+            if cached is not None:
+                return cached
+        result = await self._call(api_name=api_name, **kwargs)
+        if cache_key is not None:
+            result = await asyncio.to_thread(self._cache_result, cache_key, result)
+        return result
+
+    def run_threadsafe(self, coro) -> concurrent.futures.Future:
+        """
+        Run a coroutine on a background event loop owned by this instance.
+
+        Args:
+            coro: Coroutine, typically returned by one of the endpoint methods
+
+        Returns:
+            concurrent.futures.Future with the coroutine result
+        """
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(target=self._loop.run_forever, daemon=True).start()
+        return asyncio.run_coroutine_threadsafe(coro, self._loop)
+
+
+def create_http_client(timeout: float = 600, connect_timeout: float = 10, max_connections: int = 32,
+                       max_keepalive_connections: int = 16, keepalive_expiry: float = 120,
+                       http2: Optional[bool] = None) -> DefaultHttpxClient:
+    """
+    Build an HTTP client for the OpenAI-compatible API with a tuned connection pool.
+
+    Args:
+        timeout: Seconds a read, write or pool wait may take (streamed replies can be slow)
+        connect_timeout: Seconds to establish a connection
+        max_connections: Connections open at once, shared by all threads
+        max_keepalive_connections: Idle connections kept warm for reuse
+        keepalive_expiry: Seconds an idle connection is kept
+        http2: Use HTTP/2; None enables it when the h2 package is installed (pip install httpx[http2])
+
+    Returns:
+        Client to pass as AI(http_client=...)
+    """
+    # Timeout and Limits of the HTTP library the installed openai package is built on
+    limits = type(DEFAULT_CONNECTION_LIMITS)(max_connections=max_connections,
+                                             max_keepalive_connections=max_keepalive_connections,
+                                             keepalive_expiry=keepalive_expiry)
+    return DefaultHttpxClient(
+        timeout=Timeout(timeout, connect=connect_timeout),
+        limits=limits,
+        http2=h2 is not None if http2 is None else http2,
+    )
+
+
+_shared_http_client = None
+_shared_http_client_lock = threading.Lock()
+
+
+def shared_http_client() -> DefaultHttpxClient:
+    """
+    Process-wide HTTP client used by every AI without an injected one.
+
+    Sharing it lets the GUI, scripts and parallel workers reuse warm TLS connections
+    instead of paying a handshake per client. Created on first use with the
+    create_http_client defaults and closed at exit.
+    """
+    global _shared_http_client
+    with _shared_http_client_lock:
+        if _shared_http_client is None or _shared_http_client.is_closed:
+            _shared_http_client = create_http_client()
+            atexit.register(_shared_http_client.close)
+        return _shared_http_client
 
 
 class AI:
-    def __init__(self):
+    analysis_temperature = 0.7
+
+    def __init__(self, cache_analyses: bool = True, http_client: Optional[DefaultHttpxClient] = None):
+        """
+        Args:
+            cache_analyses: 是否把音频分析结果缓存到磁盘（按音频内容、提示词、模型和温度区分）
+            http_client: 发送请求的HTTP客户端（如create_http_client()），默认使用进程共享的连接池
+        """
         self.client = OpenAI(
             api_key=f"{os.getenv('KIMI_APIKEY')}",
             base_url="https://api.moonshot.cn/v1",
+            http_client=http_client if http_client is not None else shared_http_client(),
         )
+        self.model = "kimi-k2-0711-preview"
         self.history = [
             {"role": "system",
              "content": "你是一个音乐鉴赏家，你擅长中文和英文的对话。擅长从古至今任何旋律的鉴赏，你会为用户提供安全，有帮助，准确的回答。"
                         "同时，你会拒绝一切涉及恐怖主义，种族歧视，黄色，暴力等问题的回答。"
              }
         ]
+        self.memory = self.new_conversation()
+        self.analysis_cache = AnalysisCache() if cache_analyses else None
 
-    def chat(self, query, history=None):
+    def new_conversation(self, max_tokens: int = 8192, **kwargs) -> ConversationMemory:
+        """
+        创建一个会话的对话记忆，系统提示固定在首位，超出token预算时由模型在后台摘要较早的对话
+
+        Args:
+            max_tokens: 每次请求携带的对话历史的token预算
+            **kwargs: ConversationMemory的其余参数
+
+        Returns:
+            ConversationMemory: 可传给chat/chat_stream的history
+        """
+        kwargs.setdefault("summarizer", self.summarize)
+        kwargs.setdefault("background", True)  # 摘要请求不占用回复的时间和任务槽位
+        return ConversationMemory(self.history[0]["content"], max_tokens=max_tokens, **kwargs)
+
+    def summarize(self, previous: str, turns: list, max_tokens: int = 1024, timeout: Optional[float] = 60) -> str:
+        """
+        将较早的对话并入摘要，供ConversationMemory压缩历史；请求失败时退回截取原文
+
+        Args:
+            previous: 已有摘要，可为空
+            turns: 需要并入的(用户消息, AI回复)列表
+            max_tokens: 摘要的token上限
+            timeout: 请求的最长秒数
+
+        Returns:
+            str: 新的摘要
+        """
+        dialogue = "\n".join(f"用户: {user}\nAI: {assistant}" for user, assistant in turns)
+        messages = [
+            {"role": "system",
+             "content": "请把对话压缩成简洁的中文摘要，保留用户的偏好、提到的作品和已给出的结论，"
+                        f"不超过{min(300, max_tokens)}字。"},
+            {"role": "user", "content": (f"已有摘要：\n{previous}\n\n" if previous else "") + f"新的对话：\n{dialogue}"},
+        ]
+        try:
+            return self._complete(messages, 0.3, timeout=timeout)
+        except Exception:
+            return clip_summary(previous, turns, max_tokens)
+
+    def _complete(self, messages: list, temperature: float, timeout: Optional[float] = None,
+                  cancel_token: Optional[CancelToken] = None) -> str:
+        """流式请求对话补全并拼接结果，参数同_stream"""
+        return "".join(self._stream(messages, temperature, timeout=timeout, cancel_token=cancel_token))
+
+    def _stream(self, messages: list, temperature: float, timeout: Optional[float] = None,
+                cancel_token: Optional[CancelToken] = None) -> Iterator[str]:
+        """
+        流式请求对话补全，逐段产出回复文本；取消或超时时立即中断HTTP请求
+
+        Args:
+            messages: 对话消息
+            temperature: 采样温度
+            timeout: 整个请求的最长秒数，超时后中断请求并抛出TimeoutError
+            cancel_token: 调用其cancel()会中断请求并抛出CancelledError
+
+        Returns:
+            Iterator[str]: 模型回复的增量文本
+        """
+        if cancel_token is not None:
+            cancel_token.raise_if_cancelled()
+        start = time.perf_counter()
+        stream = self._open_stream(messages, temperature, timeout)
+        # 关闭响应会中断正在读取的流，服务端随即停止生成
+        timer = None
+        if timeout is not None:
+            timer = threading.Timer(max(0.0, timeout - (time.perf_counter() - start)), stream.close)
+            timer.daemon = True
+            timer.start()
+        if cancel_token is not None:
+            cancel_token.add_callback(stream.close)
+        try:
+            for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+        except Exception:
+            if not (cancel_token is not None and cancel_token.cancelled) and not \
+                    (timeout is not None and time.perf_counter() - start >= timeout):
+                raise
+        finally:
+            if timer is not None:
+                timer.cancel()
+            stream.close()
+        if cancel_token is not None:
+            cancel_token.raise_if_cancelled()
+        if timeout is not None and time.perf_counter() - start >= timeout:
+            raise TimeoutError(f"AI request did not finish within {timeout} seconds")
+
+    def _open_stream(self, messages: list, temperature: float, timeout: Optional[float]) -> Stream:
+        """
+        发起流式对话补全请求
+
+        消息中含有_Base64File（如音频数据）时，请求体在发送过程中从磁盘分块编码，
+        内存占用与文件大小无关。
+
+        Args:
+            messages: 对话消息
+            temperature: 采样温度
+            timeout: 请求的最长秒数
+
+        Returns:
+            Stream: 补全结果块的流
+        """
+        payload = {"model": self.model, "messages": messages, "temperature": temperature, "stream": True}
+        body = _StreamingJSONBody(payload)
+        if not body.files:
+            body.close()
+            return self.client.chat.completions.create(**payload, timeout=timeout)
+        try:
+            return self.client.post(
+                "/chat/completions",
+                cast_to=ChatCompletion,
+                content=body,
+                options={"headers": {"Content-Type": "application/json"}, "timeout": timeout},
+                stream=True,
+                stream_cls=Stream[ChatCompletionChunk],
+            )
+        finally:
+            body.close()  # the request body has been sent once the response stream is open
+
+    def chat(self, query, history=None, timeout: Optional[float] = None, cancel_token: Optional[CancelToken] = None):
+        """
+        与AI对话
+
+        Args:
+            query: 用户消息
+            history: 对话记忆（默认self.memory）或消息列表，会追加本轮问答
+            timeout: 请求的最长秒数，超时后中断请求并抛出TimeoutError
+            cancel_token: 调用其cancel()会中断请求并抛出CancelledError
+
+        Returns:
+            str: AI回复
+        """
+        return "".join(self.chat_stream(query, history, timeout=timeout, cancel_token=cancel_token))
+
+    def chat_stream(self, query, history=None, timeout: Optional[float] = None,
+                    cancel_token: Optional[CancelToken] = None) -> Iterator[str]:
+        """
+        与AI对话，回复随生成逐段产出，首段文字到达即可显示
+
+        Args:
+            query: 用户消息
+            history: 对话记忆（默认self.memory）或消息列表，回复完整结束后追加本轮问答
+            timeout: 请求的最长秒数，超时后中断请求并抛出TimeoutError
+            cancel_token: 调用其cancel()会中断请求并抛出CancelledError
+
+        Returns:
+            Iterator[str]: AI回复的增量文本
+        """
         if history is None:
-            history = []
+            history = self.memory
+        if isinstance(history, ConversationMemory):
+            parts = []
+            for delta in self._stream(history.messages(query), 0.6, timeout=timeout, cancel_token=cancel_token):
+                parts.append(delta)
+                yield delta
+            history.add_turn(query, "".join(parts))
+            return
         history.append({
             "role": "user",
             "content": query
         })
-        completion = self.client.chat.completions.create(
-            model="kimi-k2-0711-preview",
-            messages=history,
-            temperature=0.6,
-        )
-        result = completion.choices[0].message.content
+        parts = []
+        for delta in self._stream(history, 0.6, timeout=timeout, cancel_token=cancel_token):
+            parts.append(delta)
+            yield delta
         history.append({
             "role": "assistant",
-            "content": result
+            "content": "".join(parts)
         })
-        return result
 
-    def analyze_audio(self, audio_file_path: str, analysis_prompt: str = None) -> str:
+    def _analysis_key(self, audio_file_path: str, analysis_prompt: Optional[str], temperature: float,
+                      preset: Optional[str], with_features: bool, upload_audio: bool) -> str:
+        return self.analysis_cache.key(audio_file_path, analysis_prompt, self.model, temperature,
+                                       preset=preset, with_features=with_features, upload_audio=upload_audio)
+
+    def cached_analysis(self, audio_file_path: str, analysis_prompt: str = None, preset: Optional[str] = "balanced",
+                        with_features: bool = True, upload_audio: bool = True) -> Optional[str]:
+        """
+        查询缓存中的分析结果，不发起请求，参数同analyze_audio_stream
+
+        Returns:
+            Optional[str]: 缓存的分析结果，没有缓存时为None
         """
-        使用Kimi AI分析音频文件
+        if self.analysis_cache is None or not os.path.exists(audio_file_path):
+            return None
+        return self.analysis_cache.get(self._analysis_key(audio_file_path, analysis_prompt, self.analysis_temperature, preset,
+                                                          with_features, upload_audio))
+
+    def analyze_audio(self, audio_file_path: str, analysis_prompt: str = None, timeout: Optional[float] = None,
+                      cancel_token: Optional[CancelToken] = None, preset: Optional[str] = "balanced",
+                      with_features: bool = True, upload_audio: bool = True, refresh: bool = False,
+                      raise_errors: bool = False) -> str:
+        """
+        使用Kimi AI分析音频文件，参数同analyze_audio_stream
+
+        Returns:
+            str: AI分析结果
+        """
+        return "".join(self.analyze_audio_stream(audio_file_path, analysis_prompt, timeout=timeout,
+                                                 cancel_token=cancel_token, preset=preset,
+                                                 with_features=with_features, upload_audio=upload_audio,
+                                                 refresh=refresh, raise_errors=raise_errors))
+
+    def analyze_audio_stream(self, audio_file_path: str, analysis_prompt: str = None,
+                             timeout: Optional[float] = None, cancel_token: Optional[CancelToken] = None,
+                             preset: Optional[str] = "balanced", with_features: bool = True,
+                             upload_audio: bool = True, refresh: bool = False,
+                             raise_errors: bool = False) -> Iterator[str]:
+        """
+        使用Kimi AI分析音频文件，分析结果随生成逐段产出
         
         Args:
             audio_file_path: 音频文件路径
             analysis_prompt: 分析提示词，如果为None则使用默认提示
+            timeout: 请求的最长秒数，超时后中断请求并抛出TimeoutError
+            cancel_token: 调用其cancel()会中断请求并抛出CancelledError
+            preset: 上传前的压缩预设（audio.PRESETS中的名称），None则上传原文件
+            with_features: 是否在提示中附上本地提取的音频特征（速度、调性、响度等）
+            upload_audio: 是否上传音频；为False时只发送特征描述，请求小几个数量级
+            refresh: 忽略缓存的分析结果，重新请求并更新缓存
+            raise_errors: 出错时抛出异常（AnalysisError的子类或openai的异常类型，便于调用方重试），而不是产出错误说明
             
         Returns:
-            str: AI分析结果
+            Iterator[str]: AI分析结果的增量文本（出错时产出错误说明；命中缓存时一次产出全部结果）
         """
+        prepared = None
+        temperature = self.analysis_temperature
         try:
             if not os.path.exists(audio_file_path):
-                return f"错误：音频文件不存在 - {audio_file_path}"
+                raise AudioFileError(f"错误：音频文件不存在 - {audio_file_path}")
+
+            cache_key = None
+            if self.analysis_cache is not None:
+                cache_key = self._analysis_key(audio_file_path, analysis_prompt, temperature, preset,
+                                               with_features, upload_audio)
+                cached = None if refresh else self.analysis_cache.get(cache_key)
+                if cached is not None:
+                    yield cached
+                    return
 
-            with open(audio_file_path, 'rb') as audio_file:
-                audio_data = audio_file.read()
-                audio_base64 = base64.b64encode(audio_data).decode('utf-8')
+            # 打开一次，供特征提取和压缩共用；WAV只做内存映射，采样按块读取
+            source = None
+            if with_features or (upload_audio and preset is not None):
+                try:
+                    source = decode(audio_file_path)
+                except (ValueError, OSError):
+                    source = None  # 无法解码的格式：不提取特征，直接上传原文件
+            features = None
+            if with_features and source is not None:
+                try:
+                    features = extract_features(source=source)
+                except Exception:
+                    # 特征只是音频之外的补充信息，提取失败时照常上传音频分析
+                    logger.exception("特征提取失败，继续分析但不附带特征 - %s", audio_file_path)
+            if not upload_audio and features is None:
+                raise AudioFileError(f"错误：无法解码音频，不能仅凭特征分析 - {audio_file_path}")
+            if upload_audio and preset is not None and source is not None:
+                prepared = prepare_for_analysis(audio_file_path, preset, source=source)
+            source = None  # 释放内存映射（或解码后的采样数据），不必在请求期间占用
 
             file_extension = os.path.splitext(audio_file_path)[1].lower()
 
@@ -598,7 +1692,7 @@ class AI:
                 '.ogg': 'audio/ogg',
                 '.flac': 'audio/flac'
             }
-            mime_type = mime_types.get(file_extension, 'audio/wav')
+            mime_type = prepared.mime_type if prepared else mime_types.get(file_extension, 'audio/wav')
 
             # 构建分析提示
             if analysis_prompt is None:
@@ -615,13 +1709,17 @@ class AI:
 请用专业但易懂的语言进行分析，并给出具体的评价和建议。"""
 
             # 构建消息内容
+            upload_text = self._describe_upload(prepared) if upload_audio else "- 上传内容：未上传音频，请仅根据下面的特征进行分析"
+            features_text = f"本地提取的音频特征：\n{features.describe()}" if features else ""
             message_content = f"""
 {analysis_prompt}
 
 音频文件信息：
 - 文件名：{os.path.basename(audio_file_path)}
-- 文件大小：{len(audio_data)} 字节
+- 文件大小：{os.path.getsize(audio_file_path)} 字节
 - 文件格式：{file_extension}
+{upload_text}
+{features_text}
 
 请基于以上信息对音频进行专业分析。
 """
@@ -637,26 +1735,52 @@ class AI:
                         {
                             "type": "text",
                             "text": message_content
-                        },
-                        {
-                            "type": "audio",
-                            "audio": {
-                                "data": audio_base64,
-                                "mime_type": mime_type
-                            }
                         }
                     ]
                 }
             ]
+            if upload_audio:
+                # 不把整个文件读入内存，请求体在发送时从磁盘分块进行base64编码
+                messages[1]["content"].append({
+                    "type": "audio",
+                    "audio": {
+                        "data": _Base64File(prepared.path if prepared else audio_file_path),
+                        "mime_type": mime_type
+                    }
+                })
 
-            completion = self.client.chat.completions.create(
-                model="kimi-k2-0711-preview",
-                messages=messages,
-                temperature=0.7,
-            )
-
-            result = completion.choices[0].message.content
-            return result
+            parts = []
+            for delta in self._stream(messages, temperature, timeout=timeout, cancel_token=cancel_token):
+                parts.append(delta)
+                yield delta
+            if cache_key is not None and parts:
+                self.analysis_cache.put(cache_key, "".join(parts), {"file": os.path.basename(audio_file_path)})
 
+        except (concurrent.futures.CancelledError, TimeoutError):
+            raise
+        except AudioFileError as e:
+            if raise_errors:
+                raise
+            yield str(e)
         except Exception as e:
-            return f"音频分析过程中出现错误：{str(e)}"
+            if raise_errors:
+                if isinstance(e, (AnalysisError, APIError)):
+                    raise
+                # 其他异常（如解码或写临时文件出错）统一包装，调用方只需处理AnalysisError和openai的异常
+                raise AnalysisFailedError(f"音频分析过程中出现错误：{type(e).__name__}: {e}") from e
+            yield f"音频分析过程中出现错误：{str(e)}"
+        finally:
+            if prepared is not None and os.path.exists(prepared.path):
+                os.remove(prepared.path)
+
+    @staticmethod
+    def _describe_upload(prepared: Optional[PreparedAudio]) -> str:
+        """向模型说明上传的音频相对原文件做了哪些处理"""
+        if prepared is None:
+            return "- 上传内容：原始文件"
+        lines = [f"- 时长：{prepared.source_duration:.1f} 秒（{prepared.source_sample_rate} Hz，{prepared.source_channels} 声道）",
+                 f"- 上传内容：已转换为 {prepared.sample_rate} Hz、{prepared.channels} 声道的16位WAV"]
+        if len(prepared.excerpts) > 1:
+            ranges = "、".join(f"{start:.0f}-{end:.0f}秒" for start, end in prepared.excerpts)
+            lines.append(f"- 为缩短上传，只包含以下片段（片段之间有短暂静音）：{ranges}")
+        return "\n".join(lines)
@@ -0,0 +1,404 @@
+# ------------------
+#       Meropo
+# ------------------
+"""
+Audio preprocessing that shrinks files before they are uploaded for analysis.
+
+The audio is decoded, downmixed, optionally cut down to a few representative
+excerpts, resampled and written as a compact 16-bit WAV, all with NumPy array
+operations on bounded blocks. WAV is decoded natively; other formats need the optional soundfile
+package (pip install soundfile).
+"""
+import os
+import math
+import struct
+import tempfile
+from dataclasses import dataclass, field
+from typing import Iterable, Iterator, List, Optional, Tuple
+import numpy as np
+
+try:
+    import soundfile
+except ImportError:  # only WAV can be decoded
+    soundfile = None
+
+WAVE_FORMAT_PCM = 0x0001
+WAVE_FORMAT_IEEE_FLOAT = 0x0003
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+
+@dataclass(frozen=True)
+class AudioPreset:
+    sample_rate: int  # output sample rate
+    channels: int  # 1 downmixes to mono, 2 keeps stereo sources stereo
+    excerpts: int  # number of excerpts kept, 0 keeps the whole track
+    excerpt_seconds: float  # length of each excerpt
+
+
+# name -> preset, from the smallest upload to the highest fidelity
+PRESETS = {
+    "compact": AudioPreset(sample_rate=16000, channels=1, excerpts=3, excerpt_seconds=10),
+    "balanced": AudioPreset(sample_rate=22050, channels=1, excerpts=4, excerpt_seconds=15),
+    "high": AudioPreset(sample_rate=44100, channels=2, excerpts=0, excerpt_seconds=0),
+}
+
+
+@dataclass
+class PreparedAudio:
+    path: str  # compact WAV to upload; the caller deletes it
+    mime_type: str
+    size: int  # bytes of the compact file
+    source_duration: float
+    source_sample_rate: int
+    source_channels: int
+    sample_rate: int
+    channels: int
+    excerpts: List[Tuple[float, float]] = field(default_factory=list)  # (start, end) seconds of the source
+
+
+class AudioSource:
+    def __init__(self, raw: np.ndarray, sample_rate: int, scale: float = 1.0, offset: float = 0.0):
+        """
+        Samples of an audio file, converted to float32 one block at a time.
+
+        A WAV file stays memory-mapped: only the blocks that are read are converted,
+        so the float copy of a long track never exists in memory at once.
+
+        Args:
+            raw: Samples with shape (frames, channels), usually a memmap; 24-bit PCM has
+                shape (frames, channels, 3) holding the little-endian bytes of each sample
+            sample_rate: Sample rate of the samples
+            scale: Factor turning raw values into [-1, 1] floats
+            offset: Subtracted from raw values before scaling (128 for unsigned 8-bit PCM)
+        """
+        self.raw = raw
+        self.sample_rate = sample_rate
+        self.scale = scale
+        self.offset = offset
+
+    def __len__(self) -> int:
+        return len(self.raw)
+
+    @property
+    def channels(self) -> int:
+        return self.raw.shape[1]
+
+    @property
+    def duration(self) -> float:
+        return len(self.raw) / self.sample_rate
+
+    def read(self, start: int = 0, end: Optional[int] = None, channels: Optional[int] = None) -> np.ndarray:
+        """
+        Convert a range of frames to float32.
+
+        Args:
+            start: First frame
+            end: Frame after the last one (default: end of the track)
+            channels: Downmix to at most this many channels
+
+        Returns:
+            float32 samples with shape (frames, channels)
+        """
+        block = self.raw[start:end]
+        if block.ndim == 3:
+            # 24-bit: widen each little-endian triple to the top of an int32
+            widened = np.zeros(block.shape[:2] + (4,), dtype=np.uint8)
+            widened[..., 1:] = block
+            block = widened.view('<i4')[..., 0]
+        samples = block.astype(np.float32)
+        if self.offset:
+            samples -= self.offset
+        if self.scale != 1:
+            samples *= self.scale
+        return downmix(samples, channels) if channels else samples
+
+    def blocks(self, block_frames: int = 1 << 18, channels: Optional[int] = None, start: int = 0,
+               end: Optional[int] = None) -> Iterator[np.ndarray]:
+        """Read a range of frames (default: the whole track) as consecutive float32 blocks."""
+        end = len(self) if end is None else end
+        for first in range(start, end, block_frames):
+            yield self.read(first, min(first + block_frames, end), channels)
+
+
+def read_wav(path: str) -> AudioSource:
+    """
+    Open a PCM or IEEE float WAV file as a memory-mapped source; no sample is read yet.
+
+    Args:
+        path: Path of the WAV file
+
+    Returns:
+        AudioSource over the data chunk
+    """
+    with open(path, 'rb') as f:
+        riff, _, wave_id = struct.unpack('<4sI4s', f.read(12))
+        if riff != b'RIFF' or wave_id != b'WAVE':
+            raise ValueError(f"{path} is not a RIFF/WAVE file")
+        fmt = None
+        while True:
+            header = f.read(8)
+            if len(header) < 8:
+                raise ValueError(f"{path} has no data chunk")
+            chunk_id, chunk_size = struct.unpack('<4sI', header)
+            if chunk_id == b'fmt ':
+                fmt = f.read(chunk_size)
+                f.seek(chunk_size % 2, os.SEEK_CUR)
+            elif chunk_id == b'data':
+                data_offset = f.tell()
+                break
+            else:
+                f.seek(chunk_size + chunk_size % 2, os.SEEK_CUR)
+        file_size = os.fstat(f.fileno()).st_size
+    if fmt is None:
+        raise ValueError(f"{path} has no fmt chunk")
+    format_tag, channels, sample_rate, _, block_align, bits = struct.unpack('<HHIIHH', fmt[:16])
+    if format_tag == WAVE_FORMAT_EXTENSIBLE and len(fmt) >= 26:
+        format_tag = struct.unpack('<H', fmt[24:26])[0]
+    width = block_align // channels
+    frames = min(chunk_size, file_size - data_offset) // block_align
+
+    if format_tag == WAVE_FORMAT_IEEE_FLOAT and width in (4, 8):
+        raw = np.memmap(path, dtype='<f%d' % width, mode='r', offset=data_offset, shape=(frames, channels))
+        return AudioSource(raw, sample_rate)
+    if format_tag != WAVE_FORMAT_PCM:
+        raise ValueError(f"unsupported WAV format 0x{format_tag:04x} in {path}")
+    if width == 3:
+        raw = np.memmap(path, dtype=np.uint8, mode='r', offset=data_offset, shape=(frames, channels, 3))
+        return AudioSource(raw, sample_rate, scale=1 / 2 ** 31)
+    dtype = {1: np.uint8, 2: '<i2', 4: '<i4'}.get(width)
+    if dtype is None:
+        raise ValueError(f"unsupported WAV sample width {bits} bits in {path}")
+    raw = np.memmap(path, dtype=dtype, mode='r', offset=data_offset, shape=(frames, channels))
+    if width == 1:
+        return AudioSource(raw, sample_rate, scale=1 / 128, offset=128)
+    return AudioSource(raw, sample_rate, scale=1 / 2 ** (8 * width - 1))
+
+
+def decode(path: str) -> AudioSource:
+    """
+    Open an audio file for reading.
+
+    WAV files are memory-mapped; other formats are decoded into memory by soundfile.
+
+    Args:
+        path: Path of the audio file
+
+    Returns:
+        AudioSource of the file
+    """
+    if os.path.splitext(path)[1].lower() == ".wav":
+        try:
+            return read_wav(path)
+        except ValueError:
+            if soundfile is None:
+                raise
+    if soundfile is None:
+        raise ValueError(f"decoding {os.path.splitext(path)[1] or path} needs the soundfile package")
+    samples, sample_rate = soundfile.read(path, dtype='float32', always_2d=True)
+    return AudioSource(samples, sample_rate)
+
+
+def downmix(samples: np.ndarray, channels: int) -> np.ndarray:
+    """Reduce (frames, channels) samples to at most the given number of channels."""
+    if samples.shape[1] <= channels:
+        return samples
+    if channels == 1:
+        return samples.mean(axis=1, keepdims=True)
+    return samples[:, :channels]
+
+
+def resample(samples: np.ndarray, source_rate: int, target_rate: int) -> np.ndarray:
+    """
+    Band-limited resampling in the frequency domain.
+
+    Cropping the spectrum to the new Nyquist frequency is the anti-aliasing filter,
+    so no separate low-pass pass over the signal is needed.
+
+    Args:
+        samples: float32 samples with shape (frames, channels)
+        source_rate: Sample rate of samples
+        target_rate: Wanted sample rate
+
+    Returns:
+        Resampled float32 samples
+    """
+    if source_rate == target_rate or len(samples) == 0:
+        return samples
+    frames = max(1, int(round(len(samples) * target_rate / source_rate)))
+    spectrum = np.fft.rfft(samples, axis=0)
+    resampled = np.fft.irfft(spectrum, n=frames, axis=0) * (frames / len(samples))
+    return resampled.astype(np.float32)
+
+
+def resample_blocks(source: AudioSource, target_rate: int, start: int = 0, end: Optional[int] = None,
+                    channels: Optional[int] = None, block_seconds: float = 10.0,
+                    pad_seconds: float = 0.5) -> Iterator[np.ndarray]:
+    """
+    Resample a range of a source block by block, with memory bounded by the block size.
+
+    Each block is resampled together with pad_seconds of its neighbours on both
+    sides, and the padding is cut off again, so the edge effects of the per-block
+    FFT fall outside the samples that are kept. Blocks hold a whole number of
+    resampling periods, so the output blocks join without drift.
+
+    Args:
+        source: Samples to resample
+        target_rate: Wanted sample rate
+        start: First frame of the range
+        end: Frame after the range (default: end of the track)
+        channels: Downmix to at most this many channels
+        block_seconds: Length of a block
+        pad_seconds: Overlap read on each side of a block
+
+    Returns:
+        Iterator of consecutive float32 blocks at target_rate
+    """
+    end = len(source) if end is None else end
+    if source.sample_rate == target_rate:
+        yield from source.blocks(int(block_seconds * target_rate), channels, start, end)
+        return
+    common = math.gcd(source.sample_rate, target_rate)
+    period_in, period_out = source.sample_rate // common, target_rate // common
+    block = max(1, int(block_seconds * source.sample_rate) // period_in) * period_in
+    pad = int(pad_seconds * source.sample_rate) // period_in * period_in
+    for first in range(start, end, block):
+        last = min(first + block, end)
+        lower, upper = max(start, first - pad), min(end, last + pad)
+        resampled = resample(source.read(lower, upper, channels), source.sample_rate, target_rate)
+        skip = (first - lower) // period_in * period_out
+        yield resampled[skip:skip + int(round((last - first) * target_rate / source.sample_rate))]
+
+
+def select_excerpts(source: AudioSource, count: int, seconds: float, channels: Optional[int] = None,
+                    hop_seconds: float = 0.5, block_hops: int = 64) -> List[Tuple[int, int]]:
+    """
+    Pick the most energetic window within each of count equal parts of the track.
+
+    Args:
+        source: Samples to choose from
+        count: Number of excerpts
+        seconds: Length of each excerpt
+        channels: Downmix to at most this many channels before measuring energy
+        hop_seconds: Resolution of the window positions
+        block_hops: Hops converted at once, bounding memory
+
+    Returns:
+        (start, end) frame ranges in track order; the whole track if it is short enough
+    """
+    total = len(source)
+    length = int(seconds * source.sample_rate)
+    if count <= 0 or length <= 0 or total <= count * length:
+        return [(0, total)]
+    hop = max(1, int(hop_seconds * source.sample_rate))
+    hops = total // hop
+    energy = np.empty(hops, dtype=np.float64)
+    for first in range(0, hops, block_hops):
+        last = min(first + block_hops, hops)
+        block = source.read(first * hop, last * hop, channels)
+        energy[first:last] = np.square(block).sum(axis=1).reshape(last - first, hop).sum(axis=1)
+    window = max(1, length // hop)
+    # energy of every window of `window` hops, via a cumulative sum
+    cumulative = np.concatenate(([0.0], np.cumsum(energy)))
+    window_energy = cumulative[window:] - cumulative[:-window]
+    ranges = []
+    bounds = np.linspace(0, len(window_energy), count + 1).astype(int)
+    for lower, upper in zip(bounds[:-1], bounds[1:]):
+        best = lower + int(np.argmax(window_energy[lower:max(upper, lower + 1)]))
+        start = best * hop
+        ranges.append((start, min(start + length, total)))
+    return ranges
+
+
+def join_excerpts(parts: List[np.ndarray], sample_rate: int, fade_seconds: float = 0.05,
+                  gap_seconds: float = 0.3) -> np.ndarray:
+    """Concatenate excerpts with short fades and silent gaps, so the cuts do not click."""
+    if len(parts) == 1:
+        return parts[0]
+    fade = int(fade_seconds * sample_rate)
+    gap = np.zeros((int(gap_seconds * sample_rate), parts[0].shape[1]), dtype=np.float32)
+    joined = []
+    for i, part in enumerate(parts):
+        part = part.copy()
+        n = min(fade, len(part) // 2)
+        if n:
+            ramp = np.linspace(0.0, 1.0, n, dtype=np.float32)[:, None]
+            part[:n] *= ramp
+            part[-n:] *= ramp[::-1]
+        if i:
+            joined.append(gap)
+        joined.append(part)
+    return np.concatenate(joined)
+
+
+def write_wav(path: str, samples: np.ndarray, sample_rate: int):
+    """Write float samples with shape (frames, channels) as a 16-bit PCM WAV."""
+    write_wav_blocks(path, [samples], sample_rate, samples.shape[1])
+
+
+def write_wav_blocks(path: str, blocks: Iterable[np.ndarray], sample_rate: int, channels: int) -> int:
+    """
+    Write consecutive blocks of float samples as one 16-bit PCM WAV.
+
+    The header is written first and its sizes are filled in once the last block is
+    known, so the samples never have to be held in memory together.
+
+    Returns:
+        Number of frames written
+    """
+    frames = 0
+    with open(path, 'wb') as f:
+        f.write(b'\0' * 44)
+        for block in blocks:
+            pcm = (np.clip(block, -1.0, 1.0) * 32767).astype('<i2')
+            f.write(pcm.tobytes())
+            frames += len(pcm)
+        data_size = frames * channels * 2
+        f.seek(0)
+        f.write(struct.pack('<4sI4s4sIHHIIHH4sI', b'RIFF', 36 + data_size, b'WAVE', b'fmt ', 16, WAVE_FORMAT_PCM,
+                            channels, sample_rate, sample_rate * channels * 2, channels * 2, 16, b'data', data_size))
+    return frames
+
+
+def prepare_for_analysis(path: str, preset: str = "balanced", directory: Optional[str] = None,
+                         source: Optional[AudioSource] = None) -> PreparedAudio:
+    """
+    Turn an audio file into a compact WAV for upload, according to a preset.
+
+    Only the selected excerpts are converted to float and downmixed; a whole track is
+    resampled and written block by block.
+
+    Args:
+        path: Source audio file
+        preset: Name of a PRESETS entry
+        directory: Where to write the compact file (default: the temporary directory)
+        source: Already opened source of path, to avoid decoding twice
+
+    Returns:
+        PreparedAudio describing the compact file and what was kept of the source
+    """
+    settings = PRESETS[preset]
+    source = source if source is not None else decode(path)
+    source_rate = source.sample_rate
+    channels = min(settings.channels, source.channels)
+    ranges = select_excerpts(source, settings.excerpts, settings.excerpt_seconds, channels)
+    if len(ranges) == 1:
+        blocks = resample_blocks(source, settings.sample_rate, *ranges[0], channels=channels)
+    else:
+        parts = [resample(source.read(start, end, channels), source_rate, settings.sample_rate)
+                 for start, end in ranges]
+        blocks = [join_excerpts(parts, settings.sample_rate)]
+
+    fd, out_path = tempfile.mkstemp(prefix="meropo_analysis_", suffix=".wav", dir=directory)
+    os.close(fd)
+    write_wav_blocks(out_path, blocks, settings.sample_rate, channels)
+    return PreparedAudio(
+        path=out_path,
+        mime_type="audio/wav",
+        size=os.path.getsize(out_path),
+        source_duration=source.duration,
+        source_sample_rate=source_rate,
+        source_channels=source.channels,
+        sample_rate=settings.sample_rate,
+        channels=channels,
+        excerpts=[(start / source_rate, end / source_rate) for start, end in ranges],
+    )
@@ -0,0 +1,220 @@
+# ------------------
+#       Meropo
+# ------------------
+"""
+Throughput and latency benchmark of the MusicAPI client against the local fake server.
+
+Runs the same number of generate_music calls serially, on a thread pool and on
+AsyncMusicAPI, and reports calls/sec, p50/p95/p99 latency, overhead above the
+simulated server latency and memory as JSON:
+
+    python benchmark.py --calls 40 --concurrency 8 --latency 0.5 --output bench.json
+
+Pass --url to benchmark an already running server instead of spawning fake_server.py.
+"""
+import os
+import sys
+import json
+import time
+import socket
+import asyncio
+import argparse
+import platform
+import subprocess
+import tracemalloc
+import urllib.request
+import concurrent.futures
+from typing import Callable, List, Optional, Tuple
+from gradio_client import __version__ as gradio_client_version
+from api import AsyncMusicAPI, MusicAPI
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+BENCH_PARAMS = {"prompt": "benchmark", "lyrics": "", "audio_duration": 1}
+
+
+def percentile(samples: List[float], q: float) -> Optional[float]:
+    """Linear-interpolated percentile, q in [0, 100]."""
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    position = (len(ordered) - 1) * q / 100
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+def peak_rss_mb() -> Optional[float]:
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 ** 2 if sys.platform == "darwin" else peak / 1024  # bytes on macOS, KiB elsewhere
+
+
+def summarize(mode: str, latencies: List[float], errors: List[str], wall: float, traced_peak: int,
+              server_latency: Optional[float]) -> dict:
+    p50 = percentile(latencies, 50)
+    return {
+        "mode": mode,
+        "calls": len(latencies) + len(errors),
+        "errors": len(errors),
+        "first_error": errors[0] if errors else None,
+        "wall_seconds": wall,
+        "calls_per_second": len(latencies) / wall if wall else None,
+        "latency_mean": sum(latencies) / len(latencies) if latencies else None,
+        "latency_p50": p50,
+        "latency_p95": percentile(latencies, 95),
+        "latency_p99": percentile(latencies, 99),
+        "latency_max": max(latencies) if latencies else None,
+        # time above the simulated inference: client plus gradio queue, transfer and file handling
+        "overhead_p50": p50 - server_latency if p50 is not None and server_latency is not None else None,
+        "python_alloc_peak_mb": traced_peak / 1024 ** 2,
+        "process_peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def timed_call(fn: Callable, latencies: List[float], errors: List[str]):
+    start = time.perf_counter()
+    try:
+        fn()
+    except Exception as e:
+        errors.append(f"{type(e).__name__}: {e}")
+    else:
+        latencies.append(time.perf_counter() - start)
+
+
+def run_serial(api: MusicAPI, calls: int):
+    latencies, errors = [], []
+    for _ in range(calls):
+        timed_call(lambda: api.generate_music(**BENCH_PARAMS), latencies, errors)
+    return latencies, errors
+
+
+def run_threaded(api: MusicAPI, calls: int, concurrency: int):
+    latencies, errors = [], []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for _ in range(calls):
+            executor.submit(timed_call, lambda: api.generate_music(**BENCH_PARAMS), latencies, errors)
+    return latencies, errors
+
+
+def run_async(api: AsyncMusicAPI, calls: int):
+    latencies, errors = [], []
+
+    async def one():
+        start = time.perf_counter()
+        try:
+            await api.generate_music(**BENCH_PARAMS)
+        except Exception as e:
+            errors.append(f"{type(e).__name__}: {e}")
+        else:
+            latencies.append(time.perf_counter() - start)
+
+    async def main():
+        await api.wait_connected()
+        await asyncio.gather(*(one() for _ in range(calls)))
+
+    asyncio.run(main())
+    return latencies, errors
+
+
+def measure(mode: str, run: Callable, server_latency: Optional[float]) -> dict:
+    tracemalloc.start()
+    start = time.perf_counter()
+    latencies, errors = run()
+    wall = time.perf_counter() - start
+    _, traced_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return summarize(mode, latencies, errors, wall, traced_peak, server_latency)
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_fake_server(args: argparse.Namespace) -> Tuple[subprocess.Popen, str]:
+    port = free_port()
+    url = f"http://127.0.0.1:{port}/"
+    server = subprocess.Popen(
+        [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "fake_server.py"),
+         "--port", str(port), "--latency", str(args.latency), "--jitter", str(args.jitter),
+         "--concurrency", str(args.server_concurrency), "--audio-seconds", "1"],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.time() + 120
+    while time.time() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f"fake_server.py exited with code {server.returncode}")
+        try:
+            urllib.request.urlopen(url + "config", timeout=1)
+            return server, url
+        except OSError:
+            time.sleep(0.5)
+    server.kill()
+    raise RuntimeError("fake_server.py did not start within 120 seconds")
+
+
+def main(argv: Optional[list] = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark MusicAPI against a fake ACE-Step server")
+    parser.add_argument("--url", help="benchmark this server instead of spawning fake_server.py")
+    parser.add_argument("--calls", type=int, default=20, help="calls per mode (default: 20)")
+    parser.add_argument("--concurrency", type=int, default=8, help="client concurrency for threaded/async modes")
+    parser.add_argument("--modes", default="serial,threaded,async", help="comma-separated modes to run")
+    parser.add_argument("--latency", type=float, default=0.2, help="simulated server latency in seconds")
+    parser.add_argument("--jitter", type=float, default=0.0, help="relative spread of the simulated latency")
+    parser.add_argument("--server-concurrency", type=int, default=64, help="jobs the fake server runs at once")
+    parser.add_argument("--output", help="write the JSON report to this file instead of stdout")
+    args = parser.parse_args(argv)
+
+    server = None
+    url = args.url
+    if url is None:
+        server, url = start_fake_server(args)
+    server_latency = None if args.url else args.latency
+    try:
+        api = MusicAPI(url, cache_schema=False, cache_results=False)
+        async_api = AsyncMusicAPI(url, max_concurrency=args.concurrency, cache_schema=False, cache_results=False)
+        api.client  # connect before timing
+        api.generate_music(**BENCH_PARAMS)  # warm up
+        runs = {
+            "serial": lambda: run_serial(api, args.calls),
+            "threaded": lambda: run_threaded(api, args.calls, args.concurrency),
+            "async": lambda: run_async(async_api, args.calls),
+        }
+        results = []
+        for mode in args.modes.split(","):
+            result = measure(mode, runs[mode.strip()], server_latency)
+            results.append(result)
+            print(f"{mode:>8}: {result['calls_per_second'] or 0:7.2f} calls/s  "
+                  f"p50 {result['latency_p50'] or 0:.3f}s  p95 {result['latency_p95'] or 0:.3f}s  "
+                  f"p99 {result['latency_p99'] or 0:.3f}s  errors {result['errors']}", file=sys.stderr)
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    report = {
+        "timestamp": time.time(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "gradio_client": gradio_client_version,
+        "config": {"url": args.url or "fake_server", "calls": args.calls, "concurrency": args.concurrency,
+                   "server_latency": server_latency, "jitter": args.jitter,
+                   "server_concurrency": args.server_concurrency},
+        "results": results,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    return 1 if any(result["errors"] for result in results) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
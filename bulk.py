@@ -0,0 +1,265 @@
+# ------------------
+#       Meropo
+# ------------------
+"""
+Bulk audio analysis under the provider's rate limits.
+
+Files are analysed concurrently, but every request first takes one request from a
+requests-per-minute bucket and its estimated tokens from a tokens-per-minute
+bucket, so the pool never outruns the quota. A 429 response pauses the whole
+limiter for the Retry-After time (or an exponential backoff) before the request
+is retried, so one rejected worker does not keep the others hammering the API.
+"""
+import os
+import time
+import random
+import threading
+import concurrent.futures
+from typing import Iterable, Iterator, List, Optional, Set
+import openai
+from api import AI
+from cancel import CancelToken
+from memory import estimate_tokens
+
+AUDIO_EXTENSIONS = (".wav", ".mp3", ".flac", ".ogg")
+LIST_EXTENSIONS = (".txt", ".lst")
+
+# failures worth another attempt; everything else is final for the file
+RETRYABLE_ERRORS = (openai.RateLimitError, openai.APIConnectionError, openai.InternalServerError, TimeoutError)
+
+
+def _sleep(seconds: float, cancel_token: Optional[CancelToken] = None):
+    """Sleep for seconds, waking up early once cancel_token is cancelled."""
+    if cancel_token is None:
+        time.sleep(seconds)
+    else:
+        cancel_token.wait(seconds)
+
+
+class TokenBucket:
+    def __init__(self, rate_per_minute: float, capacity: Optional[float] = None):
+        """
+        Thread-safe token bucket refilled continuously at rate_per_minute.
+
+        Args:
+            rate_per_minute: Tokens added per minute
+            capacity: Largest burst; defaults to one minute's worth
+        """
+        self.rate = rate_per_minute / 60
+        self.capacity = capacity if capacity is not None else rate_per_minute
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, amount: float) -> float:
+        """
+        Take amount tokens, going into debt if necessary.
+
+        Returns:
+            Seconds the caller has to wait before using them
+        """
+        with self._lock:
+            self._refill(time.monotonic())
+            self.tokens -= amount
+            return max(0.0, -self.tokens / self.rate)
+
+    def acquire(self, amount: float = 1):
+        """Block until amount tokens are available and take them."""
+        delay = self.reserve(amount)
+        if delay:
+            time.sleep(delay)
+
+
+class RateLimiter:
+    def __init__(self, rpm: float, tpm: Optional[float] = None):
+        """
+        Requests-per-minute and tokens-per-minute quota shared by all workers.
+
+        Args:
+            rpm: Requests allowed per minute
+            tpm: Tokens allowed per minute, None for no token limit
+        """
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm) if tpm else None
+        self._resume_at = 0.0
+        self._lock = threading.Lock()
+
+    def pause(self, seconds: float):
+        """Hold back every worker for seconds, e.g. after a 429."""
+        with self._lock:
+            self._resume_at = max(self._resume_at, time.monotonic() + seconds)
+
+    def acquire(self, tokens: int = 0, cancel_token: Optional[CancelToken] = None):
+        """
+        Block until a request with the given estimated tokens fits in the quota.
+
+        Raises:
+            concurrent.futures.CancelledError: cancel_token was cancelled while waiting
+        """
+        while True:
+            if cancel_token is not None:
+                cancel_token.raise_if_cancelled()
+            with self._lock:
+                wait = self._resume_at - time.monotonic()
+            if wait <= 0:
+                break
+            _sleep(wait, cancel_token)
+        delay = self.requests.reserve(1)
+        if self.tokens is not None and tokens:
+            delay = max(delay, self.tokens.reserve(tokens))
+        if delay:
+            _sleep(delay, cancel_token)
+            if cancel_token is not None:
+                cancel_token.raise_if_cancelled()
+
+
+def retry_after(error: Exception) -> Optional[float]:
+    """Seconds the server asked us to wait, from the Retry-After header of a 429 response."""
+    response = getattr(error, "response", None)
+    value = response.headers.get("retry-after") if response is not None else None
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+def backoff(attempt: int, base: float = 2.0, cap: float = 60.0) -> float:
+    """Exponential backoff with full jitter for the given retry attempt (1 for the first retry)."""
+    return random.uniform(0, min(cap, base * 2 ** (attempt - 1)))
+
+
+def iter_audio_files(inputs: Iterable[str], extensions: tuple = AUDIO_EXTENSIONS) -> Iterator[str]:
+    """
+    Expand directories and list files into audio file paths.
+
+    Args:
+        inputs: Audio files, directories (walked recursively) and .txt/.lst files
+            listing one path per line
+        extensions: Extensions of the audio files picked up from directories
+
+    Returns:
+        Iterator of paths, each at most once, directory contents in sorted order
+    """
+    seen = set()
+    for item in inputs:
+        if os.path.isdir(item):
+            paths = []
+            for directory, dirnames, filenames in os.walk(item):
+                dirnames.sort()
+                paths += [os.path.join(directory, name) for name in sorted(filenames)
+                          if name.lower().endswith(extensions)]
+        elif item.lower().endswith(LIST_EXTENSIONS):
+            with open(item, 'r', encoding='utf-8') as f:
+                paths = [line.strip() for line in f if line.strip() and not line.startswith("#")]
+        else:
+            paths = [item]
+        for path in paths:
+            if path not in seen:
+                seen.add(path)
+                yield path
+
+
+class BulkAnalyzer:
+    def __init__(self, ai: AI, limiter: RateLimiter, concurrency: int = 4, max_retries: int = 5,
+                 tokens_per_request: int = 4000, timeout: Optional[float] = 300,
+                 cancel_token: Optional[CancelToken] = None, **analysis_options):
+        """
+        Analyse many files concurrently within a rate limit.
+
+        Args:
+            ai: AI used for the requests; cached analyses are returned without a request
+            limiter: Quota shared by the workers
+            concurrency: Analyses in flight at once
+            max_retries: Retries of a file after a 429, connection error, 5xx or timeout
+            tokens_per_request: Estimated tokens of a request besides the prompt text
+                (audio and reply), charged to the tokens-per-minute bucket
+            timeout: Seconds a single request may take
+            cancel_token: Cancelling it aborts the requests in flight and fails the
+                remaining files with CancelledError, e.g. on Ctrl-C
+            **analysis_options: analysis_prompt, preset, with_features, upload_audio and
+                refresh of AI.analyze_audio
+        """
+        self.ai = ai
+        self.limiter = limiter
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.tokens_per_request = tokens_per_request
+        self.timeout = timeout
+        self.cancel_token = cancel_token
+        self.options = analysis_options
+
+    def analyze(self, path: str) -> dict:
+        """
+        Analyse one file, retrying transient failures.
+
+        Returns:
+            Results record with id, file, ok, analysis, cached, error, error_type,
+            attempts, started_at and elapsed
+        """
+        record = {"id": path, "file": path, "ok": False, "analysis": None, "cached": False, "error": None,
+                  "error_type": None, "attempts": 0, "started_at": time.time(), "elapsed": None}
+        start = time.perf_counter()
+        options = dict(self.options)
+        cached = None
+        if not options.get("refresh"):
+            cached = self.ai.cached_analysis(path, options.get("analysis_prompt"),
+                                             options.get("preset", "balanced"), options.get("with_features", True),
+                                             options.get("upload_audio", True))
+        if cached is not None:
+            record.update(ok=True, analysis=cached, cached=True, elapsed=time.perf_counter() - start)
+            return record
+        tokens = self.tokens_per_request + estimate_tokens(options.get("analysis_prompt") or "")
+        while True:
+            record["attempts"] += 1
+            try:
+                self.limiter.acquire(tokens, self.cancel_token)
+                analysis = self.ai.analyze_audio(path, timeout=self.timeout, cancel_token=self.cancel_token,
+                                                 raise_errors=True, **options)
+            except RETRYABLE_ERRORS as e:
+                if record["attempts"] > self.max_retries:
+                    self._fail(record, e)
+                    break
+                delay = retry_after(e) if isinstance(e, openai.RateLimitError) else None
+                delay = delay if delay is not None else backoff(record["attempts"])
+                if isinstance(e, openai.RateLimitError):
+                    self.limiter.pause(delay)  # the quota is shared, so everyone backs off
+                else:
+                    _sleep(delay, self.cancel_token)  # a cancelled token fails the next attempt
+            except Exception as e:
+                # AnalysisError, other API errors, cancellation and anything unexpected are
+                # final for this file and recorded, but never abort the batch
+                self._fail(record, e)
+                break
+            else:
+                record.update(ok=True, analysis=analysis)
+                break
+        record["elapsed"] = time.perf_counter() - start
+        return record
+
+    @staticmethod
+    def _fail(record: dict, error: Exception):
+        record.update(error=str(error), error_type=type(error).__name__)
+
+    def run(self, paths: List[str], skip: Optional[Set[str]] = None) -> Iterator[dict]:
+        """
+        Analyse files concurrently.
+
+        Args:
+            paths: Audio files to analyse
+            skip: Ids (paths) already finished, e.g. from cli.load_finished
+
+        Returns:
+            Iterator of results records in completion order
+        """
+        pending = [path for path in paths if not skip or path not in skip]
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.concurrency)
+        try:
+            futures = [executor.submit(self.analyze, path) for path in pending]
+            for future in concurrent.futures.as_completed(futures):
+                yield future.result()
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
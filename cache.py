@@ -0,0 +1,451 @@
+# ------------------
+#       Meropo
+# ------------------
+import os
+import json
+import time
+import shutil
+import sqlite3
+import hashlib
+import tempfile
+import threading
+from typing import Iterable, Optional, Tuple
+from gradio_client import __version__ as gradio_client_version
+
+CACHE_DIR = os.getenv("MEROPO_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".meropo"))
+
+
+_digest_lock = threading.Lock()
+_digests = {}
+
+
+def file_digest(path: str) -> str:
+    """
+    SHA-256 of a file's content, memoized per (path, size, mtime).
+
+    Args:
+        path: Path of the file to hash
+
+    Returns:
+        Hex digest of the content
+    """
+    stat = os.stat(path)
+    memo_key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    with _digest_lock:
+        digest = _digests.get(memo_key)
+    if digest is None:
+        h = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                h.update(chunk)
+        digest = h.hexdigest()
+        with _digest_lock:
+            _digests[memo_key] = digest
+    return digest
+
+
+def _link_or_copy(src: str, dst: str):
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+
+def _write_json_atomic(path: str, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+class SchemaCache:
+    def __init__(self, path: str = os.path.join(CACHE_DIR, "schema_cache.json")):
+        """
+        Persistent store of resolved Gradio app schemas (app config and API info).
+
+        Entries are keyed by endpoint URL and gradio_client version, and record the
+        remote Gradio version plus a digest of the schema so changes can be detected.
+
+        Args:
+            path: JSON file holding all cached schemas
+        """
+        self.path = path
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(api_url: str) -> str:
+        return f"{api_url.rstrip('/')}@{gradio_client_version}"
+
+    @staticmethod
+    def digest(config: dict, info: dict) -> str:
+        """Hash of the parts of a schema that affect how endpoints are called."""
+        relevant = {
+            "version": config.get("version"),
+            "protocol": config.get("protocol"),
+            "api_prefix": config.get("api_prefix"),
+            "dependencies": config.get("dependencies"),
+            "components": config.get("components"),
+            "info": info,
+        }
+        return hashlib.sha256(json.dumps(relevant, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+    def _load(self) -> dict:
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def get(self, api_url: str) -> Optional[dict]:
+        """
+        Look up the cached schema of an endpoint.
+
+        Args:
+            api_url: The base URL of the API endpoint
+
+        Returns:
+            Dict with "version", "digest", "config", "info" and "saved_at", or None
+        """
+        with self._lock:
+            return self._load().get(self.key(api_url))
+
+    def put(self, api_url: str, config: dict, info: dict) -> dict:
+        """
+        Store the schema of an endpoint, replacing any previous entry.
+
+        Args:
+            api_url: The base URL of the API endpoint
+            config: The Gradio app config fetched by the client
+            info: The API info fetched by the client
+
+        Returns:
+            The stored entry
+        """
+        entry = {
+            "version": config.get("version"),
+            "digest": self.digest(config, info),
+            "config": config,
+            "info": info,
+            "saved_at": time.time(),
+        }
+        with self._lock:
+            schemas = self._load()
+            schemas[self.key(api_url)] = entry
+            _write_json_atomic(self.path, schemas)
+        return entry
+
+    def invalidate(self, api_url: str):
+        """Drop the cached schema of an endpoint."""
+        with self._lock:
+            schemas = self._load()
+            if schemas.pop(self.key(api_url), None) is not None:
+                _write_json_atomic(self.path, schemas)
+
+
+class DiskLRU:
+    def __init__(self, root: str, max_bytes: int):
+        """
+        Directory of files addressed by key, capped in size with least-recently-used eviction.
+
+        Files are sharded by the first two characters of their key. An SQLite index
+        tracks size and last access, so several processes can share one directory.
+
+        Args:
+            root: Directory holding the files and the index
+            max_bytes: Total size above which the least recently used files are evicted
+        """
+        self.root = root
+        self.max_bytes = max_bytes
+        os.makedirs(root, exist_ok=True)
+        self._local = threading.local()
+        with self._db() as db:
+            db.execute("CREATE TABLE IF NOT EXISTS entries ("
+                       "key TEXT PRIMARY KEY, path TEXT NOT NULL, size INTEGER NOT NULL, "
+                       "meta TEXT, last_access REAL NOT NULL)")
+            db.execute("CREATE INDEX IF NOT EXISTS entries_last_access ON entries (last_access)")
+
+    def _db(self) -> sqlite3.Connection:
+        # one connection per thread, reused across calls
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = self._local.db = sqlite3.connect(os.path.join(self.root, "index.sqlite3"), timeout=30)
+        return db
+
+    def path_for(self, key: str, suffix: str = "") -> str:
+        return os.path.join(self.root, key[:2], key + suffix)
+
+    def get(self, key: str) -> Optional[Tuple[str, Optional[str]]]:
+        """
+        Look up a file and mark it as recently used.
+
+        Args:
+            key: Key of the entry
+
+        Returns:
+            (path, meta) of the stored file, or None
+        """
+        with self._db() as db:
+            row = db.execute("SELECT path, meta FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            if not os.path.exists(row[0]):
+                db.execute("DELETE FROM entries WHERE key = ?", (key,))
+                return None
+            db.execute("UPDATE entries SET last_access = ? WHERE key = ?", (time.time(), key))
+        return row[0], row[1]
+
+    def put(self, key: str, src_path: str, meta: Optional[str] = None, move: bool = False) -> str:
+        """
+        Store a file under a key, then evict old entries beyond the size cap.
+
+        Args:
+            key: Key of the entry
+            src_path: File to store
+            meta: Optional text stored alongside the file
+            move: Move src_path into the store (atomic on the same filesystem) instead of copying it
+
+        Returns:
+            Path of the stored file
+        """
+        path = self.path_for(key, os.path.splitext(src_path)[1])
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        if move:
+            shutil.move(src_path, tmp_path)
+        else:
+            _link_or_copy(src_path, tmp_path)
+        os.replace(tmp_path, path)
+        self._index(key, path, meta)
+        return path
+
+    def _index(self, key: str, path: str, meta: Optional[str]):
+        """Record a file already placed at path, then evict old entries beyond the size cap."""
+        with self._db() as db:
+            db.execute("INSERT OR REPLACE INTO entries (key, path, size, meta, last_access) VALUES (?, ?, ?, ?, ?)",
+                       (key, path, os.path.getsize(path), meta, time.time()))
+        self.evict()
+
+    def delete(self, key: str):
+        with self._db() as db:
+            row = db.execute("SELECT path FROM entries WHERE key = ?", (key,)).fetchone()
+            db.execute("DELETE FROM entries WHERE key = ?", (key,))
+        if row is not None and os.path.exists(row[0]):
+            os.remove(row[0])
+
+    def total_bytes(self) -> int:
+        with self._db() as db:
+            return db.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+
+    def evict(self):
+        """Remove least recently used files until the store fits in max_bytes."""
+        with self._db() as db:
+            total = db.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+            if total <= self.max_bytes:
+                return
+            victims = []
+            for key, path, size in db.execute("SELECT key, path, size FROM entries ORDER BY last_access"):
+                if total <= self.max_bytes:
+                    break
+                victims.append((key, path))
+                total -= size
+            db.executemany("DELETE FROM entries WHERE key = ?", [(key,) for key, _ in victims])
+        for _, path in victims:
+            if os.path.exists(path):
+                os.remove(path)
+
+
+class ResultCache(DiskLRU):
+    def __init__(self, root: str = os.path.join(CACHE_DIR, "results"), max_bytes: int = 2 * 1024 ** 3):
+        """
+        Cache of generated audio keyed by a canonical hash of the generation arguments.
+
+        Only deterministic generations (fixed manual_seeds) should be stored.
+
+        Args:
+            root: Directory holding the cached audio
+            max_bytes: Size cap of the cache
+        """
+        super().__init__(root, max_bytes)
+
+    @staticmethod
+    def key(arguments: dict, endpoint: str, file_arguments: Tuple[str, ...] = ("ref_audio_input",)) -> str:
+        """
+        Canonical hash of generation arguments and the endpoint that runs them.
+
+        Local files passed in file_arguments are represented by their content hash,
+        so moving or renaming a reference audio keeps the key stable. The endpoint is
+        part of the key, so servers running different models never share results.
+
+        Args:
+            arguments: All keyword arguments of the generation call
+            endpoint: URL of the server the generation runs on
+            file_arguments: Names of arguments holding file paths
+
+        Returns:
+            Hex digest identifying the generation
+        """
+        canonical = dict(arguments)
+        for name in file_arguments:
+            value = canonical.get(name)
+            if value and os.path.isfile(value):
+                canonical[name] = {"sha256": file_digest(value)}
+        canonical = {"arguments": canonical, "endpoint": endpoint.rstrip('/')}
+        return hashlib.sha256(json.dumps(canonical, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+    def load(self, key: str) -> Optional[Tuple[str, object]]:
+        """
+        Fetch a cached generation.
+
+        The audio is linked (or copied) to a fresh temporary file, so the caller may
+        move or delete it like any freshly downloaded result.
+
+        Args:
+            key: Key from ResultCache.key
+
+        Returns:
+            (audio_file, params) or None
+        """
+        entry = self.get(key)
+        if entry is None:
+            return None
+        path, meta = entry
+        out_path = os.path.join(tempfile.mkdtemp(prefix="meropo_"), os.path.basename(path))
+        _link_or_copy(path, out_path)
+        return out_path, json.loads(meta)
+
+    def store(self, key: str, audio_file: str, params):
+        """
+        Store a generation result; the caller keeps its own audio file.
+
+        Args:
+            key: Key from ResultCache.key
+            audio_file: Generated audio file
+            params: Generation parameters returned by the endpoint
+        """
+        if audio_file and os.path.isfile(audio_file):
+            self.put(key, audio_file, json.dumps(params, ensure_ascii=False, default=str))
+
+    def store_stream(self, key: str, chunks: Iterable[bytes], suffix: str, params) -> str:
+        """
+        Store a generation result whose audio is still on the server.
+
+        Args:
+            key: Key from ResultCache.key
+            chunks: Content of the audio, e.g. MusicAPI.iter_file
+            suffix: File extension including the dot
+            params: Generation parameters returned by the endpoint
+
+        Returns:
+            Path of the stored file
+        """
+        fd, tmp_path = tempfile.mkstemp(prefix="partial_", suffix=suffix, dir=self.root)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for chunk in chunks:
+                    f.write(chunk)
+            return self.put(key, tmp_path, json.dumps(params, ensure_ascii=False, default=str), move=True)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+
+class AnalysisCache:
+    def __init__(self, path: str = os.path.join(CACHE_DIR, "analyses.sqlite3"), ttl: float = 30 * 24 * 3600,
+                 max_entries: int = 2000):
+        """
+        Persistent cache of AI audio analyses.
+
+        Entries are keyed by the audio content hash and everything else that shapes
+        the request (prompt, model, temperature, preprocessing), expire after ttl
+        seconds and are evicted least recently used beyond max_entries. The SQLite
+        file is shared by every process using the same path, e.g. the GUI and scripts.
+
+        Args:
+            path: SQLite file holding the analyses
+            ttl: Age in seconds after which an analysis is no longer returned
+            max_entries: Number of analyses kept
+        """
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._local = threading.local()
+        with self._db() as db:
+            db.execute("CREATE TABLE IF NOT EXISTS analyses ("
+                       "key TEXT PRIMARY KEY, text TEXT NOT NULL, meta TEXT, "
+                       "created_at REAL NOT NULL, last_access REAL NOT NULL)")
+            db.execute("CREATE INDEX IF NOT EXISTS analyses_last_access ON analyses (last_access)")
+
+    def _db(self) -> sqlite3.Connection:
+        # one connection per thread, reused across calls
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = self._local.db = sqlite3.connect(self.path, timeout=30)
+        return db
+
+    @staticmethod
+    def key(audio_path: str, prompt: Optional[str], model: str, temperature: float, **options) -> str:
+        """
+        Hash identifying an analysis request.
+
+        Args:
+            audio_path: Analysed file, represented by its content hash
+            prompt: Analysis prompt (None for the default prompt)
+            model: Model name
+            temperature: Sampling temperature
+            **options: Other settings that change the request, e.g. the preprocessing preset
+
+        Returns:
+            Hex digest identifying the analysis
+        """
+        canonical = {"audio": file_digest(audio_path), "prompt": prompt, "model": model,
+                     "temperature": temperature, "options": options}
+        return hashlib.sha256(json.dumps(canonical, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        """
+        Look up an analysis and mark it as recently used.
+
+        Args:
+            key: Key from AnalysisCache.key
+
+        Returns:
+            The analysis text, or None if missing or expired
+        """
+        now = time.time()
+        with self._db() as db:
+            row = db.execute("SELECT text, created_at FROM analyses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            if row[1] < now - self.ttl:
+                db.execute("DELETE FROM analyses WHERE key = ?", (key,))
+                return None
+            db.execute("UPDATE analyses SET last_access = ? WHERE key = ?", (now, key))
+        return row[0]
+
+    def put(self, key: str, text: str, meta: Optional[dict] = None):
+        """
+        Store an analysis, then drop expired and least recently used entries.
+
+        Args:
+            key: Key from AnalysisCache.key
+            text: Analysis text
+            meta: Optional details kept alongside, e.g. the file name
+        """
+        now = time.time()
+        with self._db() as db:
+            db.execute("INSERT OR REPLACE INTO analyses (key, text, meta, created_at, last_access) "
+                       "VALUES (?, ?, ?, ?, ?)",
+                       (key, text, json.dumps(meta, ensure_ascii=False, default=str) if meta else None, now, now))
+            db.execute("DELETE FROM analyses WHERE created_at < ?", (now - self.ttl,))
+            db.execute("DELETE FROM analyses WHERE key IN (SELECT key FROM analyses "
+                       "ORDER BY last_access DESC LIMIT -1 OFFSET ?)", (self.max_entries,))
+
+    def delete(self, key: str):
+        with self._db() as db:
+            db.execute("DELETE FROM analyses WHERE key = ?", (key,))
+
+    def clear(self):
+        with self._db() as db:
+            db.execute("DELETE FROM analyses")
@@ -0,0 +1,36 @@
+# ------------------
+#       Meropo
+# ------------------
+import concurrent.futures
+from concurrent.futures import Future
+from typing import Callable, Optional
+
+
+class CancelToken:
+    """Cancels the calls it is passed to; cancel() may be called from any thread."""
+
+    def __init__(self):
+        self._future = Future()
+
+    def cancel(self):
+        try:
+            self._future.set_result(True)
+        except concurrent.futures.InvalidStateError:
+            pass  # already cancelled
+
+    @property
+    def cancelled(self) -> bool:
+        return self._future.done()
+
+    def raise_if_cancelled(self):
+        if self.cancelled:
+            raise concurrent.futures.CancelledError("cancelled")
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """Block until the token is cancelled or timeout seconds have passed; returns whether it is cancelled."""
+        concurrent.futures.wait([self._future], timeout=timeout)
+        return self.cancelled
+
+    def add_callback(self, callback: Callable[[], None]):
+        """Call callback once the token is cancelled (right away if it already is)."""
+        self._future.add_done_callback(lambda _: callback())
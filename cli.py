@@ -0,0 +1,296 @@
+# ------------------
+#       Meropo
+# ------------------
+import os
+import sys
+import json
+import time
+import shutil
+import hashlib
+import argparse
+import threading
+import concurrent.futures
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+from api import DEFAULT_API_URL, MusicAPI
+from audio import PRESETS
+from cancel import CancelToken
+
+OPERATIONS = {
+    "generate": "generate_music",
+    "retake": "retake_process_func",
+    "repaint": "repaint_process_func",
+    "edit": "edit_process_func",
+    "extend": "extend_process_func",
+}
+
+# operation -> stage name in the generation index
+STAGES = {"generate": "text2music", "retake": "retake", "repaint": "repaint", "edit": "edit", "extend": "extend"}
+
+
+def load_jobs(path: str) -> Iterator[Tuple[str, str, dict]]:
+    """
+    Read a JSONL job file.
+
+    Each non-empty line is an object with an optional "op" (generate, retake, repaint,
+    edit or extend; default generate), an optional "id" and the keyword arguments of
+    the MusicAPI method, either inline or under "params". Jobs without an id are
+    identified by a hash of their line, so resuming works as long as lines are unchanged.
+
+    Args:
+        path: Path of the job file
+
+    Returns:
+        Iterator of (job_id, op, kwargs)
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        for line_no, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                job = json.loads(line)
+            except ValueError as e:
+                raise ValueError(f"{path}:{line_no}: invalid JSON ({e})") from None
+            op = job.pop("op", "generate")
+            if op not in OPERATIONS:
+                raise ValueError(f"{path}:{line_no}: unknown op {op!r}, expected one of {', '.join(OPERATIONS)}")
+            job_id = job.pop("id", None)
+            if job_id is None:
+                job_id = hashlib.sha256(line.strip().encode('utf-8')).hexdigest()[:16]
+            kwargs = job.pop("params", None) or {}
+            kwargs.update(job)
+            yield str(job_id), op, kwargs
+
+
+def load_finished(results_path: str) -> Set[str]:
+    """
+    Ids of the jobs that already succeeded according to a results file (the checkpoint).
+
+    A line cut short by a crash is ignored, so its job runs again.
+    """
+    finished = set()
+    if not os.path.exists(results_path):
+        return finished
+    with open(results_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if record.get("ok"):
+                finished.add(record["id"])
+    return finished
+
+
+class ResultWriter:
+    def __init__(self, path: str):
+        """
+        Append-only JSONL results file, flushed and synced after every record.
+
+        Args:
+            path: Path of the results file
+        """
+        self._lock = threading.Lock()
+        self._file = open(path, 'a+', encoding='utf-8')
+        self._file.seek(0, os.SEEK_END)
+        if self._file.tell() > 0:
+            # terminate a line cut short by a crash, so the next record starts on its own line
+            self._file.seek(self._file.tell() - 1)
+            if self._file.read(1) != "\n":
+                self._file.write("\n")
+
+    def write(self, record: dict):
+        with self._lock:
+            self._file.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    def close(self):
+        self._file.close()
+
+
+def run_job(api: MusicAPI, job_id: str, op: str, kwargs: dict, output_dir: Optional[str] = None,
+            timeout: Optional[float] = None, cancel_token: Optional[CancelToken] = None) -> dict:
+    """
+    Run one job and describe its outcome as a results record.
+
+    Args:
+        api: Client used for the call
+        job_id: Id of the job
+        op: Operation name, a key of OPERATIONS
+        kwargs: Keyword arguments of the MusicAPI method
+        output_dir: Directory the audio file is moved to, named after the job id
+        timeout: Seconds the remote job may take
+        cancel_token: Cancels the remote job, e.g. on Ctrl-C
+
+    Returns:
+        Dict with id, op, ok, audio_file, request (the job's arguments), params (returned
+        by the server), error, started_at and elapsed
+    """
+    record = {"id": job_id, "op": op, "ok": False, "audio_file": None, "request": kwargs, "params": None,
+              "error": None, "started_at": time.time(), "elapsed": None}
+    start = time.perf_counter()
+    try:
+        audio_file, params = getattr(api, OPERATIONS[op])(**kwargs, timeout=timeout, cancel_token=cancel_token)
+        if output_dir and audio_file:
+            os.makedirs(output_dir, exist_ok=True)
+            target = os.path.join(output_dir, job_id + os.path.splitext(audio_file)[1])
+            shutil.move(audio_file, target)
+            audio_file = target
+        record.update(ok=True, audio_file=audio_file, params=params)
+    except Exception as e:
+        record["error"] = f"{type(e).__name__}: {e}"
+    record["elapsed"] = time.perf_counter() - start
+    return record
+
+
+def make_api(endpoints: List[str], cache_results: bool) -> MusicAPI:
+    if len(endpoints) > 1:
+        from pool import MusicAPIPool
+        return MusicAPIPool(endpoints, cache_results=cache_results)
+    return MusicAPI(endpoints[0], cache_results=cache_results)
+
+
+def cmd_run(args: argparse.Namespace) -> int:
+    try:
+        jobs = list(load_jobs(args.jobs))
+    except (OSError, ValueError) as e:
+        print(e, file=sys.stderr)
+        return 2
+    counts: Dict[str, int] = {}
+    for job_id, _, _ in jobs:
+        counts[job_id] = counts.get(job_id, 0) + 1
+    duplicates = [job_id for job_id, count in counts.items() if count > 1]
+    if duplicates:
+        print(f"duplicate job ids: {', '.join(duplicates[:10])}", file=sys.stderr)
+        return 2
+
+    results_path = args.results or os.path.splitext(args.jobs)[0] + ".results.jsonl"
+    finished = load_finished(results_path)
+    pending = [job for job in jobs if job[0] not in finished]
+    print(f"{len(jobs)} jobs, {len(jobs) - len(pending)} already finished, {len(pending)} to run", file=sys.stderr)
+    if not pending:
+        return 0
+
+    from generations import GenerationIndex
+    api = make_api(args.endpoint or [DEFAULT_API_URL], cache_results=not args.no_cache)
+    index = GenerationIndex()
+    writer = ResultWriter(results_path)
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=args.concurrency)
+    cancel_tokens = [CancelToken() for _ in pending]
+    failed = 0
+    try:
+        futures = [executor.submit(run_job, api, job_id, op, kwargs, args.output_dir, args.timeout, cancel_token)
+                   for (job_id, op, kwargs), cancel_token in zip(pending, cancel_tokens)]
+        for done, future in enumerate(concurrent.futures.as_completed(futures), 1):
+            record = future.result()
+            writer.write(record)
+            if record["ok"]:
+                index.add(STAGES[record["op"]], record["audio_file"], record["params"],
+                          request=record["request"], endpoint=getattr(api, "api_url", None),
+                          elapsed=record["elapsed"])
+            else:
+                failed += 1
+            print(f"[{done}/{len(pending)}] {record['id']} {'ok' if record['ok'] else 'FAILED'} "
+                  f"{record['elapsed']:.1f}s {record['audio_file'] or record['error']}", file=sys.stderr)
+    except KeyboardInterrupt:
+        # stop the running jobs too (queued ones are dropped below), so the process can exit
+        for cancel_token in cancel_tokens:
+            cancel_token.cancel()
+        print("interrupted, finished jobs are recorded; run again to resume", file=sys.stderr)
+        return 130
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+        writer.close()
+    return 1 if failed else 0
+
+
+def cmd_analyze(args: argparse.Namespace) -> int:
+    from api import AI
+    from bulk import BulkAnalyzer, RateLimiter, iter_audio_files
+    try:
+        paths = list(iter_audio_files(args.inputs))
+    except OSError as e:
+        print(e, file=sys.stderr)
+        return 2
+    results_path = args.results or "analyses.results.jsonl"
+    finished = load_finished(results_path)
+    pending = [path for path in paths if path not in finished]
+    print(f"{len(paths)} files, {len(paths) - len(pending)} already analysed, {len(pending)} to analyse",
+          file=sys.stderr)
+    if not pending:
+        return 0
+
+    ai = AI(cache_analyses=not args.no_cache)
+    ai.client = ai.client.with_options(max_retries=0)  # 429s are retried by BulkAnalyzer, which pauses all workers
+    cancel_token = CancelToken()
+    analyzer = BulkAnalyzer(ai, RateLimiter(args.rpm, args.tpm), concurrency=args.concurrency,
+                            max_retries=args.retries, tokens_per_request=args.tokens_per_request,
+                            timeout=args.timeout, cancel_token=cancel_token, analysis_prompt=args.prompt,
+                            preset=None if args.preset == "original" else args.preset,
+                            upload_audio=not args.features_only, refresh=args.refresh)
+    writer = ResultWriter(results_path)
+    records = analyzer.run(pending)
+    failed = 0
+    try:
+        for done, record in enumerate(records, 1):
+            writer.write(record)
+            if not record["ok"]:
+                failed += 1
+            status = "cached" if record["cached"] else "ok" if record["ok"] else "FAILED"
+            detail = "" if record["ok"] else f" {record['error_type']}: {record['error']}"
+            print(f"[{done}/{len(pending)}] {record['file']} {status} {record['elapsed']:.1f}s "
+                  f"attempts {record['attempts']}{detail}", file=sys.stderr)
+    except KeyboardInterrupt:
+        # abort the requests in flight as well (queued files are dropped below), so the process can exit
+        cancel_token.cancel()
+        print("interrupted, finished analyses are recorded; run again to resume", file=sys.stderr)
+        return 130
+    finally:
+        records.close()
+        writer.close()
+    return 1 if failed else 0
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="meropo", description="Headless Meropo batch runner")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run = subparsers.add_parser("run", help="run a JSONL job file, resuming from its results file")
+    run.add_argument("jobs", help="JSONL file, one job per line: {\"id\": ..., \"op\": ..., <MusicAPI kwargs>}")
+    run.add_argument("--results", help="results JSONL, also the checkpoint (default: <jobs>.results.jsonl)")
+    run.add_argument("--concurrency", type=int, default=4, help="jobs running at once (default: 4)")
+    run.add_argument("--endpoint", action="append",
+                     help="ACE-Step endpoint URL; repeat to load-balance over several replicas")
+    run.add_argument("--output-dir", help="move audio files here, named after the job id")
+    run.add_argument("--timeout", type=float, help="seconds a single job may take")
+    run.add_argument("--no-cache", action="store_true", help="do not use the on-disk result cache")
+    run.set_defaults(func=cmd_run)
+
+    analyze = subparsers.add_parser("analyze", help="AI-analyse audio files within the provider's rate limits")
+    analyze.add_argument("inputs", nargs="+",
+                         help="audio files, directories (searched recursively) or .txt/.lst files of paths")
+    analyze.add_argument("--results", help="results JSONL, also the checkpoint (default: analyses.results.jsonl)")
+    analyze.add_argument("--concurrency", type=int, default=4, help="analyses in flight at once (default: 4)")
+    analyze.add_argument("--rpm", type=float, default=20, help="requests per minute allowed (default: 20)")
+    analyze.add_argument("--tpm", type=float, help="tokens per minute allowed (default: unlimited)")
+    analyze.add_argument("--tokens-per-request", type=int, default=4000,
+                         help="estimated tokens of a request besides the prompt, for --tpm (default: 4000)")
+    analyze.add_argument("--retries", type=int, default=5, help="retries after 429s and transient errors")
+    analyze.add_argument("--timeout", type=float, default=300, help="seconds a single request may take")
+    analyze.add_argument("--prompt", help="analysis prompt (default: the built-in critique prompt)")
+    analyze.add_argument("--preset", default="balanced", choices=[*PRESETS, "original"],
+                         help="upload preset: compact, balanced, high or original (default: balanced)")
+    analyze.add_argument("--features-only", action="store_true", help="send only locally extracted features")
+    analyze.add_argument("--refresh", action="store_true", help="ignore cached analyses")
+    analyze.add_argument("--no-cache", action="store_true", help="do not use the on-disk analysis cache")
+    analyze.set_defaults(func=cmd_analyze)
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = build_parser().parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,215 @@
+# ------------------
+#       Meropo
+# ------------------
+"""
+Local stand-in for the ACE-Step Gradio app, for benchmarks and offline development.
+
+Exposes the same api names and parameters as the endpoints wrapped by MusicAPI, sleeps
+for a configurable latency while reporting gr.Progress steps, and returns a generated
+sine-tone WAV plus an echo of the parameters. Requires the gradio package:
+
+    pip install gradio
+    python fake_server.py --port 7865 --latency 2 --concurrency 4
+"""
+import os
+import sys
+import math
+import time
+import wave
+import random
+import inspect
+import argparse
+import tempfile
+import functools
+from array import array
+from typing import Optional, Union, get_args, get_origin
+import gradio as gr
+from api import MusicAPI
+
+# api name -> MusicAPI method wrapping it
+ENDPOINTS = {
+    "/__call__": "generate_music",
+    "/retake_process_func": "retake_process_func",
+    "/repaint_process_func": "repaint_process_func",
+    "/edit_process_func": "edit_process_func",
+    "/extend_process_func": "extend_process_func",
+    "/sample_data": "sample_data",
+    "/load_data": "load_data",
+    "/lambda": "lambda_func",
+    "/lambda_1": "lambda_func_1",
+    "/lambda_2": "lambda_func_2",
+    "/edit_type_change_func": "edit_type_change_func",
+    "/update_tags_from_preset": "update_tags_from_preset",
+    "/toggle_ref_audio_visibility": "toggle_ref_audio_visibilitity",
+}
+# chained endpoint -> (source parameter, own JSON parameter, upload parameter)
+CHAINED_ENDPOINTS = {
+    "/repaint_process_func": ("repaint_source", "repaint_json_data", "repaint_source_audio_upload"),
+    "/edit_process_func": ("edit_source", "edit_input_params_json", "edit_source_audio_upload"),
+    "/extend_process_func": ("extend_source", "extend_input_params_json", "extend_source_audio_upload"),
+}
+AUDIO_ENDPOINTS = {"/__call__", "/retake_process_func", "/repaint_process_func", "/edit_process_func",
+                   "/extend_process_func"}
+CLIENT_ONLY_PARAMETERS = {"self", "on_status", "timeout", "cancel_token"}
+FILE_PARAMETERS = {"ref_audio_input", "repaint_source_audio_upload", "edit_source_audio_upload",
+                   "extend_source_audio_upload", "json_file"}
+
+# the 21 values returned by /sample_data and /load_data, in order
+SAMPLE_DATA = ["audio_duration", "prompt", "lyrics", "infer_step", "guidance_scale", "scheduler_type", "cfg_type",
+               "omega_scale", "manual_seeds", "guidance_interval", "guidance_interval_decay", "min_guidance_scale",
+               "use_erg_tag", "use_erg_lyric", "use_erg_diffusion", "oss_steps", "guidance_scale_text",
+               "guidance_scale_lyric", "audio2audio_enable", "ref_audio_strength", "lora_name_or_path"]
+
+
+@functools.lru_cache(maxsize=4)
+def _tone_second(sample_rate: int, frequency: float) -> bytes:
+    return array('h', (int(8000 * math.sin(2 * math.pi * frequency * i / sample_rate))
+                       for i in range(sample_rate))).tobytes()
+
+
+def write_tone(path: str, seconds: float, sample_rate: int = 44100, frequency: float = 440.0):
+    """Write a mono 16-bit sine tone WAV (whole seconds repeat, so the server spends no CPU on audio)."""
+    second = _tone_second(sample_rate, frequency)
+    size = int(seconds * sample_rate) * 2
+    with wave.open(path, 'wb') as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(sample_rate)
+        w.writeframes((second * (size // len(second) + 1))[:size])
+
+
+def input_component(name: str, annotation):
+    if name in FILE_PARAMETERS:
+        return gr.File(label=name) if name == "json_file" else gr.Audio(type='filepath', label=name)
+    if name.endswith(("json_data", "params_json")):
+        return gr.JSON(label=name)
+    if get_origin(annotation) is Union:
+        annotation = next((arg for arg in get_args(annotation) if arg is not type(None)), str)
+    if annotation is bool:
+        return gr.Checkbox(label=name)
+    if annotation in (int, float):
+        return gr.Number(label=name)
+    return gr.Textbox(label=name)
+
+
+def output_component(value):
+    if isinstance(value, bool):
+        return gr.Checkbox()
+    if isinstance(value, (int, float)):
+        return gr.Number()
+    return gr.Textbox()
+
+
+class FakeAceStep:
+    def __init__(self, latency: float = 1.0, jitter: float = 0.0, steps: int = 10, audio_seconds: float = 10.0):
+        """
+        Args:
+            latency: Mean seconds an audio endpoint takes
+            jitter: Relative random spread of the latency (0.2 = +-20%)
+            steps: Number of progress steps reported per audio call
+            audio_seconds: Length of the generated audio when audio_duration is not positive
+        """
+        self.latency = latency
+        self.jitter = jitter
+        self.steps = steps
+        self.audio_seconds = audio_seconds
+        self.defaults = {name: parameter.default for name, parameter
+                         in inspect.signature(MusicAPI.generate_music).parameters.items()
+                         if name not in CLIENT_ONLY_PARAMETERS}
+
+    @staticmethod
+    def source_audio(api_name: str, arguments: dict) -> Optional[str]:
+        """Resolve the input audio of a chained call the way ACE-Step does, failing on a stale path."""
+        if api_name not in CHAINED_ENDPOINTS:
+            return None
+        source_name, json_name, upload_name = CHAINED_ENDPOINTS[api_name]
+        source = arguments.get(source_name)
+        if source == "upload":
+            path = arguments.get(upload_name)
+        else:
+            json_data = arguments.get("text2music_json_data" if source == "text2music" else json_name) or {}
+            path = json_data.get("audio_path") if isinstance(json_data, dict) else None
+        if not path or not os.path.isfile(path):
+            raise gr.Error(f"source audio of {source!r} not found: {path}")
+        return path
+
+    def audio_call(self, api_name: str, arguments: dict, progress: gr.Progress):
+        source_audio = self.source_audio(api_name, arguments)
+        latency = self.latency * (1 + random.uniform(-self.jitter, self.jitter))
+        for _ in progress.tqdm(range(self.steps), desc=api_name.strip("/")):
+            time.sleep(latency / self.steps)
+        try:
+            seconds = float(arguments.get("audio_duration") or -1)
+        except (TypeError, ValueError):
+            seconds = -1
+        extension = arguments.get("format") if arguments.get("format") in ("wav", "mp3", "ogg", "flac") else "wav"
+        fd, path = tempfile.mkstemp(prefix="fake_acestep_", suffix="." + extension)
+        os.close(fd)
+        # always WAV data; the suffix only mirrors the requested format
+        write_tone(path, seconds if seconds > 0 else self.audio_seconds)
+        params = {name: value for name, value in arguments.items() if not isinstance(value, bytes)}
+        params["audio_path"] = path
+        params["task"] = api_name.strip("/")
+        if source_audio is not None:
+            params["src_audio_path"] = source_audio
+        return path, params
+
+    def handler(self, api_name: str, parameters: list):
+        def fn(*args, progress=gr.Progress()):
+            arguments = dict(zip(parameters, args))
+            if api_name in AUDIO_ENDPOINTS:
+                return self.audio_call(api_name, arguments, progress)
+            if api_name in ("/sample_data", "/load_data"):
+                return tuple(self.defaults[name] if self.defaults[name] is not None else "" for name in SAMPLE_DATA)
+            if api_name == "/edit_type_change_func":
+                return (0.6, 1.0) if arguments.get("edit_type") == "only_lyrics" else (0.2, 0.4)
+            if api_name == "/toggle_ref_audio_visibility":
+                return None, 0.5
+            if api_name == "/update_tags_from_preset":
+                return self.defaults["prompt"]
+            return None  # /lambda*: the real app only toggles component visibility
+
+        fn.__signature__ = inspect.Signature(
+            [inspect.Parameter(name, inspect.Parameter.POSITIONAL_OR_KEYWORD) for name in parameters] +
+            [inspect.Parameter("progress", inspect.Parameter.KEYWORD_ONLY, default=gr.Progress())])
+        return fn
+
+    def outputs(self, api_name: str) -> list:
+        if api_name in AUDIO_ENDPOINTS:
+            return [gr.Audio(type='filepath'), gr.JSON()]
+        if api_name in ("/sample_data", "/load_data"):
+            return [output_component(self.defaults[name]) for name in SAMPLE_DATA]
+        if api_name == "/edit_type_change_func":
+            return [gr.Number(), gr.Number()]
+        if api_name == "/toggle_ref_audio_visibility":
+            return [gr.Audio(type='filepath'), gr.Number()]
+        return [gr.Textbox()]
+
+    def build(self, concurrency: int = 4) -> gr.Blocks:
+        with gr.Blocks(title="Fake ACE-Step") as demo:
+            for api_name, method in ENDPOINTS.items():
+                signature = inspect.signature(getattr(MusicAPI, method))
+                parameters = [name for name in signature.parameters if name not in CLIENT_ONLY_PARAMETERS]
+                inputs = [input_component(name, signature.parameters[name].annotation) for name in parameters]
+                gr.Button(api_name).click(self.handler(api_name, parameters), inputs, self.outputs(api_name),
+                                          api_name=api_name.strip("/"))
+        demo.queue(default_concurrency_limit=concurrency)
+        return demo
+
+
+def main(argv: Optional[list] = None):
+    parser = argparse.ArgumentParser(description="Local stand-in for the ACE-Step Gradio app")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=7865)
+    parser.add_argument("--latency", type=float, default=1.0, help="mean seconds per audio call (default: 1)")
+    parser.add_argument("--jitter", type=float, default=0.0, help="relative latency spread, e.g. 0.2 for +-20%%")
+    parser.add_argument("--steps", type=int, default=10, help="progress steps reported per audio call")
+    parser.add_argument("--audio-seconds", type=float, default=10.0, help="length of the generated audio")
+    parser.add_argument("--concurrency", type=int, default=4, help="jobs the fake GPU runs at once")
+    args = parser.parse_args(argv)
+    app = FakeAceStep(args.latency, args.jitter, args.steps, args.audio_seconds)
+    app.build(args.concurrency).launch(server_name=args.host, server_port=args.port, quiet=True)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,395 @@
+# ------------------
+#       Meropo
+# ------------------
+"""
+Local audio descriptors computed with NumPy: tempo, key, loudness, spectral centroid,
+dynamic range and section boundaries.
+
+The descriptor is small enough to put into an analysis prompt, so a model can critique
+a track from a few hundred bytes of text instead of megabytes of uploaded audio.
+"""
+import math
+from dataclasses import asdict, dataclass, field
+from typing import List, Optional, Tuple
+import numpy as np
+from audio import AudioSource, decode, resample_blocks
+
+ANALYSIS_RATE = 22050  # rate of the mono signal used for tempo, key, centroid and sections
+N_FFT = 2048
+HOP = 512
+BLOCK_SECONDS = 0.1  # loudness block length
+CHUNK_BLOCKS = 600  # loudness blocks read from the source at once (one minute)
+# smallest differences between neighbouring sections that are reported as a boundary
+MIN_CHROMA_DISTANCE = 0.02  # cosine distance of the mean chroma
+MIN_LEVEL_DB = 1.0  # difference of the mean spectral energy
+MIN_BRIGHTNESS_OCTAVES = 0.1  # difference of the mean spectral centroid
+MAX_SECTIONS = 12
+PITCH_CLASSES = ["C", "C#", "D", "D#", "E", "F", "F#", "G", "G#", "A", "A#", "B"]
+# Krumhansl-Kessler key profiles, tonic first
+MAJOR_PROFILE = np.array([6.35, 2.23, 3.48, 2.33, 4.38, 4.09, 2.52, 5.19, 2.39, 3.66, 2.29, 2.88])
+MINOR_PROFILE = np.array([6.33, 2.68, 3.52, 5.38, 2.60, 3.53, 2.54, 4.75, 3.98, 2.69, 3.34, 3.17])
+
+
+@dataclass
+class Section:
+    start: float  # seconds
+    end: float
+    loudness_lufs: Optional[float]
+
+
+@dataclass
+class AudioFeatures:
+    duration: float  # seconds
+    sample_rate: int
+    channels: int
+    bpm: Optional[float]
+    tempo_confidence: float  # 0..1, autocorrelation of the onset envelope at the chosen tempo
+    key: Optional[str]  # e.g. "A minor"
+    key_confidence: float  # correlation with the key profile, -1..1
+    loudness_lufs: Optional[float]  # integrated loudness (ITU-R BS.1770)
+    loudness_range_lu: Optional[float]  # EBU R 128 loudness range
+    peak_dbfs: Optional[float]
+    crest_factor_db: Optional[float]  # peak to RMS ratio
+    spectral_centroid_hz: Optional[float]
+    sections: List[Section] = field(default_factory=list)
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+    def describe(self) -> str:
+        """Compact Chinese summary for an analysis prompt."""
+
+        def number(value, digits=1, unit=""):
+            return "未知" if value is None else f"{value:.{digits}f}{unit}"
+
+        lines = [
+            f"- 时长：{self.duration:.1f} 秒（{self.sample_rate} Hz，{self.channels} 声道）",
+            f"- 速度：约 {number(self.bpm)} BPM（置信度 {self.tempo_confidence:.2f}）"
+            if self.bpm is not None and self.tempo_confidence >= 0.1 else "- 速度：无明显节拍",
+            f"- 调性估计：{self.key or '未知'}（相关系数 {self.key_confidence:.2f}）",
+            f"- 响度：{number(self.loudness_lufs, unit=' LUFS')}，响度范围 {number(self.loudness_range_lu, unit=' LU')}，"
+            f"峰值 {number(self.peak_dbfs, unit=' dBFS')}，峰均比 {number(self.crest_factor_db, unit=' dB')}",
+            f"- 频谱质心：{number(self.spectral_centroid_hz, 0, ' Hz')}",
+        ]
+        if len(self.sections) > 1:
+            parts = "；".join(f"{s.start:.0f}-{s.end:.0f}秒 {number(s.loudness_lufs, unit=' LUFS')}"
+                             for s in self.sections)
+            lines.append(f"- 段落（起止时间与响度）：{parts}")
+        return "\n".join(lines)
+
+
+def _biquad_power(b: Tuple[float, float, float], a: Tuple[float, float, float], freqs: np.ndarray,
+                  sample_rate: int) -> np.ndarray:
+    z = np.exp(-1j * 2 * np.pi * freqs / sample_rate)
+    return np.abs((b[0] + b[1] * z + b[2] * z * z) / (a[0] + a[1] * z + a[2] * z * z)) ** 2
+
+
+def k_weighting(freqs: np.ndarray, sample_rate: int) -> np.ndarray:
+    """Power response of the BS.1770 K-weighting filter (high shelf + high pass) at the given frequencies."""
+    # stage 1: +4 dB high shelf around 1.5 kHz
+    gain, q, fc = 4.0, 1 / math.sqrt(2), 1500.0
+    amp = 10 ** (gain / 40)
+    w0 = 2 * math.pi * fc / sample_rate
+    alpha = math.sin(w0) / (2 * q)
+    cos, root = math.cos(w0), 2 * math.sqrt(amp) * alpha
+    shelf = _biquad_power(
+        (amp * ((amp + 1) + (amp - 1) * cos + root), -2 * amp * ((amp - 1) + (amp + 1) * cos),
+         amp * ((amp + 1) + (amp - 1) * cos - root)),
+        ((amp + 1) - (amp - 1) * cos + root, 2 * ((amp - 1) - (amp + 1) * cos), (amp + 1) - (amp - 1) * cos - root),
+        freqs, sample_rate)
+    # stage 2: high pass at 38 Hz
+    w0 = 2 * math.pi * 38.0 / sample_rate
+    alpha, cos = math.sin(w0) / (2 * 0.5), math.cos(w0)
+    high_pass = _biquad_power(((1 + cos) / 2, -(1 + cos), (1 + cos) / 2), (1 + alpha, -2 * cos, 1 - alpha),
+                              freqs, sample_rate)
+    return shelf * high_pass
+
+
+def weighted_power(samples: np.ndarray, sample_rate: int, block_seconds: float = BLOCK_SECONDS,
+                   chunk_blocks: int = 512) -> np.ndarray:
+    """
+    K-weighted mean square of consecutive blocks, summed over channels.
+
+    Each block is weighted in the frequency domain (Parseval), which avoids running
+    IIR filters sample by sample.
+
+    Args:
+        samples: float32 samples with shape (frames, channels)
+        sample_rate: Sample rate of samples
+        block_seconds: Block length
+        chunk_blocks: Blocks transformed at once, bounding memory
+
+    Returns:
+        Array with one power value per block
+    """
+    size = max(2, int(block_seconds * sample_rate))
+    blocks = len(samples) // size
+    freqs = np.fft.rfftfreq(size, 1 / sample_rate)
+    # one-sided spectrum: interior bins count twice
+    weights = k_weighting(freqs, sample_rate) * np.where((freqs > 0) & (freqs < sample_rate / 2), 2.0, 1.0)
+    weights = (weights / size ** 2).astype(np.float32)
+    power = np.zeros(blocks, dtype=np.float64)
+    for channel in range(samples.shape[1]):
+        signal = samples[:blocks * size, channel].reshape(blocks, size)
+        for start in range(0, blocks, chunk_blocks):
+            spectrum = np.fft.rfft(signal[start:start + chunk_blocks], axis=1)
+            power[start:start + chunk_blocks] += (np.square(np.abs(spectrum)) @ weights)
+    return power
+
+
+def _moving_mean(values: np.ndarray, window: int) -> np.ndarray:
+    if len(values) < window:
+        return np.array([])
+    cumulative = np.concatenate(([0.0], np.cumsum(values)))
+    return (cumulative[window:] - cumulative[:-window]) / window
+
+
+def _lufs(power) -> Optional[float]:
+    return -0.691 + 10 * math.log10(power) if power > 0 else None
+
+
+def integrated_loudness(block_power: np.ndarray) -> Optional[float]:
+    """Gated integrated loudness from 100 ms block powers (400 ms windows, 75% overlap)."""
+    momentary = _moving_mean(block_power, 4)
+    momentary = momentary[momentary > 0]
+    gated = momentary[-0.691 + 10 * np.log10(momentary) > -70]
+    if not len(gated):
+        return None
+    relative_gate = -0.691 + 10 * math.log10(gated.mean()) - 10
+    gated = gated[-0.691 + 10 * np.log10(gated) > relative_gate]
+    return _lufs(gated.mean()) if len(gated) else None
+
+
+def loudness_range(block_power: np.ndarray) -> Optional[float]:
+    """EBU Tech 3342 loudness range from 100 ms block powers (3 s short-term windows)."""
+    short_term = _moving_mean(block_power, 30)
+    short_term = short_term[short_term > 0]
+    levels = -0.691 + 10 * np.log10(short_term)
+    levels = levels[levels > -70]
+    if len(levels) < 2:
+        return None
+    relative_gate = -0.691 + 10 * math.log10(np.mean(10 ** ((levels + 0.691) / 10))) - 20
+    levels = levels[levels > relative_gate]
+    return float(np.percentile(levels, 95) - np.percentile(levels, 10)) if len(levels) >= 2 else None
+
+
+def frame_features(mono: np.ndarray, sample_rate: int, chunk_frames: int = 512):
+    """
+    Short-time spectral features of a mono signal, computed chunk by chunk.
+
+    Returns:
+        (centroid, flux, chroma, energy): per-frame spectral centroid in Hz, positive
+        log-spectral flux, 12-bin chroma and spectral energy
+    """
+    if len(mono) < N_FFT:
+        mono = np.pad(mono, (0, N_FFT - len(mono)))
+    frames = np.lib.stride_tricks.sliding_window_view(mono, N_FFT)[::HOP]
+    window = np.hanning(N_FFT).astype(np.float32)
+    freqs = np.fft.rfftfreq(N_FFT, 1 / sample_rate)
+    pitched = (freqs >= 55) & (freqs <= 4200)
+    pitch_class = (np.round(12 * np.log2(freqs[pitched] / 440.0)).astype(int) + 9) % 12
+    chroma_map = np.zeros((int(pitched.sum()), 12), dtype=np.float32)
+    chroma_map[np.arange(len(pitch_class)), pitch_class] = 1
+
+    centroid, flux, chroma, energy = [], [], [], []
+    previous = None
+    for start in range(0, len(frames), chunk_frames):
+        magnitude = np.abs(np.fft.rfft(frames[start:start + chunk_frames] * window, axis=1)).astype(np.float32)
+        total = magnitude.sum(axis=1)
+        centroid.append((magnitude @ freqs.astype(np.float32)) / np.maximum(total, 1e-10))
+        log_magnitude = np.log1p(1000 * magnitude)
+        before = log_magnitude[:1] if previous is None else previous  # the first frame has no flux
+        flux.append(np.maximum(np.diff(np.vstack([before, log_magnitude]), axis=0), 0).sum(axis=1))
+        previous = log_magnitude[-1:]
+        power = np.square(magnitude)
+        chroma.append(power[:, pitched] @ chroma_map)
+        energy.append(power.sum(axis=1))
+    return np.concatenate(centroid), np.concatenate(flux), np.concatenate(chroma), np.concatenate(energy)
+
+
+def estimate_tempo(flux: np.ndarray, frame_rate: float, min_bpm: float = 60,
+                   max_bpm: float = 200) -> Tuple[Optional[float], float]:
+    """
+    Tempo from the autocorrelation of the onset envelope, weighted towards 120 BPM.
+
+    Returns:
+        (bpm, confidence)
+    """
+    if len(flux) < 4:
+        return None, 0.0
+    onset = np.maximum(flux - _smooth(flux, int(frame_rate)), 0)
+    if not onset.any():
+        return None, 0.0
+    n = 1 << (2 * len(onset) - 1).bit_length()
+    spectrum = np.fft.rfft(onset - onset.mean(), n)
+    acf = np.fft.irfft(np.square(np.abs(spectrum)), n)[:len(onset)]
+    if acf[0] <= 0:
+        return None, 0.0
+    acf = acf / acf[0]
+    # the peak needs a neighbour on each side for the interpolation below
+    lags = np.arange(max(1, int(60 * frame_rate / max_bpm)), min(len(acf) - 2, int(60 * frame_rate / min_bpm)) + 1)
+    if not len(lags):
+        return None, 0.0
+    prior = np.exp(-0.5 * np.log2(60 * frame_rate / lags / 120) ** 2)
+    best = lags[int(np.argmax(acf[lags] * prior))]
+    # parabolic interpolation around the peak for sub-frame lag resolution
+    left, centre, right = acf[best - 1], acf[best], acf[best + 1]
+    denominator = left - 2 * centre + right
+    offset = 0.5 * (left - right) / denominator if denominator < 0 else 0.0
+    return 60 * frame_rate / (best + offset), float(max(0.0, min(1.0, centre)))
+
+
+def _smooth(values: np.ndarray, window: int) -> np.ndarray:
+    if not len(values):
+        return values
+    window = max(1, min(window, len(values)))  # a longer window would lengthen the 'same' output
+    return np.convolve(values, np.ones(window) / window, mode='same')
+
+
+def estimate_key(chroma: np.ndarray) -> Tuple[Optional[str], float]:
+    """
+    Key by correlating the track's chroma with the 24 rotated Krumhansl-Kessler profiles.
+
+    Returns:
+        (key name such as "A minor", correlation)
+    """
+    profile = np.sqrt(chroma.sum(axis=0))
+    if not profile.any():
+        return None, 0.0
+    rotations = (np.arange(12)[None, :] - np.arange(12)[:, None]) % 12  # row k: profile with tonic k
+    candidates = np.vstack([MAJOR_PROFILE[rotations], MINOR_PROFILE[rotations]])
+    candidates = candidates - candidates.mean(axis=1, keepdims=True)
+    centred = profile - profile.mean()
+    scores = candidates @ centred / (np.linalg.norm(candidates, axis=1) * np.linalg.norm(centred))
+    best = int(np.argmax(scores))
+    return f"{PITCH_CLASSES[best % 12]} {'major' if best < 12 else 'minor'}", float(scores[best])
+
+
+def _contrast(chroma: np.ndarray, energy: np.ndarray, centroid: np.ndarray, start: int, boundary: int,
+              end: int) -> float:
+    """How clearly [start, boundary) differs from [boundary, end), in multiples of the smallest reported difference."""
+    left, right = chroma[start:boundary].mean(axis=0), chroma[boundary:end].mean(axis=0)
+    distance = 1 - left @ right / max(float(np.linalg.norm(left) * np.linalg.norm(right)), 1e-10)
+    level = abs(10 * math.log10(max(energy[start:boundary].mean(), 1e-10) / max(energy[boundary:end].mean(), 1e-10)))
+    brightness = abs(math.log2(max(centroid[start:boundary].mean(), 1.0) / max(centroid[boundary:end].mean(), 1.0)))
+    return max(distance / MIN_CHROMA_DISTANCE, level / MIN_LEVEL_DB, brightness / MIN_BRIGHTNESS_OCTAVES)
+
+
+def section_boundaries(chroma: np.ndarray, energy: np.ndarray, centroid: np.ndarray, frame_rate: float,
+                       kernel_seconds: int = 8, min_seconds: float = 8.0,
+                       max_sections: int = MAX_SECTIONS) -> List[float]:
+    """
+    Section boundaries as peaks of a checkerboard-kernel novelty curve over a
+    self-similarity matrix of one-second feature summaries.
+
+    The novelty curve is relative to the track, so even steady noise has peaks.
+    A peak is only kept if the sections on either side differ by an absolute
+    amount in chroma, level or brightness; the weakest boundaries are merged
+    until that holds and at most max_sections remain.
+
+    Returns:
+        Boundary times in seconds, excluding the start and end of the track
+    """
+    per_second = max(1, int(round(frame_rate)))
+    seconds = len(energy) // per_second
+    if seconds < 4 * kernel_seconds:
+        return []
+    cut = seconds * per_second
+
+    def pool(values):
+        return values[:cut].reshape(seconds, per_second, -1).mean(axis=1)
+
+    chroma_s = pool(chroma)
+    chroma_s = chroma_s / np.maximum(chroma_s.sum(axis=1, keepdims=True), 1e-10)
+    energy_s, centroid_s = pool(energy[:, None])[:, 0], pool(centroid[:, None])[:, 0]
+    summary = np.hstack([chroma_s, np.log1p(energy_s[:, None]), centroid_s[:, None] / 1000])
+    summary = (summary - summary.mean(axis=0)) / np.maximum(summary.std(axis=0), 1e-10)
+    summary = summary / np.maximum(np.linalg.norm(summary, axis=1, keepdims=True), 1e-10)
+    similarity = summary @ summary.T
+
+    half = kernel_seconds
+    signs = np.sign(np.arange(-half, half) + 0.5)
+    taper = np.exp(-0.5 * (np.arange(-half, half) + 0.5) ** 2 / (half / 2) ** 2)
+    kernel = np.outer(signs * taper, signs * taper)
+    padded = np.pad(similarity, half, mode='edge')
+    windows = np.lib.stride_tricks.sliding_window_view(padded, (2 * half, 2 * half))
+    diagonal = windows[np.arange(seconds), np.arange(seconds)]
+    novelty = (diagonal * kernel).sum(axis=(1, 2))
+
+    threshold = novelty.mean() + 0.5 * novelty.std()
+    peaks = np.flatnonzero((novelty[1:-1] > novelty[:-2]) & (novelty[1:-1] >= novelty[2:]) &
+                           (novelty[1:-1] > threshold)) + 1
+    boundaries = []
+    for peak in sorted(peaks, key=lambda p: -novelty[p]):
+        if min_seconds <= peak <= seconds - min_seconds and all(abs(peak - b) >= min_seconds for b in boundaries):
+            boundaries.append(peak)
+    boundaries.sort()
+    while boundaries:
+        edges = [0] + boundaries + [seconds]
+        contrasts = [_contrast(chroma_s, energy_s, centroid_s, *edges[i:i + 3]) for i in range(len(boundaries))]
+        weakest = int(np.argmin(contrasts))
+        if contrasts[weakest] >= 1 and len(boundaries) < max_sections:
+            break
+        del boundaries[weakest]
+    return [float(b) for b in boundaries]
+
+
+def extract_features(path: Optional[str] = None, source: Optional[AudioSource] = None) -> AudioFeatures:
+    """
+    Compute the descriptor of an audio file.
+
+    The source is read one chunk at a time: loudness, peak and RMS are accumulated
+    per chunk, and only the mono signal at ANALYSIS_RATE is kept in memory.
+
+    Args:
+        path: Audio file to analyse
+        source: Already opened source of path, to avoid decoding twice
+
+    Returns:
+        AudioFeatures of the track
+    """
+    source = source if source is not None else decode(path)
+    sample_rate = source.sample_rate
+    duration = source.duration
+    # whole loudness blocks per chunk, so the chunks' block powers concatenate seamlessly
+    chunk = max(2, int(BLOCK_SECONDS * sample_rate)) * CHUNK_BLOCKS
+    peak, square_sum, powers = 0.0, 0.0, [np.zeros(0)]
+    for block in source.blocks(chunk):
+        peak = max(peak, float(np.abs(block).max()))
+        square_sum += float(np.square(block, dtype=np.float64).sum())
+        powers.append(weighted_power(block, sample_rate))
+    block_power = np.concatenate(powers)
+    rms = math.sqrt(square_sum / (len(source) * source.channels)) if len(source) else 0.0
+
+    rate = min(sample_rate, ANALYSIS_RATE)
+    mono = np.empty(math.ceil(len(source) * rate / sample_rate) + 1, dtype=np.float32)
+    filled = 0
+    for block in resample_blocks(source, rate, channels=1):
+        mono[filled:filled + len(block)] = block[:, 0]
+        filled += len(block)
+    centroid, flux, chroma, energy = frame_features(mono[:filled], rate)
+    frame_rate = rate / HOP
+    bpm, tempo_confidence = estimate_tempo(flux, frame_rate)
+    key, key_confidence = estimate_key(chroma)
+
+    edges = [0.0] + section_boundaries(chroma, energy, centroid, frame_rate) + [duration]
+    sections = []
+    for start, end in zip(edges[:-1], edges[1:]):
+        power = block_power[round(start / BLOCK_SECONDS):round(end / BLOCK_SECONDS)]
+        sections.append(Section(start, end, _lufs(float(power.mean())) if len(power) else None))
+
+    return AudioFeatures(
+        duration=duration,
+        sample_rate=sample_rate,
+        channels=source.channels,
+        bpm=bpm,
+        tempo_confidence=tempo_confidence,
+        key=key,
+        key_confidence=key_confidence,
+        loudness_lufs=integrated_loudness(block_power),
+        loudness_range_lu=loudness_range(block_power),
+        peak_dbfs=20 * math.log10(peak) if peak > 0 else None,
+        crest_factor_db=20 * math.log10(peak / rms) if rms > 0 else None,
+        spectral_centroid_hz=float(np.average(centroid, weights=energy)) if energy.sum() > 0 else None,
+        sections=sections,
+    )
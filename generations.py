@@ -0,0 +1,261 @@
+# ------------------
+#       Meropo
+# ------------------
+import os
+import json
+import time
+import sqlite3
+import threading
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
+from cache import CACHE_DIR, file_digest
+from audio import read_wav
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS generations (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    created_at REAL NOT NULL,
+    stage TEXT NOT NULL,
+    source TEXT,
+    path TEXT,
+    sha256 TEXT,
+    endpoint TEXT,
+    prompt TEXT,
+    lora TEXT,
+    params TEXT,
+    elapsed REAL,
+    duration REAL,
+    format TEXT,
+    size INTEGER
+);
+CREATE INDEX IF NOT EXISTS generations_created_at ON generations (created_at);
+CREATE INDEX IF NOT EXISTS generations_sha256 ON generations (sha256);
+CREATE INDEX IF NOT EXISTS generations_lora ON generations (lora, created_at);
+CREATE TABLE IF NOT EXISTS generation_tags (
+    generation_id INTEGER NOT NULL REFERENCES generations (id) ON DELETE CASCADE,
+    tag TEXT NOT NULL,
+    PRIMARY KEY (tag, generation_id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS generation_analyses (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    generation_id INTEGER NOT NULL REFERENCES generations (id) ON DELETE CASCADE,
+    created_at REAL NOT NULL,
+    model TEXT,
+    prompt TEXT,
+    text TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS generation_analyses_generation ON generation_analyses (generation_id);
+"""
+
+COLUMNS = "id, created_at, stage, source, path, sha256, endpoint, prompt, lora, params, elapsed, duration, format, size"
+
+
+@dataclass
+class Generation:
+    id: int
+    created_at: float
+    stage: str
+    source: Optional[str]
+    path: Optional[str]
+    sha256: Optional[str]
+    endpoint: Optional[str]
+    prompt: Optional[str]
+    lora: Optional[str]
+    params: Optional[str]  # JSON text, parsed on demand with params_dict
+    elapsed: Optional[float]
+    duration: Optional[float]
+    format: Optional[str]
+    size: Optional[int]
+
+    def params_dict(self) -> dict:
+        return json.loads(self.params) if self.params else {}
+
+
+def prompt_tags(prompt: Optional[str]) -> List[str]:
+    """Comma-separated tags of an ACE-Step prompt, lower-cased and de-duplicated."""
+    tags = []
+    for tag in (prompt or "").split(","):
+        tag = tag.strip().lower()
+        if tag and tag not in tags:
+            tags.append(tag)
+    return tags
+
+
+def _like_escape(text: str) -> str:
+    """Escape LIKE wildcards, for use with ESCAPE '\\'."""
+    return text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def _prefix_bound(prefix: str) -> str:
+    """Smallest string greater than every string starting with prefix (prefix must not be empty)."""
+    code = ord(prefix[-1]) + 1
+    if 0xD800 <= code <= 0xDFFF:
+        code = 0xE000  # surrogates cannot be encoded
+    return prefix[:-1] + chr(code) if code <= 0x10FFFF else prefix + "\U0010ffff"
+
+
+def audio_duration(path: str) -> Optional[float]:
+    """Duration of a WAV file from its header; None for other formats."""
+    if not path.lower().endswith(".wav"):
+        return None
+    try:
+        return read_wav(path).duration  # memory-mapped, the samples are not read
+    except (OSError, ValueError):
+        return None
+
+
+class GenerationIndex:
+    def __init__(self, path: str = os.path.join(CACHE_DIR, "generations.sqlite3")):
+        """
+        Persistent, indexed record of every generated file.
+
+        Each generation stores its file path, content hash, full parameter JSON,
+        endpoint, timing, duration and format. Prompt tags go into their own table,
+        so searching by tag, LoRA or date is an index lookup, and analyses of a file
+        are linked to the generation that produced it. Nothing is loaded up front:
+        callers page through the history with search().
+
+        Args:
+            path: SQLite file holding the index
+        """
+        self.path = path
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._local = threading.local()
+        self._db().executescript(SCHEMA)
+
+    def _db(self) -> sqlite3.Connection:
+        # one connection per thread, reused across queries
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = self._local.db = sqlite3.connect(self.path, timeout=30)
+            db.execute("PRAGMA foreign_keys = ON")
+        return db
+
+    def add(self, stage: str, path: Optional[str], params: Optional[dict] = None, request: Optional[dict] = None,
+            source: Optional[str] = None, endpoint: Optional[str] = None, elapsed: Optional[float] = None) -> int:
+        """
+        Record a generation.
+
+        Args:
+            stage: "text2music", "repaint", "edit", "extend" or "retake"
+            path: Local audio file
+            params: Parameter JSON returned by the endpoint
+            request: Arguments the endpoint was called with, used where params lack a value
+            source: Audio source of a repaint/edit/extend stage
+            endpoint: URL of the server that produced it
+            elapsed: Seconds the generation took
+
+        Returns:
+            Id of the new record
+        """
+        params = params if isinstance(params, dict) else {}
+        path = os.path.abspath(path) if path else None
+        request = request or {}
+        prompt = params.get("prompt", request.get("prompt"))
+        lora = params.get("lora_name_or_path", request.get("lora_name_or_path"))
+        exists = bool(path) and os.path.isfile(path)
+        duration = audio_duration(path) if exists else None
+        if duration is None:
+            duration = params.get("audio_duration", request.get("audio_duration"))
+        row = (time.time(), stage, source, path, file_digest(path) if exists else None, endpoint, prompt,
+               None if lora in (None, "none") else lora, json.dumps(params, ensure_ascii=False, default=str),
+               elapsed, duration, os.path.splitext(path)[1].lstrip(".").lower() if path else None,
+               os.path.getsize(path) if exists else None)
+        with self._db() as db:
+            cursor = db.execute(f"INSERT INTO generations ({COLUMNS.split(', ', 1)[1]}) "
+                                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", row)
+            generation_id = cursor.lastrowid
+            db.executemany("INSERT OR IGNORE INTO generation_tags (generation_id, tag) VALUES (?, ?)",
+                           [(generation_id, tag) for tag in prompt_tags(prompt)])
+        return generation_id
+
+    def _where(self, text: Optional[str], tag: Optional[str], lora: Optional[str], since: Optional[float],
+               until: Optional[float], stage: Optional[str]) -> Tuple[str, list]:
+        clauses, args = [], []
+        if tag:
+            clauses.append("id IN (SELECT generation_id FROM generation_tags WHERE tag = ?)")
+            args.append(tag.strip().lower())
+        if lora:
+            # a range over the (lora, created_at) index instead of a LIKE scan
+            clauses.append("lora >= ? AND lora < ?")
+            args += [lora, _prefix_bound(lora)]
+        if text:
+            clauses.append("prompt LIKE ? ESCAPE '\\'")
+            args.append(f"%{_like_escape(text)}%")
+        if since is not None:
+            clauses.append("created_at >= ?")
+            args.append(since)
+        if until is not None:
+            clauses.append("created_at < ?")
+            args.append(until)
+        if stage:
+            clauses.append("stage = ?")
+            args.append(stage)
+        return (" WHERE " + " AND ".join(clauses)) if clauses else "", args
+
+    def search(self, text: Optional[str] = None, tag: Optional[str] = None, lora: Optional[str] = None,
+               since: Optional[float] = None, until: Optional[float] = None, stage: Optional[str] = None,
+               limit: int = 20, offset: int = 0) -> List[Generation]:
+        """
+        Page through generations, newest first.
+
+        Args:
+            text: Substring of the prompt
+            tag: Exact prompt tag, case-insensitive
+            lora: LoRA name or path, or its beginning (case-sensitive)
+            since: Earliest creation time (epoch seconds)
+            until: Creation time before which results end (epoch seconds)
+            stage: Only generations of this stage
+            limit: Page size
+            offset: Number of matching generations to skip
+
+        Returns:
+            List of Generation
+        """
+        where, args = self._where(text, tag, lora, since, until, stage)
+        rows = self._db().execute(f"SELECT {COLUMNS} FROM generations{where} ORDER BY created_at DESC, id DESC "
+                                  "LIMIT ? OFFSET ?", args + [limit, offset]).fetchall()
+        return [Generation(*row) for row in rows]
+
+    def count(self, text: Optional[str] = None, tag: Optional[str] = None, lora: Optional[str] = None,
+              since: Optional[float] = None, until: Optional[float] = None, stage: Optional[str] = None) -> int:
+        """Number of generations matching the same filters as search()."""
+        where, args = self._where(text, tag, lora, since, until, stage)
+        return self._db().execute(f"SELECT COUNT(*) FROM generations{where}", args).fetchone()[0]
+
+    def get(self, generation_id: int) -> Optional[Generation]:
+        row = self._db().execute(f"SELECT {COLUMNS} FROM generations WHERE id = ?", (generation_id,)).fetchone()
+        return Generation(*row) if row else None
+
+    def find_by_file(self, path: str) -> Optional[Generation]:
+        """The latest generation whose audio has the same content as path."""
+        row = self._db().execute(f"SELECT {COLUMNS} FROM generations WHERE sha256 = ? "
+                                 "ORDER BY created_at DESC LIMIT 1", (file_digest(path),)).fetchone()
+        return Generation(*row) if row else None
+
+    def link_analysis(self, path: str, text: str, model: Optional[str] = None,
+                      prompt: Optional[str] = None) -> Optional[int]:
+        """
+        Attach an analysis to the generation that produced a file.
+
+        Args:
+            path: Analysed audio file
+            text: Analysis text
+            model: Model that wrote it
+            prompt: Analysis prompt
+
+        Returns:
+            Id of the generation, or None if the file is not a recorded generation
+        """
+        generation = self.find_by_file(path) if os.path.isfile(path) else None
+        if generation is None:
+            return None
+        with self._db() as db:
+            db.execute("INSERT INTO generation_analyses (generation_id, created_at, model, prompt, text) "
+                       "VALUES (?, ?, ?, ?, ?)", (generation.id, time.time(), model, prompt, text))
+        return generation.id
+
+    def analyses(self, generation_id: int) -> List[Tuple[float, Optional[str], Optional[str], str]]:
+        """(created_at, model, prompt, text) of the analyses linked to a generation, newest first."""
+        return self._db().execute("SELECT created_at, model, prompt, text FROM generation_analyses "
+                                  "WHERE generation_id = ? ORDER BY created_at DESC", (generation_id,)).fetchall()
@@ -0,0 +1,204 @@
+# ------------------
+#       Meropo
+# ------------------
+import threading
+from typing import Callable, List, Optional, Tuple
+
+MESSAGE_OVERHEAD = 4  # tokens of role and separators around each message
+SUMMARY_PREFIX = "此前对话的摘要：\n"
+
+# (previous summary or "", [(user, assistant), ...] to fold in, token limit) -> new summary
+Summarizer = Callable[[str, List[Tuple[str, str]], int], str]
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Cheap token estimate that needs no tokenizer.
+
+    Chinese characters are counted as one token each and other text as one token
+    per four characters, which overestimates slightly for both.
+    """
+    wide = sum(1 for ch in text if ord(ch) > 0x7f)
+    return wide + (len(text) - wide + 3) // 4
+
+
+def truncate_tokens(text: str, max_tokens: int, count_tokens: Callable[[str], int] = estimate_tokens) -> str:
+    """Keep the end of text within max_tokens; the latest facts come last in a summary."""
+    if count_tokens(text) <= max_tokens:
+        return text
+    low, high = 0, len(text)
+    while low < high:  # smallest start whose remainder fits
+        middle = (low + high) // 2
+        if count_tokens("…" + text[middle:]) <= max_tokens:
+            high = middle
+        else:
+            low = middle + 1
+    return "…" + text[low:]
+
+
+def clip_summary(previous: str, turns: List[Tuple[str, str]], max_tokens: int = 1024, max_chars: int = 120) -> str:
+    """Summarizer that needs no model call: keeps the start of every folded message, the oldest dropped first."""
+    lines = [previous] if previous else []
+    for user, assistant in turns:
+        lines.append("用户: " + user[:max_chars])
+        lines.append("AI: " + assistant[:max_chars])
+    return truncate_tokens("\n".join(lines), max_tokens)
+
+
+class ConversationMemory:
+    def __init__(self, system_prompt: str, max_tokens: int = 8192, compact_to: float = 0.5,
+                 summary_share: float = 0.25, keep_turns: int = 2, summarizer: Optional[Summarizer] = None,
+                 count_tokens: Callable[[str], int] = estimate_tokens, background: bool = False):
+        """
+        Conversation history of one chat session kept within a token budget.
+
+        The system prompt is pinned as the first message. Once the history exceeds
+        max_tokens, the oldest turns are folded into a summary message placed right
+        after it until the history is back under compact_to * max_tokens. Compacting
+        well below the budget means it happens rarely, and between compactions every
+        request repeats the previous one's messages unchanged (the same dict objects,
+        so the same bytes) followed by the new turn, which lets provider-side prompt
+        caching reuse the prefix.
+
+        The summary counts against the budget: it is limited to summary_share *
+        max_tokens (the summarizer is asked for that length and its result is cut to
+        it), so the history cannot outgrow the budget however long the chat runs.
+
+        Args:
+            system_prompt: Pinned system message
+            max_tokens: Token budget of the history sent with a request
+            compact_to: Fraction of max_tokens the history is reduced to when compacting
+            summary_share: Fraction of max_tokens the summary may take
+            keep_turns: Most recent turns that are never folded into the summary
+            summarizer: Folds turns into the summary, e.g. AI.summarize; defaults to clip_summary
+            count_tokens: Token counter of a message text
+            background: Compact on a background thread, so add_turn returns at once even
+                when the summarizer calls a model; until it finishes, requests carry the
+                uncompacted history
+        """
+        self.system = {"role": "system", "content": system_prompt}
+        self.max_tokens = max_tokens
+        self.compact_to = compact_to
+        self.summary_share = summary_share
+        self.keep_turns = keep_turns
+        self.summarizer = summarizer or clip_summary
+        self.count_tokens = count_tokens
+        self.background = background
+        self.summary_text = ""
+        self.summary: Optional[dict] = None
+        self.turns: List[Tuple[dict, dict]] = []
+        self.compactions = 0
+        self._turn_tokens: List[int] = []
+        self._compacting = False
+        self._lock = threading.Lock()
+
+    def _message_tokens(self, message: dict) -> int:
+        return self.count_tokens(message["content"]) + MESSAGE_OVERHEAD
+
+    @property
+    def summary_tokens(self) -> int:
+        """Token limit of the summary text."""
+        return int(self.max_tokens * self.summary_share)
+
+    @property
+    def tokens(self) -> int:
+        """Estimated tokens of the history (system prompt, summary and turns)."""
+        with self._lock:
+            return self._tokens()
+
+    def _tokens(self) -> int:
+        total = self._message_tokens(self.system) + sum(self._turn_tokens)
+        if self.summary is not None:
+            total += self._message_tokens(self.summary)
+        return total
+
+    def messages(self, query: Optional[str] = None) -> List[dict]:
+        """
+        Messages of the next request.
+
+        Args:
+            query: New user message appended after the history
+
+        Returns:
+            System prompt, summary, earlier turns and the new message, in that order
+        """
+        with self._lock:
+            messages = [self.system]
+            if self.summary is not None:
+                messages.append(self.summary)
+            for user, assistant in self.turns:
+                messages += [user, assistant]
+        if query is not None:
+            messages.append({"role": "user", "content": query})
+        return messages
+
+    def add_turn(self, query: str, reply: str):
+        """Record a finished exchange and compact the history if it is over budget."""
+        user = {"role": "user", "content": query}
+        assistant = {"role": "assistant", "content": reply}
+        with self._lock:
+            self.turns.append((user, assistant))
+            self._turn_tokens.append(self._message_tokens(user) + self._message_tokens(assistant))
+            over_budget = self._tokens() > self.max_tokens
+            if over_budget and self.background:
+                if self._compacting:
+                    return  # the running compaction picks this turn up as well
+                self._compacting = True
+        if not over_budget:
+            return
+        if self.background:
+            threading.Thread(target=self._compact_until_within_budget, name="meropo-compact", daemon=True).start()
+        else:
+            self.compact()
+
+    def _compact_until_within_budget(self):
+        try:
+            while self.compact() and self.tokens > self.max_tokens:
+                pass
+        finally:
+            with self._lock:
+                self._compacting = False
+
+    def compact(self) -> bool:
+        """
+        Fold the oldest turns into the summary until the history fits compact_to * max_tokens.
+
+        Returns:
+            Whether any turns were folded
+        """
+        with self._lock:
+            target = self.max_tokens * self.compact_to
+            # the new summary replaces the old one and may take up to its full share
+            total = self._tokens() + self._message_tokens({"content": SUMMARY_PREFIX}) + self.summary_tokens
+            if self.summary is not None:
+                total -= self._message_tokens(self.summary)
+            count = 0
+            while count < len(self.turns) - self.keep_turns and total > target:
+                total -= self._turn_tokens[count]
+                count += 1
+            if not count:
+                return False
+            folded = [(user["content"], assistant["content"]) for user, assistant in self.turns[:count]]
+            previous = self.summary_text
+            generation = self.compactions
+        # summarizing may call the model; the history stays usable meanwhile
+        limit = self.summary_tokens
+        summary_text = truncate_tokens(self.summarizer(previous, folded, limit), limit, self.count_tokens)
+        with self._lock:
+            if self.compactions != generation:
+                return False  # compacted or cleared concurrently
+            self.summary_text = summary_text
+            self.summary = {"role": "system", "content": SUMMARY_PREFIX + summary_text}
+            del self.turns[:count]
+            del self._turn_tokens[:count]
+            self.compactions += 1
+        return True
+
+    def clear(self):
+        """Start over, keeping only the system prompt."""
+        with self._lock:
+            self.summary_text = ""
+            self.summary = None
+            self.turns.clear()
+            self._turn_tokens.clear()
+            self.compactions += 1
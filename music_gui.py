@@ -1,8 +1,15 @@
 import json
 import threading
 import tkinter as tk
+from concurrent.futures import CancelledError
 from datetime import datetime
 from api import MusicAPI, AI, get_desktop_path
+from audio import PRESETS
+from pipeline import MusicPipeline
+from store import OutputStore
+from generations import GenerationIndex
+from scheduler import JobScheduler
+from widgets import LogStore, LogView
 from tkinter import ttk, filedialog, messagebox, scrolledtext
 import os
 
@@ -14,16 +21,33 @@ class MusicGeneratorGUI:
         self.root.geometry("1200x800")
         self.root.configure(bg='#2b2b2b')
 
-        # 初始化API
-        self.music_api = MusicAPI()
+        # 初始化API（音乐服务在后台连接，不阻塞窗口显示）
+        # 结果不经临时目录下载，而是直接写入输出库；带种子的生成仍会命中结果缓存
+        self.music_api = MusicAPI(download_files=False)
+        # 重绘/编辑/扩展在服务器端接着上一步的结果继续，不再回传音频
+        self.pipeline = MusicPipeline(self.music_api)
         self.ai = AI()
+
+        # 任务调度：每类任务的并发数有上限，多余的任务排队等待
+        self.scheduler = JobScheduler(limits={"music": 2, "ai": 2})
         
         # 获取桌面路径
         self.desktop_path = get_desktop_path()
         
-        # 存储生成的文件路径
-        self.generated_files = []
+        # 输出库（缓存目录下）：按内容哈希命名并分目录存放，超出配额时删除最久未用的文件
+        # 给用户的文件另外以可读的文件名导出到桌面，不受配额清理影响
+        self.output_store = OutputStore()
+        
+        # 生成记录索引（SQLite），按需分页查询，启动时不加载全部历史
+        self.generation_index = GenerationIndex()
+        self.recent_page = 0
+        self.recent_page_size = 10
+        self.recent_rows = []
+        
+        # 生成历史、对话和品鉴结果只在界面中保留最近的记录，更早的记录存入磁盘按需加载
+        self.log_store = LogStore()
         self.setup_ui()
+        self.scheduler.add_listener(lambda job: self.root.after(0, lambda: self.refresh_queue_view(job)))
         
     def setup_ui(self):
         # 创建主框架
@@ -47,6 +71,7 @@ class MusicGeneratorGUI:
         self.create_extend_tab()
         self.create_ai_chat_tab()
         self.create_audio_analysis_tab()
+        self.create_queue_tab()
         
         # 创建状态栏
         self.create_status_bar()
@@ -163,6 +188,7 @@ class MusicGeneratorGUI:
         
         self.history_text = scrolledtext.ScrolledText(history_frame, height=20)
         self.history_text.pack(fill=tk.BOTH, expand=True)
+        self.history_log = LogView(self.root, self.history_text, self.log_store, "history")
         
     def create_repaint_tab(self):
         """创建重绘标签页"""
@@ -272,6 +298,7 @@ class MusicGeneratorGUI:
         
         self.chat_history = scrolledtext.ScrolledText(history_frame, height=20)
         self.chat_history.pack(fill=tk.BOTH, expand=True)
+        self.chat_log = LogView(self.root, self.chat_history, self.log_store, "chat")
         
         # 输入区域
         input_frame = ttk.Frame(chat_frame)
@@ -283,6 +310,9 @@ class MusicGeneratorGUI:
         send_btn = ttk.Button(input_frame, text="发送", command=self.send_chat)
         send_btn.pack(side=tk.RIGHT)
         
+        new_chat_btn = ttk.Button(input_frame, text="新对话", command=self.new_chat)
+        new_chat_btn.pack(side=tk.RIGHT, padx=(0, 5))
+        
         # 绑定回车键
         self.chat_input.bind("<Return>", self.on_enter_press)
         
@@ -316,10 +346,31 @@ class MusicGeneratorGUI:
         recent_frame = ttk.LabelFrame(left_frame, text="最近生成的文件", padding=10)
         recent_frame.pack(fill=tk.X, pady=(0, 10))
         
+        # 搜索：按提示词、标签、LoRA或日期(YYYY-MM-DD)筛选
+        search_frame = ttk.Frame(recent_frame)
+        search_frame.pack(fill=tk.X, pady=(0, 5))
+        self.recent_field_var = tk.StringVar(value="提示词")
+        ttk.Combobox(search_frame, textvariable=self.recent_field_var, values=["提示词", "标签", "LoRA", "日期"],
+                     state="readonly", width=6).pack(side=tk.LEFT)
+        self.recent_query_var = tk.StringVar()
+        query_entry = ttk.Entry(search_frame, textvariable=self.recent_query_var)
+        query_entry.pack(side=tk.LEFT, fill=tk.X, expand=True, padx=5)
+        query_entry.bind("<Return>", lambda event: self.search_recent_files())
+        ttk.Button(search_frame, text="搜索", command=self.search_recent_files).pack(side=tk.LEFT)
+        
         self.recent_files_listbox = tk.Listbox(recent_frame, height=6)
         self.recent_files_listbox.pack(fill=tk.X)
         self.recent_files_listbox.bind("<Double-Button-1>", self.on_recent_file_select)
         
+        # 翻页
+        page_frame = ttk.Frame(recent_frame)
+        page_frame.pack(fill=tk.X, pady=(5, 0))
+        ttk.Button(page_frame, text="上一页", command=lambda: self.change_recent_page(-1)).pack(side=tk.LEFT)
+        self.recent_page_label = ttk.Label(page_frame, text="")
+        self.recent_page_label.pack(side=tk.LEFT, expand=True)
+        ttk.Button(page_frame, text="下一页", command=lambda: self.change_recent_page(1)).pack(side=tk.RIGHT)
+        self.update_recent_files_list()
+        
         # 分析设置
         analysis_frame = ttk.LabelFrame(left_frame, text="分析设置", padding=10)
         analysis_frame.pack(fill=tk.X, pady=(0, 10))
@@ -329,6 +380,20 @@ class MusicGeneratorGUI:
         self.analysis_prompt_text.pack(fill=tk.X, pady=(0, 5))
         self.analysis_prompt_text.insert(tk.END, "请对这个音频进行专业的音乐鉴赏分析，包括风格、节奏、旋律、编曲等方面。")
         
+        # 上传质量：压缩后上传更快，original 上传原文件，features_only 只发送本地提取的特征
+        preset_frame = ttk.Frame(analysis_frame)
+        preset_frame.pack(fill=tk.X, pady=(5, 0))
+        ttk.Label(preset_frame, text="上传质量:").pack(side=tk.LEFT)
+        self.analysis_preset_var = tk.StringVar(value="balanced")
+        ttk.Combobox(preset_frame, textvariable=self.analysis_preset_var,
+                     values=list(PRESETS) + ["original", "features_only"], state="readonly",
+                     width=14).pack(side=tk.LEFT, padx=(10, 0))
+        
+        # 相同音频和设置的分析结果会被缓存，勾选后忽略缓存重新分析
+        self.analysis_refresh_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(analysis_frame, text="重新分析（忽略缓存）",
+                        variable=self.analysis_refresh_var).pack(anchor=tk.W, pady=(5, 0))
+        
         # 分析按钮
         analyze_btn = ttk.Button(left_frame, text="🎧 开始音频品鉴", 
                                 command=self.analyze_audio_thread)
@@ -344,7 +409,117 @@ class MusicGeneratorGUI:
         
         self.analysis_result = scrolledtext.ScrolledText(result_frame, height=25)
         self.analysis_result.pack(fill=tk.BOTH, expand=True)
+        self.analysis_log = LogView(self.root, self.analysis_result, self.log_store, "analysis")
         
+    def create_queue_tab(self):
+        """创建任务队列标签页"""
+        frame = ttk.Frame(self.notebook)
+        self.notebook.add(frame, text="📋 任务队列")
+
+        # 并发设置
+        limit_frame = ttk.LabelFrame(frame, text="并发设置", padding=10)
+        limit_frame.pack(fill=tk.X, pady=(0, 10))
+
+        ttk.Label(limit_frame, text="音乐任务并发数:").pack(side=tk.LEFT)
+        self.music_limit_var = tk.StringVar(value=str(self.scheduler.limits["music"]))
+        ttk.Spinbox(limit_frame, from_=1, to=8, textvariable=self.music_limit_var, width=5,
+                    command=self.update_job_limits).pack(side=tk.LEFT, padx=(10, 20))
+
+        ttk.Label(limit_frame, text="AI任务并发数:").pack(side=tk.LEFT)
+        self.ai_limit_var = tk.StringVar(value=str(self.scheduler.limits["ai"]))
+        ttk.Spinbox(limit_frame, from_=1, to=8, textvariable=self.ai_limit_var, width=5,
+                    command=self.update_job_limits).pack(side=tk.LEFT, padx=(10, 0))
+
+        # 任务列表
+        list_frame = ttk.LabelFrame(frame, text="任务列表", padding=10)
+        list_frame.pack(fill=tk.BOTH, expand=True)
+
+        columns = ("id", "name", "state", "submitted", "elapsed", "detail")
+        self.queue_tree = ttk.Treeview(list_frame, columns=columns, show="headings", selectmode="extended")
+        for column, text, width in zip(columns, ("编号", "任务", "状态", "提交时间", "耗时", "详情"),
+                                       (60, 160, 80, 140, 80, 400)):
+            self.queue_tree.heading(column, text=text)
+            self.queue_tree.column(column, width=width, anchor=tk.W)
+        scrollbar = ttk.Scrollbar(list_frame, orient=tk.VERTICAL, command=self.queue_tree.yview)
+        self.queue_tree.configure(yscrollcommand=scrollbar.set)
+        self.queue_tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+
+        # 操作按钮
+        button_frame = ttk.Frame(frame)
+        button_frame.pack(fill=tk.X, pady=(10, 0))
+        ttk.Button(button_frame, text="取消选中任务", command=self.cancel_selected_jobs).pack(side=tk.LEFT)
+        ttk.Button(button_frame, text="清除已完成", command=self.clear_finished_jobs).pack(side=tk.LEFT, padx=(10, 0))
+
+    def report_job_status(self, status):
+        """在任务列表和状态栏中显示远程任务的排队位置、预计时间和推理进度"""
+        if status.stage == "in_queue":
+            detail = "排队中"
+            if status.rank is not None:
+                detail += f"：第 {status.rank + 1} 位"
+                if status.queue_size:
+                    detail += f" / 共 {status.queue_size} 个"
+            if status.eta is not None:
+                detail += f"，预计 {status.eta:.0f} 秒"
+        elif status.stage == "progress" and status.steps and status.progress is not None:
+            detail = f"推理中：{status.step}/{status.steps} ({status.progress:.0%})"
+            if status.desc:
+                detail += f" {status.desc}"
+        elif status.stage in ("processing", "progress", "iterating"):
+            detail = "推理中"
+        elif status.stage == "queue_full":
+            detail = "服务器队列已满"
+        else:
+            detail = "正在提交"
+        detail += f"，已用时 {status.elapsed:.0f} 秒"
+        self.scheduler.report(detail)
+        job = self.scheduler.current_job()
+        if job is not None:
+            self.root.after(0, lambda: self.update_status(f"[{job.id}] {job.name}: {detail}"))
+
+    def update_job_limits(self):
+        """更新各类任务的并发数"""
+        try:
+            self.scheduler.set_limit("music", int(self.music_limit_var.get()))
+            self.scheduler.set_limit("ai", int(self.ai_limit_var.get()))
+        except ValueError:
+            pass
+
+    def refresh_queue_view(self, job):
+        """刷新任务列表中的一行"""
+        state_names = {"queued": "排队中", "running": "运行中", "done": "已完成", "failed": "失败", "cancelled": "已取消"}
+        state = state_names[job.state]
+        if job.state == "running" and job.cancel_token.cancelled:
+            state = "取消中"
+        elapsed = f"{job.elapsed:.1f}s" if job.elapsed is not None else ""
+        detail = str(job.error) if job.state == "failed" else job.detail
+        values = (job.id, job.name, state, datetime.fromtimestamp(job.submitted_at).strftime("%Y-%m-%d %H:%M:%S"),
+                  elapsed, detail)
+        iid = str(job.id)
+        if self.queue_tree.exists(iid):
+            self.queue_tree.item(iid, values=values)
+        else:
+            self.queue_tree.insert("", tk.END, iid=iid, values=values)
+
+        self.prune_queue_view()
+
+    def prune_queue_view(self):
+        """只保留调度器仍在记录的任务"""
+        known = {str(j.id) for j in self.scheduler.jobs()}
+        for iid in self.queue_tree.get_children():
+            if iid not in known:
+                self.queue_tree.delete(iid)
+
+    def cancel_selected_jobs(self):
+        """取消选中的任务（排队中的任务直接移除，运行中的任务会立即中止远程请求）"""
+        for iid in self.queue_tree.selection():
+            self.scheduler.cancel(int(iid))
+
+    def clear_finished_jobs(self):
+        """清除已结束的任务"""
+        self.scheduler.clear_finished()
+        self.prune_queue_view()
+
     def on_enter_press(self, event):
         """处理回车键事件"""
         if event.state == 0:  # 没有按住Shift
@@ -358,164 +533,207 @@ class MusicGeneratorGUI:
             return
             
         # 显示用户消息
-        self.chat_history.insert(tk.END, f"用户: {message}\n\n")
-        self.chat_history.see(tk.END)
+        self.chat_log.append(f"用户: {message}\n\n")
         
         # 清空输入框
         self.chat_input.delete("1.0", tk.END)
         
-        # 在新线程中获取AI回复
-        threading.Thread(target=self.get_ai_response, args=(message,), daemon=True).start()
+        # 提交到任务队列获取AI回复
+        self.scheduler.submit("AI对话", self.get_ai_response, message, kind="ai")
+        
+    def new_chat(self):
+        """清空对话记忆，开始新的对话"""
+        self.ai.memory.clear()
+        self.chat_log.append(f"{'-'*20} 新对话 {'-'*20}\n\n")
         
     def get_ai_response(self, message):
-        """获取AI回复"""
+        """获取AI回复（逐段显示）"""
+        stream = self.open_text_stream(self.chat_log, "AI: ")
         try:
-            response = self.ai.chat(message)
-            
-            # 在主线程中更新UI
-            self.root.after(0, lambda: self.update_chat_response(response))
+            for delta in self.ai.chat_stream(message, cancel_token=self.scheduler.current_job().cancel_token):
+                stream.write(delta)
+            stream.close()
+            self.report_first_token("AI回复完成", stream)
+        except CancelledError:
+            stream.close("（已取消）")
+            raise
         except Exception as e:
-            error_msg = f"AI回复出错: {str(e)}"
-            self.root.after(0, lambda: self.update_chat_response(error_msg))
-            
-    def update_chat_response(self, response):
-        """更新聊天回复"""
-        self.chat_history.insert(tk.END, f"AI: {response}\n\n")
-        self.chat_history.see(tk.END)
+            stream.close(f"AI回复出错: {str(e)}")
+            raise
+
+    def open_text_stream(self, log_view, header=""):
+        """在主线程为LogView新建一条流式记录并等待其就绪，供任务线程写入"""
+        ready = threading.Event()
+        holder = []
+
+        def create():
+            holder.append(log_view.stream(header))
+            ready.set()
+
+        self.root.after(0, create)
+        ready.wait()
+        return holder[0]
+
+    def report_first_token(self, message, stream):
+        """在状态栏显示完成消息及首字用时"""
+        ttft = stream.time_to_first_chunk
+        if ttft is not None:
+            message = f"{message}（首字用时 {ttft:.2f} 秒）"
+        self.root.after(0, lambda: self.update_status(message))
         
     def generate_music_thread(self):
-        """在新线程中生成音乐"""
-        threading.Thread(target=self.generate_music, daemon=True).start()
+        """提交音乐生成任务（在主线程读取参数，在任务队列中生成）"""
+        try:
+            params = self.get_generate_params()
+        except ValueError as e:
+            messagebox.showerror("参数错误", f"参数错误: {str(e)}")
+            return
+        self.scheduler.submit("生成音乐", self.generate_music, params, kind="music")
+
+    def get_generate_params(self):
+        """读取文本生成音乐的参数"""
+        prompt = self.prompt_text.get("1.0", tk.END).strip()
+        
+        # 验证参数
+        if not prompt.strip():
+            raise ValueError("请输入音乐标签")
+        
+        return dict(
+            format=self.format_var.get(),
+            audio_duration=float(self.duration_var.get()),
+            prompt=prompt,
+            lyrics=self.lyrics_text.get("1.0", tk.END).strip(),
+            infer_step=int(self.infer_step_var.get()),
+            guidance_scale=float(self.guidance_scale_var.get()),
+            scheduler_type=self.scheduler_var.get(),
+            cfg_type=self.cfg_var.get(),
+            lora_name_or_path=self.lora_var.get(),
+            lora_weight=float(self.lora_weight_var.get())
+        )
         
-    def generate_music(self):
+    def generate_music(self, params):
         """生成音乐"""
+        self.run_pipeline_stage("音乐生成", self.pipeline.generate, **params)
+
+    def run_pipeline_stage(self, title, stage_fn, **kwargs):
+        """
+        在任务线程中运行一个流水线步骤，并把结果保存到桌面。
+
+        Args:
+            title: 显示给用户的步骤名称，如“音频重绘”
+            stage_fn: MusicPipeline 的 generate/repaint/edit/extend 方法
+            **kwargs: 传给 stage_fn 的参数
+        """
         try:
             # 更新状态
-            self.root.after(0, lambda: self.update_status("正在生成音乐，请耐心等待..."))
+            self.root.after(0, lambda: self.update_status(f"正在进行{title}，请耐心等待..."))
             
-            # 获取参数
-            prompt = self.prompt_text.get("1.0", tk.END).strip()
-            lyrics = self.lyrics_text.get("1.0", tk.END).strip()
-            format_type = self.format_var.get()
-            duration = float(self.duration_var.get())
-            infer_step = int(self.infer_step_var.get())
-            guidance_scale = float(self.guidance_scale_var.get())
-            scheduler_type = self.scheduler_var.get()
-            cfg_type = self.cfg_var.get()
-            lora_name = self.lora_var.get()
-            lora_weight = float(self.lora_weight_var.get())
-            
-            # 验证参数
-            if not prompt.strip():
-                raise ValueError("请输入音乐标签")
-            
-            # 调用API生成音乐
-            audio_file, params = self.music_api.generate_music(
-                format=format_type,
-                audio_duration=duration,
-                prompt=prompt,
-                lyrics=lyrics,
-                infer_step=infer_step,
-                guidance_scale=guidance_scale,
-                scheduler_type=scheduler_type,
-                cfg_type=cfg_type,
-                lora_name_or_path=lora_name,
-                lora_weight=lora_weight
-            )
+            # 调用API
+            stage = stage_fn(**kwargs, on_status=self.report_job_status,
+                             cancel_token=self.scheduler.current_job().cancel_token)
+            audio_file, params = stage.audio, stage.params
             
-            # 将文件移动到桌面
-            if audio_file and os.path.exists(audio_file):
-                # 生成桌面文件名
+            # 将音频直接写入输出库（同名即同内容，并发任务不会互相覆盖），再以可读的文件名导出到桌面（硬链接，不再写一份）
+            if audio_file:
+                stored = self.output_store.store_result(self.music_api, audio_file, params)
                 timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                desktop_filename = f"Meropo_Music_{timestamp}.{format_type}"
-                desktop_filepath = os.path.join(self.desktop_path, desktop_filename)
-                
-                # 移动文件到桌面
-                import shutil
-                shutil.move(audio_file, desktop_filepath)
-                audio_file = desktop_filepath
+                audio_file = stage.audio = self.output_store.export(
+                    stored, self.desktop_path, f"Meropo_{stage.stage}_{timestamp}{os.path.splitext(stored)[1]}")
+            self.generation_index.add(stage.stage, audio_file, params, request=kwargs, source=stage.source,
+                                      endpoint=self.music_api.api_url, elapsed=stage.elapsed)
             
             # 更新历史记录
             timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            history_entry = f"[{timestamp}] 音乐生成成功!\n文件: {audio_file}\n参数: {json.dumps(params, indent=2, ensure_ascii=False)}\n\n"
+            history_entry = f"[{timestamp}] {title}成功! (音频源: {stage.source}, 用时 {stage.elapsed:.1f} 秒)\n文件: {audio_file}\n参数: {json.dumps(params, indent=2, ensure_ascii=False)}\n\n"
             
             self.root.after(0, lambda: self.update_history(history_entry))
             
-            # 保存生成的文件路径
-            if audio_file:
-                self.generated_files.append(audio_file)
-                # 更新最近文件列表
-                self.root.after(0, lambda: self.update_recent_files_list())
+            # 更新最近文件列表
+            self.root.after(0, lambda: self.update_recent_files_list())
             
             # 更新状态
-            self.root.after(0, lambda: self.update_status("音乐生成完成"))
-            self.root.after(0, lambda: messagebox.showinfo("成功", f"音乐生成成功!\n文件保存至: {audio_file}"))
+            self.root.after(0, lambda: self.update_status(f"{title}完成"))
+            self.root.after(0, lambda: messagebox.showinfo("成功", f"{title}成功!\n文件保存至: {audio_file}"))
             
+        except CancelledError:
+            self.root.after(0, lambda: self.update_status(f"{title}已取消"))
+            raise
         except ValueError as e:
-            error_msg = f"参数错误: {str(e)}"
-            self.root.after(0, lambda: self.update_status("生成失败"))
-            self.root.after(0, lambda: messagebox.showerror("参数错误", error_msg))
+            # 流水线中还没有可用的音频
+            error_msg = f"{title}需要先生成音乐: {str(e)}"
+            self.root.after(0, lambda: self.update_status(f"{title}失败"))
+            self.root.after(0, lambda: messagebox.showwarning("提示", error_msg))
+            raise
         except Exception as e:
-            error_msg = f"生成音乐时出错: {str(e)}"
-            self.root.after(0, lambda: self.update_status("生成失败"))
+            error_msg = f"{title}时出错: {str(e)}"
+            self.root.after(0, lambda: self.update_status(f"{title}失败"))
             self.root.after(0, lambda: messagebox.showerror("错误", error_msg))
+            raise
             
     def repaint_audio_thread(self):
-        """在新线程中重绘音频"""
-        threading.Thread(target=self.repaint_audio, daemon=True).start()
-        
-    def repaint_audio(self):
-        """重绘音频"""
+        """提交音频重绘任务"""
         try:
             # 获取参数
             repaint_start = float(self.repaint_start_var.get())
             repaint_end = float(self.repaint_end_var.get())
             repaint_source = self.repaint_source_var.get()
-            
-            # 这里需要实现重绘逻辑
-            # 由于重绘需要之前的生成结果，这里只是示例
-            messagebox.showinfo("提示", "重绘功能需要先有生成的音频文件")
-            
-        except Exception as e:
-            error_msg = f"重绘音频时出错: {str(e)}"
-            self.root.after(0, lambda: messagebox.showerror("错误", error_msg))
+        except ValueError as e:
+            messagebox.showerror("错误", f"重绘音频时出错: {str(e)}")
+            return
+        source_audio = None
+        if repaint_source == "upload":
+            source_audio = filedialog.askopenfilename(
+                title="选择要重绘的音频文件",
+                filetypes=[("音频文件", "*.wav *.mp3 *.ogg *.flac"), ("所有文件", "*.*")])
+            if not source_audio:
+                return
+        self.scheduler.submit("音频重绘", self.repaint_audio, repaint_start, repaint_end, repaint_source,
+                              source_audio, kind="music")
+        
+    def repaint_audio(self, repaint_start, repaint_end, repaint_source, source_audio=None):
+        """重绘音频（音频源为 text2music/last_repaint 时直接使用服务器上的结果）"""
+        self.run_pipeline_stage("音频重绘", self.pipeline.repaint, repaint_start=repaint_start,
+                                repaint_end=repaint_end, source=repaint_source, source_audio=source_audio)
             
     def edit_audio_thread(self):
-        """在新线程中编辑音频"""
-        threading.Thread(target=self.edit_audio, daemon=True).start()
-        
-    def edit_audio(self):
-        """编辑音频"""
+        """提交音频编辑任务"""
         try:
             # 获取参数
             edit_type = self.edit_type_var.get()
             edit_n_min = float(self.edit_n_min_var.get())
             edit_n_max = float(self.edit_n_max_var.get())
-            
-            # 这里需要实现编辑逻辑
-            messagebox.showinfo("提示", "编辑功能需要先有生成的音频文件")
-            
-        except Exception as e:
-            error_msg = f"编辑音频时出错: {str(e)}"
-            self.root.after(0, lambda: messagebox.showerror("错误", error_msg))
+        except ValueError as e:
+            messagebox.showerror("错误", f"编辑音频时出错: {str(e)}")
+            return
+        # 新的标签和歌词取自“文本生成音乐”页
+        edit_prompt = self.prompt_text.get("1.0", tk.END).strip()
+        edit_lyrics = self.lyrics_text.get("1.0", tk.END).strip()
+        self.scheduler.submit("音频编辑", self.edit_audio, edit_type, edit_n_min, edit_n_max, edit_prompt, edit_lyrics,
+                              kind="music")
+        
+    def edit_audio(self, edit_type, edit_n_min, edit_n_max, edit_prompt, edit_lyrics):
+        """编辑最近一步的音频：only_lyrics 只改歌词，remix 同时改标签"""
+        original = self.pipeline.last.params if self.pipeline.last else {}
+        if edit_type == "only_lyrics":
+            edit_prompt = original.get("prompt", edit_prompt)
+        self.run_pipeline_stage("音频编辑", self.pipeline.edit, edit_prompt=edit_prompt, edit_lyrics=edit_lyrics,
+                                edit_n_min=edit_n_min, edit_n_max=edit_n_max)
             
     def extend_audio_thread(self):
-        """在新线程中扩展音频"""
-        threading.Thread(target=self.extend_audio, daemon=True).start()
-
-    def extend_audio(self):
-        """扩展音频"""
+        """提交音频扩展任务"""
         try:
             # 获取参数
             left_extend = float(self.left_extend_var.get())
             right_extend = float(self.right_extend_var.get())
-            
-            # 这里需要实现扩展逻辑
-            messagebox.showinfo("提示", "扩展功能需要先有生成的音频文件")
-            
-        except Exception as e:
-            error_msg = f"扩展音频时出错: {str(e)}"
-            self.root.after(0, lambda: messagebox.showerror("错误", error_msg))
+        except ValueError as e:
+            messagebox.showerror("错误", f"扩展音频时出错: {str(e)}")
+            return
+        self.scheduler.submit("音频扩展", self.extend_audio, left_extend, right_extend, kind="music")
+
+    def extend_audio(self, left_extend, right_extend):
+        """扩展最近一步的音频"""
+        self.run_pipeline_stage("音频扩展", self.pipeline.extend, left_extend_length=left_extend,
+                                right_extend_length=right_extend)
             
     def select_audio_file(self):
         """选择音频文件"""
@@ -536,60 +754,113 @@ class MusicGeneratorGUI:
     def on_recent_file_select(self, event):
         """双击选择最近生成的文件"""
         selection = self.recent_files_listbox.curselection()
-        if selection:
-            file_path = self.recent_files_listbox.get(selection[0])
+        if selection and self.recent_rows[selection[0]].path:
+            file_path = self.recent_rows[selection[0]].path
+            if not os.path.exists(file_path):
+                messagebox.showwarning("提示", f"文件已不存在（可能已被移动或删除）:\n{file_path}")
+                return
             self.audio_path_var.set(file_path)
             
+    def recent_filters(self):
+        """把搜索框内容转换为GenerationIndex.search的筛选条件"""
+        query = self.recent_query_var.get().strip()
+        if not query:
+            return {}
+        field = self.recent_field_var.get()
+        if field == "标签":
+            return {"tag": query}
+        if field == "LoRA":
+            return {"lora": query}
+        if field == "日期":
+            day = datetime.strptime(query, "%Y-%m-%d").timestamp()
+            return {"since": day, "until": day + 24 * 3600}
+        return {"text": query}
+        
+    def search_recent_files(self):
+        """按搜索条件从第一页开始显示"""
+        self.recent_page = 0
+        self.update_recent_files_list()
+        
+    def change_recent_page(self, step):
+        """翻页"""
+        self.recent_page = max(0, self.recent_page + step)
+        self.update_recent_files_list()
+            
     def update_recent_files_list(self):
-        """更新最近生成的文件列表"""
+        """从生成记录索引中查询当前页并显示"""
+        try:
+            filters = self.recent_filters()
+        except ValueError:
+            messagebox.showerror("错误", "日期格式应为 YYYY-MM-DD")
+            return
+        total = self.generation_index.count(**filters)
+        pages = max(1, -(-total // self.recent_page_size))
+        self.recent_page = min(self.recent_page, pages - 1)
+        self.recent_rows = self.generation_index.search(limit=self.recent_page_size,
+                                                        offset=self.recent_page * self.recent_page_size, **filters)
         self.recent_files_listbox.delete(0, tk.END)
-        for file_path in self.generated_files[-10:]:  # 显示最近10个文件
-            if os.path.exists(file_path):
-                self.recent_files_listbox.insert(tk.END, file_path)
+        for row in self.recent_rows:
+            created = datetime.fromtimestamp(row.created_at).strftime("%m-%d %H:%M")
+            name = os.path.basename(row.path) if row.path else "（无文件）"
+            self.recent_files_listbox.insert(tk.END, f"{created} [{row.stage}] {(row.prompt or '')[:30]} - {name}")
+        self.recent_page_label.config(text=f"第 {self.recent_page + 1}/{pages} 页，共 {total} 条")
                 
     def analyze_audio_thread(self):
-        """在新线程中分析音频"""
-        threading.Thread(target=self.analyze_audio, daemon=True).start()
-        
-    def analyze_audio(self):
+        """提交音频分析任务"""
+        audio_path = self.audio_path_var.get().strip()
+        if not audio_path:
+            messagebox.showerror("错误", "请选择音频文件")
+            return
+            
+        if not os.path.exists(audio_path):
+            messagebox.showerror("错误", "音频文件不存在")
+            return
+            
+        # 获取分析提示
+        analysis_prompt = self.analysis_prompt_text.get("1.0", tk.END).strip()
+        if not analysis_prompt:
+            analysis_prompt = None
+        preset = self.analysis_preset_var.get()
+        self.scheduler.submit(f"音频品鉴: {os.path.basename(audio_path)}", self.analyze_audio, audio_path,
+                              analysis_prompt, None if preset == "original" else preset,
+                              self.analysis_refresh_var.get(), kind="ai")
+        
+    def analyze_audio(self, audio_path, analysis_prompt, preset="balanced", refresh=False):
         """分析音频"""
         try:
-            audio_path = self.audio_path_var.get().strip()
-            if not audio_path:
-                self.root.after(0, lambda: messagebox.showerror("错误", "请选择音频文件"))
-                return
-                
-            if not os.path.exists(audio_path):
-                self.root.after(0, lambda: messagebox.showerror("错误", "音频文件不存在"))
-                return
-                
-            # 获取分析提示
-            analysis_prompt = self.analysis_prompt_text.get("1.0", tk.END).strip()
-            if not analysis_prompt:
-                analysis_prompt = None
-                
             # 更新状态
             self.root.after(0, lambda: self.update_status("正在分析音频，请耐心等待..."))
             
-            # 调用AI分析
-            result = self.ai.analyze_audio(audio_path, analysis_prompt)
-            
-            # 显示结果
+            # 调用AI分析，结果逐段显示
             timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            result_text = f"[{timestamp}] 音频品鉴结果:\n{'='*50}\n{result}\n{'='*50}\n\n"
-            
-            self.root.after(0, lambda: self.update_analysis_result(result_text))
-            self.root.after(0, lambda: self.update_status("音频分析完成"))
+            stream = self.open_text_stream(self.analysis_log, f"[{timestamp}] 音频品鉴结果:\n{'='*50}\n")
+            parts = []
+            try:
+                for delta in self.ai.analyze_audio_stream(audio_path, analysis_prompt,
+                                                          cancel_token=self.scheduler.current_job().cancel_token,
+                                                          preset=None if preset == "features_only" else preset,
+                                                          upload_audio=preset != "features_only",
+                                                          refresh=refresh, raise_errors=True):
+                    parts.append(delta)
+                    stream.write(delta)
+            finally:
+                stream.close(f"\n{'='*50}")
+            # 生成记录中的文件关联本次分析
+            self.generation_index.link_analysis(audio_path, "".join(parts), self.ai.model, analysis_prompt)
+            self.report_first_token("音频分析完成", stream)
             
+        except CancelledError:
+            self.root.after(0, lambda: self.update_status("音频分析已取消"))
+            raise
         except Exception as e:
             error_msg = f"音频分析时出错: {str(e)}"
             self.root.after(0, lambda: self.update_status("分析失败"))
             self.root.after(0, lambda: messagebox.showerror("错误", error_msg))
+            raise
             
     def update_analysis_result(self, result):
         """更新分析结果显示"""
-        self.analysis_result.insert(tk.END, result)
-        self.analysis_result.see(tk.END)
+        self.analysis_log.append(result)
             
     def create_status_bar(self):
         """创建状态栏"""
@@ -598,6 +869,22 @@ class MusicGeneratorGUI:
         
         self.status_label = ttk.Label(self.status_bar, text="就绪", relief=tk.SUNKEN)
         self.status_label.pack(side=tk.LEFT, fill=tk.X, expand=True)
+
+        # 音乐服务连接状态
+        self.connection_label = ttk.Label(self.status_bar, text="", relief=tk.SUNKEN)
+        self.connection_label.pack(side=tk.RIGHT)
+        self.music_api.add_state_callback(
+            lambda state: self.root.after(0, lambda: self.update_connection_state(state)))
+
+    def update_connection_state(self, state):
+        """更新音乐服务连接状态"""
+        if state == "ready":
+            text = "🟢 音乐服务已就绪"
+        elif state == "failed":
+            text = f"🔴 音乐服务连接失败: {self.music_api.connection_error}"
+        else:
+            text = "🟡 正在连接音乐服务..."
+        self.connection_label.config(text=text)
         
     def update_status(self, message):
         """更新状态栏消息"""
@@ -606,8 +893,7 @@ class MusicGeneratorGUI:
         
     def update_history(self, entry):
         """更新历史记录"""
-        self.history_text.insert(tk.END, entry)
-        self.history_text.see(tk.END)
+        self.history_log.append(entry)
 
 def main():
     root = tk.Tk()
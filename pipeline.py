@@ -0,0 +1,214 @@
+# ------------------
+#       Meropo
+# ------------------
+import time
+import inspect
+import threading
+from dataclasses import dataclass
+from typing import List, Literal, Optional, Union
+from api import DEFAULT_API_URL, MusicAPI
+
+Stage = Literal['text2music', 'repaint', 'edit', 'extend']
+
+# stage -> (MusicAPI method, its previous-stage JSON parameter, its source and upload parameters)
+STAGE_METHODS = {
+    "repaint": ("repaint_process_func", "repaint_json_data", "repaint_source", "repaint_source_audio_upload"),
+    "edit": ("edit_process_func", "edit_input_params_json", "edit_source", "edit_source_audio_upload"),
+    "extend": ("extend_process_func", "extend_input_params_json", "extend_source", "extend_source_audio_upload"),
+}
+
+# generation settings a stage takes over from the stage it continues, unless given explicitly
+INHERITED_PARAMETERS = ("prompt", "lyrics", "infer_step", "guidance_scale", "scheduler_type", "cfg_type",
+                        "omega_scale", "guidance_interval", "guidance_interval_decay", "min_guidance_scale",
+                        "use_erg_tag", "use_erg_lyric", "use_erg_diffusion", "guidance_scale_text",
+                        "guidance_scale_lyric")
+
+
+@dataclass
+class PipelineStage:
+    stage: Stage
+    audio: Union[str, dict, None]  # local path, or FileData of the server-side file when downloads are off
+    params: dict  # parameter JSON returned by the endpoint; its "audio_path" is the server-side audio
+    source: str  # source the stage read its input audio from
+    elapsed: float
+
+    @property
+    def remote_audio_path(self) -> Optional[str]:
+        return self.params.get("audio_path")
+
+
+class MusicPipeline:
+    def __init__(self, api: Optional[MusicAPI] = None, api_url: str = DEFAULT_API_URL):
+        """
+        Chain text2music, repaint, edit and extend on the server.
+
+        Every stage keeps the parameter JSON of its result, whose "audio_path" points at
+        the audio on the server. The next stage passes that JSON back (as the text2music
+        data, or as its own JSON with the last_repaint/last_edit/last_extend source when
+        it repeats the same stage), so intermediate audio never travels to the client and
+        back. Use a single MusicAPI, not a pool: server paths are only valid on the
+        replica that produced them, and only as long as that server keeps its outputs (a
+        generation served from the result cache still names the audio of its original run).
+
+        Args:
+            api: Client to run the stages on; defaults to one that does not download results
+            api_url: Endpoint of the default client
+        """
+        self.api = api if api is not None else MusicAPI(api_url, cache_results=False, download_files=False)
+        self.stages: List[PipelineStage] = []
+        self._lock = threading.Lock()
+
+    @property
+    def last(self) -> Optional[PipelineStage]:
+        with self._lock:
+            return self.stages[-1] if self.stages else None
+
+    def latest(self, stage: Stage) -> Optional[PipelineStage]:
+        """The most recent result of a stage, if any."""
+        with self._lock:
+            return next((s for s in reversed(self.stages) if s.stage == stage), None)
+
+    def reset(self):
+        with self._lock:
+            self.stages.clear()
+
+    def _record(self, stage: Stage, source: str, start: float, result) -> PipelineStage:
+        audio, params = result
+        record = PipelineStage(stage, audio, params if isinstance(params, dict) else {}, source,
+                               time.perf_counter() - start)
+        with self._lock:
+            self.stages.append(record)
+        return record
+
+    def generate(self, **kwargs) -> PipelineStage:
+        """
+        Start (or restart) the chain with a text2music generation.
+
+        Args:
+            **kwargs: Keyword arguments of MusicAPI.generate_music
+
+        Returns:
+            The recorded PipelineStage
+        """
+        start = time.perf_counter()
+        return self._record("text2music", "text2music", start, self.api.generate_music(**kwargs))
+
+    def repaint(self, repaint_start: float, repaint_end: float, **kwargs) -> PipelineStage:
+        """
+        Repaint a time range of the current audio.
+
+        Args:
+            repaint_start: Start time for repaint
+            repaint_end: End time for repaint
+            **kwargs: source, source_audio and keyword arguments of MusicAPI.repaint_process_func
+
+        Returns:
+            The recorded PipelineStage
+        """
+        return self._run("repaint", repaint_start=repaint_start, repaint_end=repaint_end, **kwargs)
+
+    def edit(self, **kwargs) -> PipelineStage:
+        """
+        Edit the tags or lyrics of the current audio.
+
+        Args:
+            **kwargs: source, source_audio and keyword arguments of MusicAPI.edit_process_func,
+                e.g. edit_prompt, edit_lyrics, edit_n_min and edit_n_max
+
+        Returns:
+            The recorded PipelineStage
+        """
+        return self._run("edit", **kwargs)
+
+    def extend(self, left_extend_length: float = 0, right_extend_length: float = 30, **kwargs) -> PipelineStage:
+        """
+        Extend the current audio.
+
+        Args:
+            left_extend_length: Seconds added before the audio
+            right_extend_length: Seconds added after the audio
+            **kwargs: source, source_audio and keyword arguments of MusicAPI.extend_process_func
+
+        Returns:
+            The recorded PipelineStage
+        """
+        return self._run("extend", left_extend_length=left_extend_length,
+                         right_extend_length=right_extend_length, **kwargs)
+
+    def _run(self, stage: Stage, source: Optional[str] = None, source_audio: Optional[str] = None,
+             **kwargs) -> PipelineStage:
+        """
+        Run a repaint, edit or extend stage on the output of an earlier stage.
+
+        Args:
+            stage: "repaint", "edit" or "extend"
+            source: "text2music" (latest generation), "last_<stage>" (latest result of this stage),
+                "upload" (source_audio) or None to continue from the latest stage of any kind
+            source_audio: Local audio file, used with source "upload" or to start an empty pipeline
+            **kwargs: Keyword arguments of the MusicAPI method
+
+        Returns:
+            The recorded PipelineStage
+        """
+        method, json_parameter, source_parameter, upload_parameter = STAGE_METHODS[stage]
+        if source is None:
+            previous = self.last
+            if previous is None:
+                if source_audio is None:
+                    raise ValueError(f"nothing to {stage} yet: generate first or pass source_audio")
+                source = "upload"
+            elif previous.stage == stage:
+                source = "last_" + stage
+            else:
+                source = "text2music"
+        else:
+            previous = None
+
+        text2music = self.latest("text2music")
+        if source == "upload":
+            if source_audio is None:
+                raise ValueError("source 'upload' needs source_audio")
+            previous = None  # unrelated audio, nothing to inherit
+            own = self.latest(stage)
+        elif source == "text2music":
+            # the server reads the source audio from text2music_json_data["audio_path"], so the JSON of
+            # any earlier stage chains that stage's output without sending the audio back
+            previous = previous or text2music
+            if previous is None:
+                raise ValueError(f"no text2music result to {stage}")
+            text2music = own = previous
+        elif source == "last_" + stage:
+            own = previous = self.latest(stage)
+            if previous is None:
+                raise ValueError(f"no earlier {stage} result")
+        else:
+            raise ValueError(f"unknown {stage} source {source!r}")
+
+        if previous is not None:
+            accepted = inspect.signature(getattr(self.api, method)).parameters
+            for name in INHERITED_PARAMETERS:
+                if name in previous.params and name in accepted and name not in kwargs:
+                    kwargs[name] = previous.params[name]
+
+        kwargs[json_parameter] = own.params if own is not None else {}
+        kwargs[source_parameter] = source
+        kwargs[upload_parameter] = source_audio if source == "upload" else None
+        start = time.perf_counter()
+        result = getattr(self.api, method)(text2music.params if text2music is not None else {}, **kwargs)
+        return self._record(stage, source, start, result)
+
+    def download(self, stage: Optional[PipelineStage] = None, path: Optional[str] = None) -> str:
+        """
+        Fetch the audio of a stage, by default the latest one.
+
+        Args:
+            stage: Stage whose audio to fetch
+            path: Local destination; defaults to a temporary file
+
+        Returns:
+            Path of the local audio file
+        """
+        stage = stage or self.last
+        if stage is None or stage.audio is None:
+            raise ValueError("no audio to download")
+        return self.api.download(stage.audio, path)
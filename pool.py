@@ -0,0 +1,345 @@
+# ------------------
+#       Meropo
+# ------------------
+import time
+import httpx
+import weakref
+import urllib.parse
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+from typing import Dict, Iterator, List, Literal, Optional, Union
+from gradio_client import Client
+from gradio_client.client import Job
+from api import MusicAPI
+
+MAX_TRACKED_FILES = 4096  # server-side result files whose replica is remembered for fetching them
+
+
+class _Replica:
+    def __init__(self, api: MusicAPI):
+        self.api = api
+        self.in_flight = 0
+        self.queue_size = 0
+        self.latency: Optional[float] = None  # EWMA of successful call durations, seconds
+        self.healthy = True
+        self.failures = 0
+
+    def score(self):
+        return self.in_flight + self.queue_size, self.latency or 0.0
+
+
+class _HedgedJob:
+    """Job-like handle racing a primary gradio Job against a delayed duplicate on another replica."""
+
+    def __init__(self, pool: "MusicAPIPool", replica: _Replica, job: Job, api_name: str, kwargs: dict,
+                 delay: float):
+        self.future = Future()
+        self.jobs = [job]
+        self._owners = {id(job): replica}
+        self._pool = pool
+        self._replica = replica
+        self._api_name = api_name
+        self._kwargs = kwargs
+        self._lock = threading.Lock()
+        self._cancelling = False
+        self.winner: Optional[_Replica] = None  # replica of the copy whose result was taken
+        self._timer = threading.Timer(delay, self._launch_hedge)
+        self._timer.daemon = True
+        self._timer.start()
+        job.add_done_callback(lambda _: self._settle(job))
+
+    def _launch_hedge(self):
+        with self._lock:
+            if self.future.done() or self._cancelling or not self._pool._take_hedge_budget():
+                return
+        # submitting may wait for the replica's connection, so it must not hold the lock
+        try:
+            replica, job = self._pool._submit_to(self._api_name, self._kwargs, exclude=self._replica)
+        except Exception:
+            return  # the primary is still running, losing the hedge is harmless
+        with self._lock:
+            registered = not (self.future.done() or self._cancelling)
+            if registered:
+                self.jobs.append(job)
+                self._owners[id(job)] = replica
+        if not registered:
+            replica.api._cancel_job(job)  # settled or cancelled while the hedge was being submitted
+            return
+        job.add_done_callback(lambda _: self._settle(job))
+
+    def _settle(self, job: Job):
+        with self._lock:
+            if self.future.done():
+                return
+            if not job.cancelled() and job.exception() is None:
+                self.winner = self._owners[id(job)]
+                self.future.set_result(job.result())
+            elif all(j.done() for j in self.jobs):
+                self._timer.cancel()
+                if job.cancelled():
+                    self.future.cancel()
+                else:
+                    self.future.set_exception(job.exception())
+                return
+            else:
+                return  # another copy is still running and may succeed
+            self._timer.cancel()
+            losers = [j for j in self.jobs if j is not job]
+        for loser in losers:
+            self._owners[id(loser)].api._cancel_job(loser)
+
+    def result(self, timeout: Optional[float] = None):
+        return self.future.result(timeout=timeout)
+
+    def exception(self, timeout: Optional[float] = None):
+        return self.future.exception(timeout=timeout)
+
+    def done(self) -> bool:
+        return self.future.done()
+
+    def cancelled(self) -> bool:
+        return self.future.cancelled()
+
+    def add_done_callback(self, fn):
+        self.future.add_done_callback(fn)
+
+    def status(self):
+        with self._lock:
+            running = [j for j in self.jobs if not j.done()]
+        return (running or self.jobs)[-1].status()
+
+    def cancel(self) -> bool:
+        self._timer.cancel()
+        with self._lock:
+            self._cancelling = True  # a hedge still being submitted cancels itself
+            jobs = list(self.jobs)
+        for job in jobs:
+            self._owners[id(job)].api._cancel_job(job)
+        self.future.cancel()
+        return True
+
+
+class MusicAPIPool(MusicAPI):
+    def __init__(self, endpoints: List[str], probe_interval: float = 15.0, failure_threshold: int = 2,
+                 connect_timeout: Optional[float] = None, cache_schema: bool = True,
+                 cache_results: bool = True, result_cache_bytes: int = 2 * 1024 ** 3,
+                 hedge: bool = False, hedge_percentile: float = 0.9, max_hedge_ratio: float = 0.1,
+                 hedge_min_samples: int = 20, status_interval: float = 0.5, download_files: bool = True):
+        """
+        MusicAPI spread over several ACE-Step replicas.
+
+        Keeps one client per endpoint and routes every call to the healthy replica
+        with the fewest queued and in-flight jobs, breaking ties by recent latency.
+        A background probe polls each replica's queue; replicas failing
+        failure_threshold probes in a row are ejected and re-admitted once a probe
+        succeeds again. All MusicAPI methods are available unchanged.
+
+        With hedge enabled, a call still running after the observed hedge_percentile
+        latency of its endpoint is duplicated on another replica; the first copy to
+        succeed wins and the other is cancelled. Hedges are capped at max_hedge_ratio
+        of all calls so they cannot double the load.
+
+        Args:
+            endpoints: Base URLs of the replicas
+            probe_interval: Seconds between health probes
+            failure_threshold: Consecutive failed probes before a replica is ejected
+            connect_timeout: Seconds a remote call waits for a replica connection
+            cache_schema: Whether replicas persist and reuse their endpoint schema
+            cache_results: Whether to cache the audio of seeded generations on disk
+            result_cache_bytes: Size cap of the result cache
+            hedge: Whether to send delayed duplicates of slow calls
+            hedge_percentile: Latency percentile after which a call is hedged
+            max_hedge_ratio: Maximum fraction of calls that may be hedged
+            hedge_min_samples: Latency samples needed per endpoint before hedging starts
+            status_interval: Seconds between job status polls for calls given an on_status callback
+            download_files: Whether audio results are downloaded, see MusicAPI
+        """
+        if not endpoints:
+            raise ValueError("MusicAPIPool needs at least one endpoint")
+        # the replicas own the connections; MusicAPI.__init__ starts them through connect()
+        self.replicas = [_Replica(MusicAPI(url, connect_timeout=connect_timeout, cache_schema=cache_schema,
+                                           cache_results=False, status_interval=status_interval,
+                                           download_files=download_files))
+                         for url in endpoints]
+        super().__init__(endpoints[0], connect_timeout=connect_timeout, cache_schema=False,
+                         cache_results=cache_results, result_cache_bytes=result_cache_bytes,
+                         status_interval=status_interval, download_files=download_files)
+        self.probe_interval = probe_interval
+        self.failure_threshold = failure_threshold
+        self.hedge = hedge
+        self.hedge_percentile = hedge_percentile
+        self.max_hedge_ratio = max_hedge_ratio
+        self.hedge_min_samples = hedge_min_samples
+        self._latencies: Dict[str, deque] = {}
+        self._calls = 0
+        self._hedges = 0
+        self._job_replicas = weakref.WeakKeyDictionary()
+        self._file_replicas: "OrderedDict[str, _Replica]" = OrderedDict()  # server path -> replica holding it
+        for replica in self.replicas:
+            replica.api.add_state_callback(lambda _: self._notify_state(self.state))
+        self._closed = threading.Event()
+        threading.Thread(target=self._probe_loop, daemon=True).start()
+
+    def connect(self):
+        """Start the handshake of every replica that is not connected; the pool has no connection of its own."""
+        for replica in self.replicas:
+            replica.api.connect()
+
+    @property
+    def state(self) -> Literal['connecting', 'ready', 'failed']:
+        states = [replica.api.state for replica in self.replicas]
+        if "ready" in states:
+            return "ready"
+        return "connecting" if "connecting" in states else "failed"
+
+    @property
+    def connection_error(self) -> Optional[BaseException]:
+        errors = [replica.api.connection_error for replica in self.replicas]
+        return next((e for e in errors if e is not None), None)
+
+    @property
+    def client(self) -> Client:
+        """Client of the replica that would receive the next call; result files are fetched from their own replica."""
+        return self._pick().api.client
+
+    def close(self):
+        """Stop the health probes."""
+        self._closed.set()
+
+    def _pick(self, exclude: Optional[_Replica] = None) -> _Replica:
+        candidates = [r for r in self.replicas if r.healthy and r.api.state != "failed" and r is not exclude]
+        if not candidates:
+            # with every replica ejected, keep trying all of them rather than failing outright
+            candidates = [r for r in self.replicas if r is not exclude] or self.replicas
+        return min(candidates, key=_Replica.score)
+
+    def _submit(self, *, api_name: str, **kwargs) -> Job:
+        replica, job = self._submit_to(api_name, kwargs)
+        with self._lock:
+            self._calls += 1
+        delay = self._hedge_delay(api_name) if self.hedge and len(self.replicas) > 1 else None
+        if delay is None:
+            return job
+        return _HedgedJob(self, replica, job, api_name, kwargs, delay)
+
+    def _submit_to(self, api_name: str, kwargs: dict, exclude: Optional[_Replica] = None):
+        with self._lock:
+            replica = self._pick(exclude)
+            replica.in_flight += 1
+        start = time.perf_counter()
+        try:
+            job = replica.api._submit(api_name=api_name, **kwargs)
+        except BaseException:
+            self._release(replica, api_name, None)
+            raise
+        job.add_done_callback(lambda future: self._release(
+            replica, api_name,
+            time.perf_counter() - start if not future.cancelled() and future.exception() is None else None))
+        self._job_replicas[job] = replica
+        return replica, job
+
+    def _cancel_job(self, job: Job):
+        replica = self._job_replicas.get(job)
+        if replica is None:
+            job.cancel()  # a _HedgedJob cancels every copy on its own replica
+        else:
+            replica.api._cancel_job(job)
+
+    def _job_result(self, job: Job):
+        result = job.result()
+        replica = job.winner if isinstance(job, _HedgedJob) else self._job_replicas.get(job)
+        if replica is not None:
+            self._remember_files(result, replica)
+        return result
+
+    def _remember_files(self, outputs, replica: _Replica):
+        """Record the replica holding every server-side file (FileData dict) among a job's outputs."""
+        if isinstance(outputs, dict):
+            if isinstance(outputs.get("path"), str):
+                with self._lock:
+                    self._file_replicas[outputs["path"]] = replica
+                    self._file_replicas.move_to_end(outputs["path"])
+                    while len(self._file_replicas) > MAX_TRACKED_FILES:
+                        self._file_replicas.popitem(last=False)
+            return
+        if isinstance(outputs, (list, tuple)):
+            for output in outputs:
+                self._remember_files(output, replica)
+
+    def iter_file(self, file: Union[str, dict], chunk_size: int = 1024 * 1024) -> Iterator[bytes]:
+        """Stream a server-side file from the replica that produced it (see MusicAPI.iter_file)."""
+        remote_path = file["path"] if isinstance(file, dict) else file
+        with self._lock:
+            replica = self._file_replicas.get(remote_path)
+        if replica is None:
+            return super().iter_file(file, chunk_size)  # not a result of this pool, or long forgotten
+        return replica.api.iter_file(file, chunk_size)
+
+    def _release(self, replica: _Replica, api_name: str, elapsed: Optional[float]):
+        with self._lock:
+            replica.in_flight -= 1
+            if elapsed is not None:
+                replica.latency = elapsed if replica.latency is None else 0.8 * replica.latency + 0.2 * elapsed
+                self._latencies.setdefault(api_name, deque(maxlen=200)).append(elapsed)
+
+    def _hedge_delay(self, api_name: str) -> Optional[float]:
+        with self._lock:
+            samples = sorted(self._latencies.get(api_name, ()))
+        if len(samples) < self.hedge_min_samples:
+            return None
+        return samples[min(len(samples) - 1, int(self.hedge_percentile * len(samples)))]
+
+    def _take_hedge_budget(self) -> bool:
+        with self._lock:
+            if self._hedges + 1 > self.max_hedge_ratio * self._calls:
+                return False
+            self._hedges += 1
+            return True
+
+    def _probe_loop(self):
+        while not self._closed.wait(self.probe_interval):
+            for replica in self.replicas:
+                self._probe(replica)
+
+    def _probe(self, replica: _Replica):
+        state = replica.api.state
+        if state == "connecting":
+            return
+        if state == "failed":
+            replica.healthy = False
+            replica.api.connect()
+            return
+        client = replica.api.client
+        try:
+            r = httpx.get(urllib.parse.urljoin(client.src_prefixed, "queue/status"), headers=client.headers,
+                          cookies=client.cookies, verify=client.ssl_verify, timeout=10)
+            r.raise_for_status()
+            queue_size = r.json().get("queue_size") or 0
+        except (httpx.HTTPError, ValueError):
+            with self._lock:
+                replica.failures += 1
+                if replica.failures >= self.failure_threshold:
+                    replica.healthy = False
+            return
+        with self._lock:
+            replica.queue_size = queue_size
+            replica.failures = 0
+            replica.healthy = True
+
+    def hedge_stats(self) -> dict:
+        """Number of calls and of hedged duplicates sent so far."""
+        with self._lock:
+            return {"calls": self._calls, "hedges": self._hedges}
+
+    def stats(self) -> List[dict]:
+        """Routing state of every replica, for display or logging."""
+        with self._lock:
+            return [{
+                "endpoint": replica.api.api_url,
+                "state": replica.api.state,
+                "healthy": replica.healthy,
+                "in_flight": replica.in_flight,
+                "queue_size": replica.queue_size,
+                "latency": replica.latency,
+            } for replica in self.replicas]
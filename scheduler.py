@@ -0,0 +1,222 @@
+# ------------------
+#       Meropo
+# ------------------
+import time
+import queue
+import itertools
+import threading
+from collections import deque
+from typing import Callable, Dict, List, Literal, Optional
+from cancel import CancelToken
+
+JobState = Literal['queued', 'running', 'done', 'failed', 'cancelled']
+
+
+class ScheduledJob:
+    _ids = itertools.count(1)
+
+    def __init__(self, name: str, kind: str, fn: Callable, args: tuple, kwargs: dict):
+        """
+        A unit of work tracked by the JobScheduler.
+
+        Args:
+            name: Label shown to the user
+            kind: Concurrency class of the job, e.g. "music" or "ai"
+            fn: Function run on a worker thread
+            args: Positional arguments for fn
+            kwargs: Keyword arguments for fn
+        """
+        self.id = next(self._ids)
+        self.name = name
+        self.kind = kind
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.state: JobState = "queued"
+        self.detail = ""
+        self.error: Optional[BaseException] = None
+        self.result = None
+        self.submitted_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.cancel_token = CancelToken()
+
+    @property
+    def finished(self) -> bool:
+        return self.state in ("done", "failed", "cancelled")
+
+    @property
+    def elapsed(self) -> Optional[float]:
+        if self.started_at is None:
+            return None
+        return (self.finished_at or time.time()) - self.started_at
+
+
+class JobScheduler:
+    def __init__(self, limits: Optional[Dict[str, int]] = None, keep_finished: int = 200):
+        """
+        FIFO job queue with a bounded number of running jobs per kind.
+
+        A queued job starts as soon as fewer than limits[kind] jobs of its kind are
+        running, so long generations never starve short AI requests and a burst of
+        clicks never fires more remote jobs than allowed. Each kind has its own fixed
+        set of limits[kind] worker threads, started on first use and reused for every
+        job, instead of a new thread per job.
+
+        Args:
+            limits: Maximum number of running jobs per kind (kinds not listed get 1)
+            keep_finished: Number of finished jobs kept for display
+        """
+        self.limits = dict(limits or {})
+        self.keep_finished = keep_finished
+        self._lock = threading.Lock()
+        self._queue = deque()
+        self._running: Dict[int, ScheduledJob] = {}
+        self._finished = deque()
+        self._listeners: List[Callable[[ScheduledJob], None]] = []
+        self._local = threading.local()
+        self._inboxes: Dict[str, queue.SimpleQueue] = {}  # kind -> jobs handed to its workers
+        self._workers: Dict[str, int] = {}  # kind -> number of worker threads started
+
+    def add_listener(self, callback: Callable[[ScheduledJob], None]):
+        """Register a callback invoked (on the worker or caller thread) whenever a job changes."""
+        self._listeners.append(callback)
+
+    def _notify(self, job: ScheduledJob):
+        for callback in list(self._listeners):
+            callback(job)
+
+    def submit(self, name: str, fn: Callable, *args, kind: str = "music", **kwargs) -> ScheduledJob:
+        """
+        Queue a job.
+
+        Args:
+            name: Label shown to the user
+            fn: Function run on a worker thread
+            *args: Positional arguments for fn
+            kind: Concurrency class of the job
+            **kwargs: Keyword arguments for fn
+
+        Returns:
+            The queued ScheduledJob
+        """
+        job = ScheduledJob(name, kind, fn, args, kwargs)
+        with self._lock:
+            self._queue.append(job)
+        self._notify(job)
+        self._dispatch()
+        return job
+
+    def set_limit(self, kind: str, limit: int):
+        """Change the number of concurrently running jobs of a kind."""
+        with self._lock:
+            self.limits[kind] = max(1, int(limit))
+        self._dispatch()
+
+    def _dispatch(self):
+        started = []
+        with self._lock:
+            running_per_kind: Dict[str, int] = {}
+            for job in self._running.values():
+                running_per_kind[job.kind] = running_per_kind.get(job.kind, 0) + 1
+            for job in list(self._queue):
+                if running_per_kind.get(job.kind, 0) >= self.limits.get(job.kind, 1):
+                    continue
+                self._queue.remove(job)
+                job.state = "running"
+                job.started_at = time.time()
+                self._running[job.id] = job
+                running_per_kind[job.kind] = running_per_kind.get(job.kind, 0) + 1
+                started.append((self._inbox(job.kind), job))
+        for inbox, job in started:
+            inbox.put(job)
+            self._notify(job)
+
+    def _inbox(self, kind: str) -> queue.SimpleQueue:
+        """Queue feeding the workers of a kind, starting workers up to its limit; call with the lock held."""
+        inbox = self._inboxes.setdefault(kind, queue.SimpleQueue())
+        while self._workers.get(kind, 0) < self.limits.get(kind, 1):
+            self._workers[kind] = self._workers.get(kind, 0) + 1
+            threading.Thread(target=self._work, args=(inbox,), name=f"meropo-{kind}-{self._workers[kind]}",
+                             daemon=True).start()
+        return inbox
+
+    def _work(self, inbox: queue.SimpleQueue):
+        while True:
+            self._run(inbox.get())
+
+    def current_job(self) -> Optional[ScheduledJob]:
+        """The job running on the calling worker thread, if any."""
+        return getattr(self._local, "job", None)
+
+    def report(self, detail: str):
+        """
+        Update the detail text of the job running on the calling thread and notify listeners.
+
+        Args:
+            detail: Progress description, e.g. queue position or inference step
+        """
+        job = self.current_job()
+        if job is None:
+            return
+        job.detail = detail
+        self._notify(job)
+
+    def _run(self, job: ScheduledJob):
+        self._local.job = job
+        try:
+            job.result = job.fn(*job.args, **job.kwargs)
+            state = "cancelled" if job.cancel_token.cancelled else "done"
+        except BaseException as e:
+            job.error = e
+            state = "cancelled" if job.cancel_token.cancelled else "failed"
+        finally:
+            self._local.job = None  # the worker thread goes on to other jobs
+        self._finish(job, state)
+        self._dispatch()
+
+    def _finish(self, job: ScheduledJob, state: JobState):
+        with self._lock:
+            self._running.pop(job.id, None)
+            job.state = state
+            job.finished_at = time.time()
+            self._finished.append(job)
+            while len(self._finished) > self.keep_finished:
+                self._finished.popleft()
+        self._notify(job)
+
+    def cancel(self, job_id: int) -> bool:
+        """
+        Cancel a job. A queued job is dropped at once; a running job has its cancel_token
+        cancelled, which stops the remote calls it passed the token to.
+
+        Args:
+            job_id: Id of the job
+
+        Returns:
+            Whether a job with that id was queued or running
+        """
+        with self._lock:
+            job = next((j for j in self._queue if j.id == job_id), None)
+            if job is not None:
+                self._queue.remove(job)
+            running = self._running.get(job_id)
+        if job is not None:
+            job.cancel_token.cancel()
+            self._finish(job, "cancelled")
+            return True
+        if running is not None:
+            running.cancel_token.cancel()
+            self._notify(running)
+            return True
+        return False
+
+    def clear_finished(self):
+        with self._lock:
+            self._finished.clear()
+
+    def jobs(self) -> List[ScheduledJob]:
+        """Finished, running and queued jobs in submission order."""
+        with self._lock:
+            jobs = list(self._finished) + list(self._running.values()) + list(self._queue)
+        return sorted(jobs, key=lambda job: job.id)
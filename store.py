@@ -0,0 +1,165 @@
+# ------------------
+#       Meropo
+# ------------------
+import os
+import json
+import time
+import uuid
+import shutil
+import hashlib
+import itertools
+from typing import Iterable, Optional, Union
+from cache import CACHE_DIR, DiskLRU, file_digest
+
+INCOMING_DIR = "incoming"
+
+
+class OutputStore(DiskLRU):
+    def __init__(self, root: str = os.path.join(CACHE_DIR, "outputs"), max_bytes: int = 20 * 1024 ** 3,
+                 stale_incoming: float = 24 * 3600):
+        """
+        Content-addressed store of generated audio with a disk quota.
+
+        Files are named by the SHA-256 of their content and sharded by its first two
+        characters, so identical renders are kept once and no directory grows huge.
+        Downloads are written into an incoming directory under root and renamed into
+        place, which is atomic and copy-free because both are on the same filesystem.
+        The least recently used files are deleted once the store exceeds max_bytes, so
+        the store is a cache: files meant for the user are exported out of it.
+
+        Args:
+            root: Directory holding the files and the index
+            max_bytes: Disk quota of the store
+            stale_incoming: Age in seconds after which leftover partial downloads are removed
+        """
+        super().__init__(root, max_bytes)
+        self.incoming = os.path.join(root, INCOMING_DIR)
+        os.makedirs(self.incoming, exist_ok=True)
+        self._remove_stale_incoming(stale_incoming)
+
+    def _remove_stale_incoming(self, max_age: float):
+        cutoff = time.time() - max_age
+        for entry in os.scandir(self.incoming):
+            try:
+                if entry.is_file() and entry.stat().st_mtime < cutoff:
+                    os.remove(entry.path)
+            except OSError:
+                pass  # another process finished or removed it
+
+    def _incoming_path(self, suffix: str = "") -> str:
+        return os.path.join(self.incoming, uuid.uuid4().hex + suffix)
+
+    def _commit(self, src_path: str, key: str, suffix: str, meta: Optional[str]) -> str:
+        """Rename a file on the store's filesystem to its content address (or drop it if already stored)."""
+        existing = self.get(key)
+        if existing is not None:
+            os.remove(src_path)
+            return existing[0]
+        path = self.path_for(key, suffix)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(src_path, path)
+        self._index(key, path, meta)
+        return path
+
+    def save_stream(self, chunks: Iterable[bytes], suffix: str = "", meta: Optional[str] = None) -> str:
+        """
+        Write content into the store, hashing it on the way.
+
+        Args:
+            chunks: Content of the file, e.g. MusicAPI.iter_file
+            suffix: File extension including the dot
+            meta: Optional text stored alongside the file
+
+        Returns:
+            Path of the stored file
+        """
+        h = hashlib.sha256()
+        incoming = self._incoming_path(suffix)
+        try:
+            with open(incoming, 'wb') as f:
+                for chunk in chunks:
+                    h.update(chunk)
+                    f.write(chunk)
+        except BaseException:
+            if os.path.exists(incoming):
+                os.remove(incoming)
+            raise
+        return self._commit(incoming, h.hexdigest(), suffix, meta)
+
+    def add(self, src_path: str, meta: Optional[str] = None) -> str:
+        """
+        Move a local file into the store.
+
+        On the store's filesystem the file is renamed without copying; from another
+        filesystem it is copied once and the source removed.
+
+        Args:
+            src_path: File to move
+            meta: Optional text stored alongside the file
+
+        Returns:
+            Path of the stored file
+        """
+        suffix = os.path.splitext(src_path)[1]
+        if os.stat(src_path).st_dev != os.stat(self.root).st_dev:
+            with open(src_path, 'rb') as f:
+                path = self.save_stream(iter(lambda: f.read(1024 * 1024), b''), suffix, meta)
+            os.remove(src_path)
+            return path
+        return self._commit(src_path, file_digest(src_path), suffix, meta)
+
+    def store_result(self, api, audio: Union[str, dict], params=None) -> str:
+        """
+        Place the audio returned by a MusicAPI call in the store.
+
+        Args:
+            api: MusicAPI that produced the result
+            audio: Local path (downloaded result) or FileData dict (download_files=False)
+            params: Generation parameters kept as the entry's metadata
+
+        Returns:
+            Path of the stored file
+        """
+        meta = json.dumps({"params": params, "stored_at": time.time()}, ensure_ascii=False, default=str)
+        if isinstance(audio, str) and os.path.isfile(audio):
+            return self.add(audio, meta)
+        remote_path = audio["path"] if isinstance(audio, dict) else audio
+        return self.save_stream(api.iter_file(audio), os.path.splitext(remote_path)[1], meta)
+
+    @staticmethod
+    def export(path: str, directory: str, name: str) -> str:
+        """
+        Give a stored file a readable name outside the store, e.g. on the Desktop.
+
+        The export is a hard link, so the render is not written to disk a second
+        time; it is copied only where linking is impossible (another filesystem, or
+        one without hard links). The export is not tracked by the store, so eviction
+        removes only the store's name and never the user's file. An existing file of
+        the same name is kept and the export gets a numbered name.
+
+        Args:
+            path: Stored file
+            directory: Destination directory
+            name: Wanted file name
+
+        Returns:
+            Path of the exported file
+        """
+        os.makedirs(directory, exist_ok=True)
+        stem, suffix = os.path.splitext(name)
+        for number in itertools.count(1):
+            target = os.path.join(directory, name if number == 1 else f"{stem}_{number}{suffix}")
+            try:
+                os.link(path, target)
+                return target
+            except FileExistsError:
+                continue  # claimed by an earlier export or a concurrent job
+            except OSError:
+                pass  # different device or no hard link support: copy instead
+            try:
+                fd = os.open(target, os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, "O_BINARY", 0))
+            except FileExistsError:
+                continue  # claimed by an earlier export or a concurrent job
+            with os.fdopen(fd, 'wb') as out, open(path, 'rb') as src:
+                shutil.copyfileobj(src, out, 1024 * 1024)
+            return target
@@ -0,0 +1,161 @@
+# ------------------
+#       Meropo
+# ------------------
+import time
+import threading
+import concurrent.futures
+import httpx
+import openai
+import pytest
+import bulk
+from api import AnalysisError, AnalysisFailedError
+from bulk import BulkAnalyzer, RateLimiter, TokenBucket
+from cancel import CancelToken
+from cli import build_parser
+
+
+def rate_limit_error(retry_after: str = "0") -> openai.RateLimitError:
+    request = httpx.Request("POST", "https://api.example.com/v1/chat/completions")
+    response = httpx.Response(429, headers={"retry-after": retry_after}, request=request)
+    return openai.RateLimitError("rate limited", response=response, body=None)
+
+
+class StubAI:
+    """Stands in for api.AI: replies with or raises the queued outcomes of each file in turn."""
+
+    def __init__(self, outcomes=None, cached=None):
+        self.outcomes = {path: list(queue) for path, queue in (outcomes or {}).items()}
+        self.cached = cached or {}
+        self.calls = []
+
+    def cached_analysis(self, path, analysis_prompt, preset, with_features, upload_audio):
+        return self.cached.get(path)
+
+    def analyze_audio(self, path, timeout=None, cancel_token=None, raise_errors=False, **options):
+        self.calls.append(path)
+        outcome = self.outcomes[path].pop(0)
+        if outcome == "hang":  # a long request that only a cancelled token ends
+            cancel_token.wait(10)
+            cancel_token.raise_if_cancelled()
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+
+@pytest.fixture
+def limiter():
+    return RateLimiter(rpm=60000)
+
+
+def test_bucket_reserve_goes_into_debt():
+    bucket = TokenBucket(60, capacity=2)  # one token per second
+    assert bucket.reserve(1) == 0
+    assert bucket.reserve(1) == 0
+    assert bucket.reserve(1) == pytest.approx(1, abs=0.05)
+    assert bucket.reserve(2) == pytest.approx(3, abs=0.05)  # waits behind the earlier debt
+
+
+def test_bucket_refills_up_to_capacity():
+    bucket = TokenBucket(60, capacity=2)
+    bucket.reserve(2)
+    bucket.updated -= 10  # ten seconds later
+    assert bucket.reserve(2) == 0
+    assert bucket.tokens == pytest.approx(0, abs=0.05)
+
+
+def test_limiter_pause_holds_back_acquire():
+    limiter = RateLimiter(rpm=60000)
+    limiter.pause(0.2)
+    limiter.pause(0.05)  # a shorter pause does not cut the longer one short
+    start = time.monotonic()
+    limiter.acquire()
+    assert time.monotonic() - start >= 0.18
+
+
+def test_limiter_pause_ends_on_cancel():
+    limiter = RateLimiter(rpm=60000)
+    limiter.pause(10)
+    cancel_token = CancelToken()
+    threading.Timer(0.05, cancel_token.cancel).start()
+    start = time.monotonic()
+    with pytest.raises(concurrent.futures.CancelledError):
+        limiter.acquire(cancel_token=cancel_token)
+    assert time.monotonic() - start < 2
+
+
+def test_limiter_charges_tokens():
+    limiter = RateLimiter(rpm=60000, tpm=600)
+    limiter.acquire(600)
+    assert limiter.tokens.reserve(10) == pytest.approx(1, abs=0.05)
+
+
+def test_success(limiter):
+    ai = StubAI({"a.wav": ["good"]})
+    record = BulkAnalyzer(ai, limiter).analyze("a.wav")
+    assert record["ok"] and record["analysis"] == "good"
+    assert record["attempts"] == 1 and not record["cached"] and record["error"] is None
+
+
+def test_cached_analysis_skips_the_request(limiter):
+    ai = StubAI(cached={"a.wav": "from cache"})
+    record = BulkAnalyzer(ai, limiter).analyze("a.wav")
+    assert record["ok"] and record["cached"] and record["analysis"] == "from cache"
+    assert record["attempts"] == 0 and ai.calls == []
+
+
+def test_refresh_ignores_the_cache(limiter):
+    ai = StubAI({"a.wav": ["fresh"]}, cached={"a.wav": "from cache"})
+    record = BulkAnalyzer(ai, limiter, refresh=True).analyze("a.wav")
+    assert record["analysis"] == "fresh" and not record["cached"]
+
+
+def test_rate_limit_is_retried_and_pauses_the_limiter(limiter, monkeypatch):
+    pauses = []
+    monkeypatch.setattr(limiter, "pause", pauses.append)
+    ai = StubAI({"a.wav": [rate_limit_error("0.01"), rate_limit_error("0"), "good"]})
+    record = BulkAnalyzer(ai, limiter).analyze("a.wav")
+    assert record["ok"] and record["attempts"] == 3
+    assert pauses == [0.01, 0.0]
+
+
+def test_retries_are_limited(limiter, monkeypatch):
+    monkeypatch.setattr(bulk, "backoff", lambda attempt: 0)
+    ai = StubAI({"a.wav": [TimeoutError("slow")] * 3})
+    record = BulkAnalyzer(ai, limiter, max_retries=2).analyze("a.wav")
+    assert not record["ok"] and record["attempts"] == 3
+    assert record["error_type"] == "TimeoutError"
+
+
+@pytest.mark.parametrize("error", [AnalysisError("no audio"), AnalysisFailedError("bad file"),
+                                   ValueError("unexpected"), KeyError("choices")])
+def test_other_errors_are_recorded(limiter, error):
+    ai = StubAI({"a.wav": [error]})
+    record = BulkAnalyzer(ai, limiter).analyze("a.wav")
+    assert not record["ok"] and record["attempts"] == 1
+    assert record["error_type"] == type(error).__name__ and record["error"] == str(error)
+
+
+def test_run_finishes_the_batch_despite_failures(limiter):
+    ai = StubAI({"a.wav": ["good"], "b.wav": [ValueError("broken")], "c.wav": ["fine"]})
+    records = {record["id"]: record for record in
+               BulkAnalyzer(ai, limiter, concurrency=2).run(["a.wav", "b.wav", "c.wav"], skip={"c.wav"})}
+    assert set(records) == {"a.wav", "b.wav"}
+    assert records["a.wav"]["ok"] and not records["b.wav"]["ok"]
+
+
+def test_cancel_aborts_requests_in_flight(limiter):
+    cancel_token = CancelToken()
+    ai = StubAI({"a.wav": ["hang"], "b.wav": ["hang"]})
+    analyzer = BulkAnalyzer(ai, limiter, concurrency=2, cancel_token=cancel_token)
+    threading.Timer(0.05, cancel_token.cancel).start()
+    start = time.monotonic()
+    records = list(analyzer.run(["a.wav", "b.wav"]))
+    assert time.monotonic() - start < 2
+    assert [record["error_type"] for record in records] == ["CancelledError"] * 2
+
+
+def test_analyze_rejects_unknown_presets(capsys):
+    assert build_parser().parse_args(["analyze", "a.wav", "--preset", "high"]).preset == "high"
+    with pytest.raises(SystemExit):
+        build_parser().parse_args(["analyze", "a.wav", "--preset", "hihg"])
+    assert "invalid choice" in capsys.readouterr().err
@@ -0,0 +1,33 @@
+# ------------------
+#       Meropo
+# ------------------
+import numpy as np
+import pytest
+from audio import write_wav
+from features import estimate_tempo, extract_features
+
+FRAME_RATE = 44100 / 1024
+
+
+@pytest.mark.parametrize("frames", [0, 1, 3, 4, 18, 42, 43, 44, 90])
+def test_tempo_of_short_envelopes(frames):
+    bpm, confidence = estimate_tempo(np.random.default_rng(frames).random(frames), FRAME_RATE)
+    assert bpm is None or 60 <= bpm <= 220
+    assert 0.0 <= confidence <= 1.0
+
+
+def test_tempo_of_a_click_track():
+    flux = np.zeros(int(20 * FRAME_RATE))
+    flux[::int(round(FRAME_RATE / 2))] = 1  # a click every half second
+    bpm, confidence = estimate_tempo(flux, FRAME_RATE)
+    assert bpm == pytest.approx(120, rel=0.03) and confidence > 0.5
+
+
+@pytest.mark.parametrize("seconds", [0.01, 0.1, 0.5, 0.99, 1.5, 4])
+def test_extract_features_of_short_clips(tmp_path, seconds):
+    path = str(tmp_path / "clip.wav")
+    samples = np.random.default_rng(0).normal(0, 0.1, (int(44100 * seconds), 2)).astype(np.float32)
+    write_wav(path, samples, 44100)
+    features = extract_features(path)
+    assert features.duration == pytest.approx(seconds, abs=0.01)
+    assert features.sections and features.sections[0].start == 0
@@ -0,0 +1,127 @@
+# ------------------
+#       Meropo
+# ------------------
+import time
+import threading
+import pytest
+from memory import ConversationMemory, SUMMARY_PREFIX, clip_summary, estimate_tokens, truncate_tokens
+
+
+def reply(i: int) -> str:
+    return f"第{i}轮的回答，" + "节奏与和声的分析 " * (i % 7 + 1)
+
+
+def test_estimate_tokens():
+    assert estimate_tokens("") == 0
+    assert estimate_tokens("abcd") == 1
+    assert estimate_tokens("abcde") == 2
+    assert estimate_tokens("你好") == 2
+
+
+@pytest.mark.parametrize("limit", [1, 5, 20, 100])
+def test_truncate_tokens_keeps_the_end_within_the_limit(limit):
+    text = "".join(f"事实{i}; " for i in range(200))
+    clipped = truncate_tokens(text, limit)
+    assert estimate_tokens(clipped) <= limit or clipped == "…"
+    assert text.endswith(clipped.lstrip("…"))
+
+
+def test_truncate_tokens_leaves_short_text():
+    assert truncate_tokens("short", 10) == "short"
+
+
+def test_clip_summary_is_bounded():
+    turns = [("问题" * 100, "回答" * 100)] * 50
+    summary = clip_summary("旧的摘要", turns, max_tokens=64)
+    assert estimate_tokens(summary) <= 64
+    assert summary.endswith(("回答" * 100)[:120][-10:])
+
+
+@pytest.mark.parametrize("max_tokens", [400, 1000, 4000])
+def test_history_never_exceeds_the_budget(max_tokens):
+    # holds whenever the keep_turns latest turns fit next to the summary share
+    memory = ConversationMemory("你是音乐助手。", max_tokens=max_tokens)
+    for i in range(300):
+        memory.add_turn(f"第{i}个问题：这段和弦进行怎么样？", reply(i))
+        assert memory.tokens <= max_tokens
+    assert memory.compactions > 0
+    assert memory.summary["content"].startswith(SUMMARY_PREFIX)
+    assert estimate_tokens(memory.summary_text) <= memory.summary_tokens
+
+
+def test_summary_share_holds_for_a_verbose_summarizer():
+    memory = ConversationMemory("system", max_tokens=400, summarizer=lambda previous, turns, limit: "摘要" * 1000)
+    for i in range(100):
+        memory.add_turn(f"question {i}", reply(i))
+        assert memory.tokens <= 400
+    assert estimate_tokens(memory.summary_text) <= memory.summary_tokens
+
+
+def test_summarizer_is_asked_for_its_share():
+    limits = []
+
+    def summarizer(previous, turns, limit):
+        limits.append(limit)
+        return clip_summary(previous, turns, limit)
+
+    memory = ConversationMemory("system", max_tokens=800, summary_share=0.25, summarizer=summarizer)
+    for i in range(50):
+        memory.add_turn(f"question {i}", reply(i))
+    assert limits and set(limits) == {200}
+
+
+def test_prefix_is_stable_between_compactions():
+    memory = ConversationMemory("system", max_tokens=1000)
+    previous = memory.messages()
+    for i in range(200):
+        compactions = memory.compactions
+        memory.add_turn(f"question {i}", reply(i))
+        messages = memory.messages("next")
+        if memory.compactions == compactions:
+            # the same dict objects, so every request repeats the previous one's bytes
+            assert all(a is b for a, b in zip(previous, messages))
+            assert len(messages) == len(previous) + 3  # the new turn and the query
+        previous = messages[:-1]
+    assert memory.compactions > 1
+
+
+def test_keep_turns_are_never_folded():
+    memory = ConversationMemory("system", max_tokens=300, keep_turns=2)
+    for i in range(40):
+        memory.add_turn(f"question {i}", reply(i))
+    assert [user["content"] for user, _ in memory.turns[-2:]] == ["question 38", "question 39"]
+
+
+def test_clear():
+    memory = ConversationMemory("system", max_tokens=200)
+    for i in range(30):
+        memory.add_turn(f"question {i}", reply(i))
+    memory.clear()
+    assert memory.messages() == [memory.system] and memory.summary is None
+
+
+def test_background_compaction_does_not_block_add_turn():
+    started, release = threading.Event(), threading.Event()
+
+    def slow_summarizer(previous, turns, limit):
+        started.set()
+        release.wait(5)
+        return clip_summary(previous, turns, limit)
+
+    memory = ConversationMemory("system", max_tokens=300, summarizer=slow_summarizer, background=True)
+    i = 0
+    while not started.is_set():
+        memory.add_turn(f"question {i}", reply(i))
+        i += 1
+        assert i < 100
+    turns = len(memory.turns)
+    memory.add_turn("while compacting", "still recorded")  # returns at once
+    assert len(memory.turns) == turns + 1
+    release.set()
+    deadline = time.monotonic() + 5
+    while memory.compactions == 0 or memory._compacting:
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+    assert memory.compactions > 0
+    assert memory.tokens <= memory.max_tokens
+    assert memory.turns[-1][0]["content"] == "while compacting"
@@ -0,0 +1,18 @@
+# ------------------
+#       Meropo
+# ------------------
+import os
+from store import OutputStore
+
+
+def test_export_links_the_stored_file(tmp_path):
+    store = OutputStore(str(tmp_path / "outputs"))
+    source = tmp_path / "render.wav"
+    source.write_bytes(b"RIFF" + bytes(1000))
+    stored = store.add(str(source))
+    desktop = str(tmp_path / "Desktop")
+    first = OutputStore.export(stored, desktop, "Meropo_text2music.wav")
+    second = OutputStore.export(stored, desktop, "Meropo_text2music.wav")
+    assert os.path.basename(first) == "Meropo_text2music.wav"
+    assert os.path.basename(second) == "Meropo_text2music_2.wav"
+    assert os.path.samefile(first, stored) and os.path.samefile(second, stored)  # not written again
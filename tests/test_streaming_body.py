@@ -0,0 +1,93 @@
+# ------------------
+#       Meropo
+# ------------------
+import io
+import json
+import base64
+import pytest
+from api import _Base64File, _StreamingJSONBody
+
+
+def reference(payload):
+    """The body json.dumps would produce with every file inlined as base64 text."""
+    def inline(value):
+        with open(value.path, 'rb') as f:
+            return base64.b64encode(f.read()).decode('ascii')
+    return json.dumps(payload, ensure_ascii=False, default=inline).encode('utf-8')
+
+
+def audio_file(tmp_path, name, size):
+    path = tmp_path / name
+    path.write_bytes(bytes((i * 37 + size) % 256 for i in range(size)))
+    return str(path)
+
+
+def read_exactly(body, n):
+    """Raw reads may stop at a segment boundary, as an HTTP client's would."""
+    parts = []
+    while n > 0:
+        data = body.read(n)
+        if not data:
+            break
+        parts.append(data)
+        n -= len(data)
+    return b"".join(parts)
+
+
+def payload_with(paths):
+    return {"model": "m", "messages": [{"role": "user", "content": [
+        {"type": "text", "text": "品鉴这首歌"},
+        *({"type": "input_audio", "input_audio": {"data": _Base64File(path), "format": "wav"}} for path in paths),
+    ]}], "temperature": 0.7, "stream": True}
+
+
+@pytest.mark.parametrize("sizes", [[0], [1], [2], [3], [1000], [4097, 5], [3 * 4096, 1, 2]])
+@pytest.mark.parametrize("chunk", [1, 7, 4096, 1 << 20])
+def test_matches_json_dumps(tmp_path, sizes, chunk):
+    paths = [audio_file(tmp_path, f"{i}.wav", size) for i, size in enumerate(sizes)]
+    payload = payload_with(paths)
+    expected = reference(payload)
+    body = _StreamingJSONBody(payload)
+    try:
+        assert body.files and len(body.files) == len(paths)
+        assert body.seek(0, io.SEEK_END) == len(expected)
+        body.seek(0)
+        parts = []
+        while True:
+            data = body.read(chunk)
+            if not data:
+                break
+            parts.append(data)
+        assert b"".join(parts) == expected
+    finally:
+        body.close()
+
+
+def test_seek_and_rewind(tmp_path):
+    payload = payload_with([audio_file(tmp_path, "a.wav", 10000)])
+    expected = reference(payload)
+    body = _StreamingJSONBody(payload)
+    try:
+        for offset in (0, 1, 2, 3, 50, 51, 52, 53, len(expected) - 1):
+            body.seek(offset)
+            assert read_exactly(body, 1000) == expected[offset:offset + 1000]
+        body.seek(0)
+        assert read_exactly(body, len(expected) + 10) == expected  # a retry sends the same bytes again
+        assert body.read(10) == b""
+    finally:
+        body.close()
+
+
+def test_without_files():
+    payload = {"messages": [{"role": "user", "content": "你好"}]}
+    body = _StreamingJSONBody(payload)
+    try:
+        assert not body.files
+        assert body.read() == json.dumps(payload, ensure_ascii=False).encode('utf-8')
+    finally:
+        body.close()
+
+
+def test_rejects_other_objects():
+    with pytest.raises(TypeError):
+        _StreamingJSONBody({"value": object()})
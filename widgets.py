@@ -0,0 +1,308 @@
+# ------------------
+#       Meropo
+# ------------------
+import os
+import time
+import sqlite3
+import itertools
+import threading
+import tkinter as tk
+from collections import deque
+from typing import Callable, List, Optional, Tuple
+from cache import CACHE_DIR
+
+_stream_ids = itertools.count()
+_entry_ids = itertools.count()
+
+
+class TextStream:
+    def __init__(self, root: tk.Misc, widget: tk.Text, header: str = "", footer: str = "\n\n",
+                 interval_ms: int = 50, tags: Tuple[str, ...] = (), on_close: Optional[Callable[[str], None]] = None):
+        """
+        Incrementally render text produced on a worker thread into a Text widget.
+
+        write() only appends to a buffer; the Tk main loop drains it at most once per
+        interval_ms with a single insert, so a fast token stream costs a few widget
+        updates per second instead of one per token. The first chunk is flushed
+        immediately, so time-to-first-token is not delayed by the batching. Text goes
+        in front of a mark that stays ahead of the footer, which lets the stream keep
+        its place while other messages are appended after it.
+
+        Must be created on the Tk main thread.
+
+        Args:
+            root: Tk root, used to schedule flushes on the main loop
+            widget: Text widget to render into
+            header: Text inserted before the stream, e.g. "AI: "
+            footer: Text kept after the stream
+            interval_ms: Minimum delay between two flushes
+            tags: Text tags given to everything the stream inserts
+            on_close: Called on the main thread with the complete text (header to footer)
+                once the stream is closed and rendered
+        """
+        self.root = root
+        self.widget = widget
+        self.interval_ms = interval_ms
+        self.tags = tags
+        self.on_close = on_close
+        self._parts = [header]
+        self._footer = footer
+        self.mark = f"meropo_stream_{next(_stream_ids)}"
+        self.started_at = time.perf_counter()
+        self.first_chunk_at: Optional[float] = None
+        self._buffer = []
+        self._scheduled = False
+        self._closed = False
+        self._lock = threading.Lock()
+
+        widget.insert(tk.END, header, tags)
+        widget.mark_set(self.mark, "end-1c")
+        widget.mark_gravity(self.mark, tk.LEFT)  # stay in front of the footer
+        widget.insert(tk.END, footer, tags)
+        widget.mark_gravity(self.mark, tk.RIGHT)
+        widget.see(tk.END)
+
+    @property
+    def time_to_first_chunk(self) -> Optional[float]:
+        """Seconds from creating the stream to the first write, None before it."""
+        if self.first_chunk_at is None:
+            return None
+        return self.first_chunk_at - self.started_at
+
+    def write(self, text: str):
+        """Queue text for rendering; safe to call from any thread."""
+        if not text:
+            return
+        with self._lock:
+            if self.first_chunk_at is None:
+                self.first_chunk_at = time.perf_counter()
+                delay = 0
+            else:
+                delay = self.interval_ms
+            self._buffer.append(text)
+            if self._scheduled or self._closed:
+                return
+            self._scheduled = True
+        self.root.after(delay, self._flush)
+
+    def close(self, text: str = ""):
+        """Render the remaining text (plus an optional final note) and release the mark; any thread."""
+        with self._lock:
+            if text:
+                self._buffer.append(text)
+            self._closed = True
+        self.root.after(0, self._finish)
+
+    def _flush(self):
+        with self._lock:
+            text = "".join(self._buffer)
+            self._buffer.clear()
+            self._scheduled = False
+        if text:
+            self._parts.append(text)
+            self.widget.insert(self.mark, text, self.tags)
+            self.widget.see(self.mark)
+
+    def _finish(self):
+        self._flush()
+        self.widget.mark_unset(self.mark)
+        if self.on_close is not None:
+            self.on_close("".join(self._parts) + self._footer)
+
+
+class LogStore:
+    def __init__(self, path: str = os.path.join(CACHE_DIR, "logs.sqlite3"), keep: int = 5000):
+        """
+        Persistent entries of the GUI's log panes, read back page by page.
+
+        Args:
+            path: SQLite file holding the entries
+            keep: Entries kept per pane; older ones are pruned
+        """
+        self.path = path
+        self.keep = keep
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._db:
+            self._db.execute("PRAGMA journal_mode = WAL")
+            self._db.execute("PRAGMA synchronous = NORMAL")  # an entry lost in a crash is acceptable
+            self._db.execute("CREATE TABLE IF NOT EXISTS log_entries ("
+                             "id INTEGER PRIMARY KEY AUTOINCREMENT, pane TEXT NOT NULL, "
+                             "created_at REAL NOT NULL, text TEXT NOT NULL)")
+            self._db.execute("CREATE INDEX IF NOT EXISTS log_entries_pane ON log_entries (pane, id)")
+
+    def append(self, pane: str, text: str) -> int:
+        """Store an entry and return its id."""
+        with self._lock, self._db:
+            entry_id = self._db.execute("INSERT INTO log_entries (pane, created_at, text) VALUES (?, ?, ?)",
+                                        (pane, time.time(), text)).lastrowid
+            if entry_id % 100 == 0:
+                self._db.execute("DELETE FROM log_entries WHERE pane = ? AND id <= (SELECT id FROM log_entries "
+                                 "WHERE pane = ? ORDER BY id DESC LIMIT 1 OFFSET ?)", (pane, pane, self.keep))
+        return entry_id
+
+    def before(self, pane: str, entry_id: Optional[int], limit: int) -> List[Tuple[int, str]]:
+        """
+        Entries of a pane older than entry_id (all entries if None), newest first.
+
+        Args:
+            pane: Name of the pane
+            entry_id: Id of the oldest entry already shown
+            limit: Maximum number of entries
+
+        Returns:
+            List of (id, text)
+        """
+        with self._lock:
+            if entry_id is None:
+                return self._db.execute("SELECT id, text FROM log_entries WHERE pane = ? ORDER BY id DESC LIMIT ?",
+                                        (pane, limit)).fetchall()
+            return self._db.execute("SELECT id, text FROM log_entries WHERE pane = ? AND id < ? "
+                                    "ORDER BY id DESC LIMIT ?", (pane, entry_id, limit)).fetchall()
+
+    def has_before(self, pane: str, entry_id: Optional[int]) -> bool:
+        return bool(self.before(pane, entry_id, 1))
+
+
+class LogView:
+    OLDER_TAG = "log_older"
+    LATEST_TAG = "log_latest"
+
+    def __init__(self, root: tk.Misc, widget: tk.Text, store: LogStore, pane: str, max_entries: int = 100,
+                 page_size: int = 50):
+        """
+        Ring-buffered view of an append-only log in a Text widget.
+
+        Every entry is written to the LogStore, but the widget only holds the last
+        max_entries of them; older entries are removed as new ones arrive, so inserts
+        and scrolling cost the same however long the session runs. A link at the top
+        pages older entries (also from earlier sessions) back in from the store, which
+        shifts the window instead of growing it; a link at the bottom returns to the
+        latest entries. Use from the Tk main thread.
+
+        Args:
+            root: Tk root
+            widget: Text widget showing the log
+            store: Where entries are kept
+            pane: Name of this log in the store
+            max_entries: Entries held by the widget at most
+            page_size: Entries loaded per click on the "older" link
+        """
+        self.root = root
+        self.widget = widget
+        self.store = store
+        self.pane = pane
+        self.max_entries = max_entries
+        self.page_size = page_size
+        self.entries = deque()  # [tag, store id or None while streaming], oldest first
+        self.following = True  # showing the latest entries, new ones are appended
+        self.has_newer = False
+        widget.tag_configure(self.OLDER_TAG, foreground="#4a7fd4", underline=True)
+        widget.tag_configure(self.LATEST_TAG, foreground="#4a7fd4", underline=True)
+        widget.tag_bind(self.OLDER_TAG, "<Button-1>", lambda event: self.load_older())
+        widget.tag_bind(self.LATEST_TAG, "<Button-1>", lambda event: self.show_latest())
+        self._set_older_link(store.has_before(pane, None))
+
+    @property
+    def streaming(self) -> bool:
+        return any(entry_id is None for _, entry_id in self.entries)
+
+    def _new_tag(self) -> str:
+        return f"log_entry_{next(_entry_ids)}"
+
+    def _set_older_link(self, shown: bool):
+        exists = bool(self.widget.tag_ranges(self.OLDER_TAG))
+        if shown and not exists:
+            self.widget.insert("1.0", "▲ 加载更早的记录\n", (self.OLDER_TAG,))
+        elif not shown and exists:
+            self.widget.delete(f"{self.OLDER_TAG}.first", f"{self.OLDER_TAG}.last")
+
+    def _set_latest_link(self, shown: bool, text: str = "▼ 回到最新记录\n"):
+        if self.widget.tag_ranges(self.LATEST_TAG):
+            self.widget.delete(f"{self.LATEST_TAG}.first", f"{self.LATEST_TAG}.last")
+        if shown:
+            self.widget.insert(tk.END, text, (self.LATEST_TAG,))
+
+    def _remove(self, tag: str):
+        if self.widget.tag_ranges(tag):
+            self.widget.delete(f"{tag}.first", f"{tag}.last")
+        self.widget.tag_delete(tag)
+
+    def _trim_oldest(self):
+        trimmed = False
+        while len(self.entries) > self.max_entries and self.entries[0][1] is not None:
+            self._remove(self.entries.popleft()[0])
+            trimmed = True
+        if trimmed:
+            self._set_older_link(True)
+
+    def append(self, text: str):
+        """Add an entry."""
+        entry_id = self.store.append(self.pane, text)
+        if not self.following:
+            if not self.has_newer:
+                self.has_newer = True
+                self._set_latest_link(True, "▼ 有新的记录，回到最新\n")
+            return
+        tag = self._new_tag()
+        self.widget.insert(tk.END, text, (tag,))
+        self.entries.append([tag, entry_id])
+        self._trim_oldest()
+        self.widget.see(tk.END)
+
+    def stream(self, header: str = "", footer: str = "\n\n", interval_ms: int = 50) -> TextStream:
+        """
+        Add an entry whose text arrives incrementally; it is stored once the stream is closed.
+
+        Returns:
+            TextStream to write the entry through
+        """
+        if not self.following:
+            self.show_latest()
+        tag = self._new_tag()
+        entry = [tag, None]
+        self.entries.append(entry)
+
+        def stored(text: str):
+            entry[1] = self.store.append(self.pane, text)
+            self._trim_oldest()
+
+        return TextStream(self.root, self.widget, header, footer, interval_ms, tags=(tag,), on_close=stored)
+
+    def load_older(self):
+        """Page the previous page_size entries in at the top, dropping as many of the newest."""
+        if self.streaming or not self.entries and not self.widget.tag_ranges(self.OLDER_TAG):
+            return
+        oldest = self.entries[0][1] if self.entries else None
+        rows = self.store.before(self.pane, oldest, self.page_size)
+        top = f"{self.OLDER_TAG}.last" if self.widget.tag_ranges(self.OLDER_TAG) else "1.0"
+        for entry_id, text in rows:  # newest first, each inserted above the previous one
+            tag = self._new_tag()
+            self.widget.insert(top, text, (tag,))
+            self.entries.appendleft([tag, entry_id])
+        self._set_older_link(self.store.has_before(self.pane, self.entries[0][1]) if self.entries else False)
+        dropped = False
+        while len(self.entries) > self.max_entries:
+            self._remove(self.entries.pop()[0])
+            dropped = True
+        if dropped:
+            self.following = False
+            self._set_latest_link(True)
+        self.widget.see("1.0")
+
+    def show_latest(self):
+        """Return to the newest max_entries entries."""
+        for tag, _ in self.entries:
+            self._remove(tag)
+        self.entries.clear()
+        self._set_latest_link(False)
+        self.following = True
+        self.has_newer = False
+        rows = self.store.before(self.pane, None, self.max_entries)
+        for entry_id, text in reversed(rows):
+            tag = self._new_tag()
+            self.widget.insert(tk.END, text, (tag,))
+            self.entries.append([tag, entry_id])
+        self._set_older_link(bool(rows) and self.store.has_before(self.pane, rows[-1][0]))
+        self.widget.see(tk.END)